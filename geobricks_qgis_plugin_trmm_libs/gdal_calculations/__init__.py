@@ -23,6 +23,24 @@ Classes/Objects:
         - Instantiate by passing a path or gdal.Dataset object.
         - Supports gdal.Dataset and numpy.ndarray method and attribute calls.
         - Supports arithmetic operations (i.e ds1 + ds2)
+        - Augmented assignments (i.e ds1 += ds2) update NewDataset/TemporaryDataset
+          objects in place, other datasets get a new TemporaryDataset.
+        - Dataset/Band.window(x_off,y_off,x_size,y_size) and .clip_to_extent(extent)
+          return views, operations on a view only read and write its window.
+        - With Env.tiled==True, the numpy reductions max/mean/min/ptp/std/sum/var
+          (of all values, i.e. no axis) are combined block by block in constant
+          memory, see Dataset/Band.band_statistics. As with numpy, they are NaN
+          if there are NaN values.
+        - shape/ndim/size/dtype come from the metadata, nothing is read.
+    LazyDataset(filepath ,*args)
+        - Subclass of Dataset.
+        - Header metadata (grid, sizes, SRS, nodata) is read from the HeaderCache,
+          the file is only opened by GDAL when pixels are read or GDAL methods
+          are called.
+        - The GDAL handle is borrowed from the HandlePool, so any number of
+          LazyDatasets use at most Env.maxhandles file handles.
+        - A file rewritten since it was opened (modification time/size) is
+          reopened, HandlePool.close_all() closes all the handles.
     Band
         - Returned from Dataset[i] (zero based) or Dataset.GetRasterBand(j) (1 based)
           methods, not instantiated directly.
@@ -35,6 +53,11 @@ Classes/Objects:
         - Subclass of Dataset.
         - Uses VRT functionality to modify datatype.
         - Returned by the type conversion functions, not instantiated directly.
+    WindowedDataset(dataset_or_band, extent)
+        - Subclass of ClippedDataset.
+        - Lightweight alternative to ClippedDataset, reads are offset and padded
+          reads of the parent, no VRT is created unless it is needed.
+        - Used to align the extents of datasets on the same grid.
     TemporaryDataset(cols,rows,bands,datatype,srs='',gt=[],nodata=[])
         - Subclass of Dataset.
         - A temporary raster that only persists until it goes out of scope.
@@ -44,15 +67,78 @@ Classes/Objects:
     WarpedDataset(dataset_or_band, wkt_srs, snap_ds=None, snap_cellsize=None)
         - Subclass of Dataset.
         - Uses VRT functionality to warp Dataset.
+        - The warped VRT is written directly for the output grid, small outputs
+          can be warped in memory instead (see Env.warpinmemory).
     ArrayDataset(array,extent=[],srs='',gt=[],nodata=[], prototype_ds=None)
         - Subclass of TemporaryDataset.
         - Instantiate by passing a numpy ndarray and georeferencing information
           or a prototype Dataset.
+        - The array is used directly by a MEM dataset (no copy) and is copied
+          on the first in-place operation (i.e. ds += 1), so the array passed
+          in is never changed. Arrays GDAL can't address are copied.
+    Statistics(nodata=None, buckets=256)
+        - Running count/sum/min/max/mean/std and histogram of a single band,
+          buckets=0 skips the histogram. NaNs are excluded and counted in `nans`.
+        - Partial statistics are combined with `merge`.
+        - Collected while temporary datasets are written when Env.stats==True
+          and stored in the output (.aux.xml/metadata) by the `save` method.
+    HeaderCache
+        - Header metadata of raster files, keyed by path, modification time and
+          size. Used by LazyDataset, kept across sessions if Env.headercache is set.
+        - This is instantiated on import.
+    HandlePool
+        - Least recently used pool of GDAL handles of LazyDatasets, evicted
+          datasets are reopened when needed.
+        - `hits` and `misses` count the handles reused and (re)opened.
+        - close_all() closes all the handles, calculate_outputs, calculate_window
+          and calculate_batch call it when they are done.
+        - This is instantiated on import.
     DatasetStack(filepaths, band=0)
         - Stack of bands from multiple datasets
         - Similar to gdalbuildvrt -separate etc... functionality, except the class
           can handle rasters with different extents,cellsizes and coordinate systems
           as long as they overlap.
+        - Per pixel reductions across the layers: stack_mean(), stack_median(),
+          stack_percentile(q), stack_std(ddof=0) and stack_count_above(threshold),
+          processed window by window so memory use is bounded by Env.stackmemory.
+    calculate_outputs(expressions, datasets, outfiles, outformat='GTiff', options=[], window=None)
+        - Evaluate several (name, expression) pairs over the same inputs in a single
+          tiled pass, each block of the inputs is read once for all outputs.
+        - With a window (xoff, yoff, xsize, ysize), only that window of the inputs
+          is read and calculated (gdal_calculate --window).
+        - Used by gdal_calculate when more than one --calc is given.
+    calculate_window(expressions, datasets, window=None, extent=None)
+        - Evaluate expressions for a pixel window or map extent only and return
+          numpy arrays, only the window of the inputs is read (e.g. for previews).
+    calculate_batch(expressions, patterns, outfile, outformat='GTiff', options=[], workers=1, window=None)
+        - Run calculate_outputs for every group of files matched by glob patterns
+          with {field} templates, e.g. "3B42.{date}.*.7.tif" groups TRMM layers by
+          day, in one process or a pool of worker processes.
+        - Variables matching several files are DatasetStacks.
+        - Used by gdal_calculate --batch.
+    compile_expression(expr)
+        - Parse, validate and compile an expression once, returns a cached
+          Expression object by expression string.
+        - Expression.ops is the number of operations (for progress), calling the
+          Expression evaluates it with numpy, Expression.evaluate_numexpr with
+          numexpr (compiled once per input data types).
+        - Private attributes and statements are not allowed, numpy/np only gives
+          access to its ufuncs and scalar types, other attributes are limited to
+          ndarray reductions/astype and the read only Dataset/Band methods (no
+          tofile, save, GetDriver...) and builtins are not available.
+    Tracer
+        - Records spans (time, bytes and pixels) of apply_environment, block
+          reads/writes, numpy operations, temporary dataset creation and saves
+          when Env.trace==True.
+        - Tracer.export_chrome(filepath) writes Chrome trace JSON (chrome://tracing),
+          Tracer.summary()/summary_table() aggregate the spans by name.
+        - This is instantiated on import.
+    Progress(operations=0, sinks=[term_sink], interval=0.25)
+        - Env.progress, tracks work in pixels (or bytes, files...) with a smoothed
+          throughput and ETA, `update_progress(units)` adds the work done.
+        - Sinks are callables f(fraction, rate, eta), called at most every
+          `interval` seconds: term_sink (GDAL terminal meter), LogSink(logger)
+          or e.g. a function emitting a Qt signal. format_progress formats them.
     Env - Object for setting various environment properties.
         - This is instantiated on import.
         - The following properties are supported:
@@ -65,9 +151,23 @@ Classes/Objects:
             extent
               - one of "MINOF", "INTERSECT", "MAXOF", "UNION", [xmin,ymin,xmax,ymax]
               - Default = "MINOF"
+            headercache
+              - path of a JSON file where the HeaderCache keeps raster headers
+                between sessions
+              - Default = None (headers are only cached in memory)
+            maxhandles
+              - maximum number of GDAL handles kept open by the HandlePool, also
+                used as GDAL_MAX_DATASET_POOL_SIZE for DatasetStack VRTs
+                (unless that is already set)
+              - 0 means no limit
+              - Default = 256
             nodata
               - handle nodata using masked arrays - True/False
               - Default = False
+            nthreads
+              - number of threads processing blocks in Dataset/Band.band_statistics
+                and tiled reductions (i.e. ds.sum(), ds.std())
+              - Default = 1
             ntiles
               - number of tiles to process at a time
               - Default = 1
@@ -84,10 +184,18 @@ Classes/Objects:
             snap
               - a gdal_calculations.Dataset/Band object
               - Default = None
+            stackmemory
+              - maximum memory (bytes) for the layers of a DatasetStack window
+                read by the stack_* reductions
+              - Default = 256MB
             srs
               - the output spatial reference system
               - one of osgeo.osr.SpatialReference (object)|WKT (string)|EPSG code (integer)
               - Default = None
+            stats
+              - collect band statistics and histograms while writing temporary
+                datasets and store them with saved outputs - True/False
+              - Default = False
             tempdir
               - temporary working directory
               - Default = tempfile.tempdir
@@ -97,6 +205,13 @@ Classes/Objects:
             tiled
               - use tiled processing - True/False
               - Default = True
+            trace
+              - record Tracer spans of the raster operations - True/False
+              - Default = False
+            warpinmemory
+              - maximum size (cols*rows*bands) of a WarpedDataset that is warped
+                in memory with gdal.Warp (GDAL>=2.1) instead of a warped VRT
+              - Default = 0 (always use a warped VRT)
     Byte, UInt16, Int16, UInt32, Int32, Float32, Float64
         - Type conversions functions
         - Returns a ConvertedDataset object
@@ -202,11 +317,29 @@ __version__='1.1'
 from gdal_dataset import *
 from conversions import *
 from environment import *
+from stats import *
+from caching import *
+from evaluation import *
+from batch import *
+from expressions import *
+from tracing import *
 
 from gdal_dataset import __all__ as __dall__
 from conversions import __all__ as __call__
 from environment import __all__ as __eall__
+from stats import __all__ as __sall__
+from caching import __all__ as __hall__
+from evaluation import __all__ as __vall__
+from batch import __all__ as __ball__
+from expressions import __all__ as __xall__
+from tracing import __all__ as __tall__
 __all__=[]
 __all__.extend(__dall__)
 __all__.extend(__call__)
 __all__.extend(__eall__)
+__all__.extend(__sall__)
+__all__.extend(__hall__)
+__all__.extend(__vall__)
+__all__.extend(__ball__)
+__all__.extend(__xall__)
+__all__.extend(__tall__)
@@ -0,0 +1,173 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: batch.py
+Purpose: Run the same calculation over groups of rasters matched by file patterns
+
+Notes: - see __init__.py
+'''
+__all__ = [ "calculate_batch", "find_groups"]
+
+import glob, re, sys
+
+from caching import HandlePool
+from environment import Env, Progress
+from gdal_dataset import Dataset, DatasetStack
+from evaluation import calculate_outputs
+
+#Settings passed to worker processes, Env.snap is passed as a filepath and
+#Env.srs as WKT. Env.progress and Env.trace are per process.
+ENV_SETTINGS=['cellsize','enable_numexpr','extent','headercache','maxhandles',
+              'nodata','nthreads','ntiles','overwrite','reproject','resampling',
+              'stackmemory','stats','tempdir','tempoptions','tiled','warpinmemory']
+
+def find_groups(patterns):
+    ''' Group the files matched by glob patterns with {field} templates.
+
+        Each {field} matches any part of a filename, e.g. "3B42.{date}.*.7.tif"
+        groups the 3-hourly TRMM layers by day. A group is made for each
+        combination of field values found for all the patterns with fields
+        (they must use the same fields), patterns without fields (e.g. a mask)
+        are used in every group.
+
+        @type patterns:  C{[(str,str),...]}
+        @param patterns: (variable, pattern) pairs
+        @rtype:          C{[(dict,dict),...]}
+        @return:         sorted (fields, [(variable,[filepaths]),...]) pairs,
+                         variables in the order of the patterns
+    '''
+    matched={}
+    static={}
+    keys=None
+    for var,pattern in patterns:
+        fields=re.findall(r'{(\w+)}',pattern)
+        files=sorted(glob.glob(re.sub(r'{\w+}','*',pattern)))
+        if not fields:
+            if not files:raise RuntimeError('No files match %s'%pattern)
+            static[var]=files
+            continue
+        regex=template_regex(pattern)
+        matched[var]={}
+        for f in files:
+            match=regex.match(f)
+            if match:
+                key=tuple(sorted(match.groupdict().items()))
+                matched[var].setdefault(key,[]).append(f)
+        if keys is None:keys=set(matched[var])
+        else:keys&=set(matched[var])
+
+    if keys is None:raise RuntimeError('No {field} templates in the batch patterns')
+    groups=[]
+    for key in sorted(keys):
+        paths=[]
+        for var,pattern in patterns:
+            if var in static:paths.append((var,static[var]))
+            else:paths.append((var,matched[var][key]))
+        groups.append((dict(key),paths))
+    return groups
+
+def template_regex(pattern):
+    ''' Convert a glob pattern with {field} templates to a regular expression'''
+    regex=[]
+    for part in re.split(r'({\w+}|\*|\?)',pattern):
+        if part=='*':regex.append(r'[^/\\]*')
+        elif part=='?':regex.append(r'[^/\\]')
+        elif re.match(r'^{\w+}$',part):
+            name=part[1:-1]
+            if '(?P<%s>'%name in ''.join(regex):regex.append('(?P=%s)'%name)
+            else:regex.append(r'(?P<%s>[^/\\]+?)'%name)
+        else:regex.append(re.escape(part))
+    return re.compile(''.join(regex)+'$')
+
+def calculate_batch(expressions, patterns, outfile, outformat='GTiff', options=[], workers=1, window=None):
+    ''' Evaluate expressions for every group of files found by find_groups,
+        in this process or in a pool of worker processes.
+
+        Variables that match a single file are Datasets, variables that match
+        several files are DatasetStacks, i.e. (layers, rows, cols) arrays in
+        the expressions, e.g. "a.sum(axis=0)" for the daily total of the
+        3-hourly layers. See calculate_outputs.
+
+        @type expressions:  C{[(str,str),...]}
+        @param expressions: (name, expression) pairs
+        @type patterns:     C{[(str,str),...]}
+        @param patterns:    (variable, pattern) pairs
+        @type outfile:      C{str}
+        @param outfile:     output filepath template with the {field}s of the
+                            patterns and {name} for more than one expression,
+                            e.g. "trmm_{date}_{name}.tif"
+        @type workers:      C{int}
+        @param workers:     number of worker processes, 1 runs in this process
+        @type window:       C{[int,int,int,int]}
+        @param window:      only calculate this pixel window of each group,
+                            see calculate_outputs
+        @rtype:             C{[(dict,dict|Exception),...]}
+        @return:            fields and the {name:filepath} outputs of each group,
+                            or the exception raised while processing it
+    '''
+    groups=find_groups(patterns)
+    names=[name for name,expr in expressions]
+    jobs=[]
+    for fields,paths in groups:
+        outfiles={}
+        for name in names:
+            values=dict(fields)
+            values['name']=name
+            try:outfiles[name]=outfile.format(**values)
+            except KeyError, e:raise RuntimeError('Unknown field %s in the output template'%e)
+        jobs.append((expressions,paths,outfiles,outformat,options,window))
+    if len(set([f for j in jobs for f in j[2].values()]))<len(jobs)*len(names):
+        raise RuntimeError('The output template must contain the pattern fields and {name} for multiple calculations')
+
+    progress,Env.progress=Env.progress,Progress()
+    if progress.enabled:progress.reset(len(jobs))
+    results=[]
+    try:
+        if workers>1 and len(jobs)>1:
+            import multiprocessing
+            pool=multiprocessing.Pool(workers,initializer=apply_settings,initargs=(env_settings(),))
+            try:
+                for r in pool.imap(calculate_group,jobs):
+                    results.append(r)
+                    progress.update_progress()
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                results.append(calculate_group(job))
+                progress.update_progress()
+    finally:
+        Env.progress=progress
+        HandlePool.close_all()
+    return [(fields,r) for (fields,paths),r in zip(groups,results)]
+
+def calculate_group(job):
+    ''' Evaluate the expressions for a group, exceptions are returned so a
+        failed group doesn't stop the batch'''
+    expressions,paths,outfiles,outformat,options,window=job
+    try:
+        datasets=[]
+        for var,files in paths:
+            if len(files)==1:datasets.append((var,Dataset(files[0])))
+            else:datasets.append((var,DatasetStack(files)))
+        calculate_outputs(expressions,datasets,outfiles,outformat,options,window)
+        return outfiles
+    except Exception, e:
+        return e
+
+def env_settings():
+    ''' Env settings for worker processes'''
+    settings=dict([(name,getattr(Env,name)) for name in ENV_SETTINGS])
+    if Env.snap is not None:settings['snap']=Env.snap.GetDescription()
+    if Env.srs is not None:settings['srs']=Env.srs.ExportToWkt()
+    return settings
+
+def apply_settings(settings):
+    ''' Apply the Env settings of the parent process in a worker process'''
+    settings=dict(settings)
+    if 'srs' in settings:Env.srs=settings.pop('srs') #before Env.reproject, it sets it
+    for name,value in settings.items():
+        if value is None:continue #not set in the parent process
+        if name=='snap':value=Dataset(value)
+        setattr(Env,name,value)
+    Env.progress=Progress()
@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: caching.py
+Purpose: Raster header metadata cache and GDAL handle pool for lazily
+         opened datasets
+
+Notes: - see __init__.py
+'''
+__all__ = [ "HeaderCache", "HandlePool"]
+
+import os, json, atexit
+from collections import OrderedDict
+from osgeo import gdal
+
+from environment import Env
+
+class HeaderCache(object):
+    ''' Header metadata (grid, sizes, SRS, block size, nodata) of raster files.
+
+        Headers are read once per path and modification time/size and kept in
+        memory. If Env.headercache is set to a file path, they are also kept in
+        that JSON index, so later sessions don't need to open the files at all.
+        `hits` and `misses` count the headers served from the cache and the
+        files read.
+    '''
+    def __init__(self):
+        self._headers={}
+        self._index=None #Path of the loaded sidecar index
+        self._dirty=False
+        self.hits=0
+        self.misses=0
+
+    def get(self,filepath):
+        ''' Return the header of a raster file as a dict'''
+        try:
+            st=os.stat(filepath)
+            key=[st.st_mtime,st.st_size]
+        except OSError: #Not a file, e.g. /vsimem, don't cache
+            return self.read(filepath)
+
+        self.__load__()
+        try:
+            cached=self._headers[filepath]
+            if cached['key']==key and 'data_types' in cached['header']: #else cached by an older version
+                self.hits+=1
+                return cached['header']
+        except KeyError:pass
+
+        self.misses+=1
+        header=self.read(filepath)
+        self._headers[filepath]={'key':key,'header':header}
+        self._dirty=True
+        return header
+
+    def read(self,filepath):
+        ''' Read the header of a raster file'''
+        ds=gdal.Open(filepath)
+        rb=ds.GetRasterBand(1)
+        header={'gt':list(ds.GetGeoTransform()),
+                'x_size':ds.RasterXSize,
+                'y_size':ds.RasterYSize,
+                'nbands':ds.RasterCount,
+                'data_type':rb.DataType,
+                'data_types':[ds.GetRasterBand(i+1).DataType for i in range(ds.RasterCount)],
+                'srs':ds.GetProjectionRef(),
+                'block_size':list(rb.GetBlockSize()),
+                'nodata':[ds.GetRasterBand(i+1).GetNoDataValue() for i in range(ds.RasterCount)]}
+        ds=None
+        return header
+
+    def clear(self):
+        self._headers={}
+        self._index=None
+        self._dirty=False
+        self.hits=0
+        self.misses=0
+
+    def save(self):
+        ''' Write the headers to the Env.headercache index, if it is set'''
+        if not Env.headercache or not self._dirty:return
+        with open(Env.headercache,'w') as f:
+            json.dump(self._headers,f)
+        self._index=Env.headercache
+        self._dirty=False
+
+    def __load__(self):
+        if not Env.headercache or self._index==Env.headercache:return
+        self._index=Env.headercache
+        try:
+            with open(Env.headercache) as f:headers=json.load(f)
+        except (IOError,ValueError):return
+        headers.update(self._headers)
+        self._headers=headers
+
+HeaderCache=HeaderCache()
+atexit.register(HeaderCache.save)
+
+class HandlePool(object):
+    ''' Least recently used pool of the GDAL handles of LazyDatasets.
+
+        At most Env.maxhandles files are kept open, the least recently used
+        handle is closed when another file is opened and is transparently
+        reopened the next time it is needed. As in the HeaderCache, handles are
+        only reused while the modification time/size of the file are the same,
+        a rewritten file is reopened. The pool holds the only reference to the
+        handles (LazyDataset Bands borrow them too), so dropping a handle
+        closes the file. `hits` and `misses` count the requests served from
+        the pool and the files (re)opened.
+    '''
+    def __init__(self):
+        self._handles=OrderedDict()
+        self.hits=0
+        self.misses=0
+
+    def open(self,filepath,*args):
+        ''' Return an open gdal.Dataset for filepath (and gdal.Open args)'''
+        key=(filepath,)+args
+        try:
+            st=os.stat(filepath)
+            stamp=[st.st_mtime,st.st_size]
+        except OSError: #Not a file, e.g. /vsimem
+            stamp=None
+        try:
+            cached,ds=self._handles.pop(key)
+            if cached!=stamp:raise KeyError(key) #Rewritten since it was opened
+            self.hits+=1
+        except KeyError:
+            ds=None #Close the outdated handle first
+            ds=gdal.Open(filepath,*args)
+            self.misses+=1
+        self._handles[key]=(stamp,ds)
+        while Env.maxhandles and len(self._handles)>Env.maxhandles:
+            self._handles.popitem(last=False)
+        return ds
+
+    def close(self,filepath,*args):
+        ''' Close the handle of filepath, if it is open'''
+        self._handles.pop((filepath,)+args,None)
+
+    def close_all(self):
+        ''' Close all handles, e.g. at the end of a calculation'''
+        self._handles=OrderedDict()
+
+    def clear(self):
+        ''' Close all handles and reset the counters'''
+        self.close_all()
+        self.hits=0
+        self.misses=0
+
+    def __len__(self):
+        return len(self._handles)
+
+HandlePool=HandlePool()
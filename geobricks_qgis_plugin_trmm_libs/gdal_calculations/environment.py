@@ -26,9 +26,9 @@ Author: Luke Pinner
 # THE SOFTWARE.
 #
 #-------------------------------------------------------------------------------
-__all__ = [ "Env", "Progress"]
+__all__ = [ "Env", "Progress", "LogSink", "term_sink", "format_progress"]
 
-import sys,os,tempfile
+import sys,os,tempfile,time,logging
 import numpy as np
 from osgeo import gdal, osr
 
@@ -40,13 +40,20 @@ class Env(object):
 
     #Properties
     enable_numexpr=False
+    headercache=None
+    maxhandles=256
     nodata=False
+    nthreads=1
     ntiles=1
     overwrite=False
     progress=False
     reproject=False
+    stackmemory=256*1024**2
+    stats=False
     tiled=True
     tempoptions=['BIGTIFF=IF_SAFER']
+    trace=False
+    warpinmemory=0
 
     @property
     def cellsize(self):
@@ -179,7 +186,10 @@ class Env(object):
 
     @tempdir.setter
     def tempdir(self, value):
-        if value.lower()=='/vsimem':
+        if value is None:
+            #Back to the default, e.g. when restoring a tempdir that wasn't set
+            self._tempdir=tempfile.tempdir
+        elif value.lower()=='/vsimem':
             self._tempdir=value
         elif not os.path.isdir(value):
             raise RuntimeError('%s is not a directory'%value)
@@ -190,21 +200,93 @@ class Env(object):
 Env=Env()
 
 class Progress(object):
-    def __init__(self,operations=0):
-        self.steps = 1 #n. steps per operation
+    ''' Progress of a calculation in work units (pixels, bytes, files...)
+
+        The total is operations*steps, update_progress(units) adds the work done.
+        Throughput is smoothed with an exponential moving average and used for
+        the ETA. Sinks are called with (fraction, rate, eta) at most once per
+        `interval` seconds and on completion, so updates from block loops are cheap.
+    '''
+    def __init__(self,operations=0,sinks=None,interval=0.25,smoothing=0.3):
+        self.steps = 1 #n. work units per operation
         self.operations=float(operations)
         self.progress=0
         self.enabled=operations>0
-        if self.enabled:
-            gdal.TermProgress_nocb(0)
+        if sinks is None:sinks=[term_sink]
+        self.sinks=sinks
+        self.interval=interval   #seconds between sink updates
+        self.smoothing=smoothing #weight of the latest throughput
+        self.rate=None #work units/second
+        self.eta=None  #seconds
+        self._last=time.time() #of the last throughput measurement
+        self._last_progress=0
+        self._last_callback=self._last
+        self._done=False
+        if self.enabled:self.notify(0)
 
     def reset(self,operations=0):
-        self.__init__(operations)
+        self.__init__(operations,self.sinks,self.interval,self.smoothing)
 
-    def update_progress(self):
+    @property
+    def fraction(self):
+        total=self.operations*self.steps
+        if total<=0:return 0.0
+        return min(self.progress/total,1.0)
+
+    def update_progress(self,units=1.0):
         if self.enabled:
-            self.progress+=1.0
-            gdal.TermProgress_nocb(self.progress/(self.operations*self.steps))
+            self.progress+=units
+            now=time.time()
+            fraction=self.fraction
+            if fraction>=1.0 and not self._done or now-self._last>=self.interval:
+                self.measure(now)
+                self.notify(fraction)
+
+    def measure(self,now):
+        ''' Update the smoothed throughput and the ETA'''
+        elapsed=now-self._last
+        if elapsed>0:
+            rate=(self.progress-self._last_progress)/elapsed
+            if self.rate is None:self.rate=rate
+            else:self.rate=self.smoothing*rate+(1-self.smoothing)*self.rate
+        if self.rate:self.eta=(self.operations*self.steps-self.progress)/self.rate
+        self._last,self._last_progress=now,self.progress
+
+    def notify(self,fraction):
+        if self._done:return
+        if fraction>=1.0:self._done=True
+        for sink in self.sinks:sink(fraction,self.rate,self.eta)
+
+    def callback(self,complete,message=None,data=None):
+        ''' GDAL progress callback (e.g. CreateCopy), rate limited like update_progress'''
+        now=time.time()
+        if complete>=1.0 or now-self._last_callback>=self.interval:
+            self._last_callback=now
+            for sink in self.sinks:sink(complete,None,None)
+        return 1
+
+def format_progress(fraction,rate=None,eta=None):
+    ''' Progress as text, e.g. "42% 1.3e+06/s ETA 0:00:12"'''
+    text='%d%%'%(fraction*100)
+    if rate:text+=' %.3g/s'%rate
+    if eta is not None:
+        minutes,seconds=divmod(int(max(eta,0)),60)
+        text+=' ETA %d:%02d:%02d'%(minutes//60,minutes%60,seconds)
+    return text
+
+def term_sink(fraction,rate=None,eta=None):
+    ''' Progress sink for the GDAL terminal progress meter'''
+    gdal.TermProgress_nocb(fraction)
+
+class LogSink(object):
+    ''' Progress sink writing to a logging.Logger'''
+    def __init__(self,logger='gdal_calculations',level=logging.INFO):
+        if not isinstance(logger,logging.Logger):logger=logging.getLogger(logger)
+        self.logger=logger
+        self.level=level
+
+    def __call__(self,fraction,rate=None,eta=None):
+        self.logger.log(self.level,format_progress(fraction,rate,eta))
 
 Env.progress=Progress()
 
@@ -0,0 +1,185 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: evaluation.py
+Purpose: Evaluate several expressions over the same rasters in a single tiled pass
+
+Notes: - see __init__.py
+'''
+__all__ = [ "calculate_outputs", "calculate_window"]
+
+import os
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from caching import HandlePool
+from environment import Env
+from expressions import NAMESPACE, compile_expression
+from gdal_dataset import Block, Dataset, NewDataset, TemporaryDataset, traced
+
+def calculate_outputs(expressions, datasets, outfiles, outformat='GTiff', options=[], window=None):
+    ''' Evaluate several expressions block by block, reading each block of the
+        inputs once for all of them.
+
+        Expressions use numpy syntax (numpy is available as `numpy` and `np`,
+        as are the functions numexpr supports, e.g. `where` and `sqrt`), the variables are numpy arrays of the blocks of the inputs, with shape
+        (bands, rows, cols), so band numbers are specified using square
+        brackets (zero based indexing) as with Dataset objects.
+
+        @type expressions:  C{[(str,str),...]}
+        @param expressions: (name, expression) pairs
+        @type datasets:     C{[(str,Dataset),...]}
+        @param datasets:    (variable, Dataset/Band) pairs, the extent/cellsize/
+                            coordinate system of the outputs are those of the
+                            first one after the environment settings are applied
+        @type outfiles:     C{dict}
+        @param outfiles:    name: output filepath
+        @type window:       C{[int,int,int,int]}
+        @param window:      only calculate this x_off, y_off, x_size, y_size
+                            pixel window, see align
+        @rtype:             C{dict}
+        @return:            name: Dataset of the saved outputs
+    '''
+    if not expressions:raise RuntimeError('No expressions to calculate')
+    if not datasets:raise RuntimeError('No input datasets')
+    for name,expr in expressions:
+        path=outfiles[name]
+        if os.path.exists(path) and not Env.overwrite:
+            raise RuntimeError('Output %s exists and overwrite is not set.'%path)
+    codes=[]
+    names=[var for var,ds in datasets]+NAMESPACE.keys()
+    for name,expr in expressions:
+        expression=compile_expression(expr)
+        expression.validate(names)
+        codes.append((name,expression))
+    #numexpr can't handle masked arrays
+    use_numexpr=Env.enable_numexpr and not Env.nodata
+    try:
+        variables=align(datasets,window)
+        reference=variables[0][1]
+
+        Env.progress.steps = reference._x_size*reference._y_size
+        if Env.tiled:reader=reference.ReadBlocksAsArray()
+        else: reader=[Block(reference,0, 0,reference._x_size, reference._y_size)]
+
+        nodata=reference._nodata[0]
+        outputs={}
+        for b in reader:
+            for name,data in evaluate_block(codes,variables,b,use_numexpr):
+                if name not in outputs:
+                    outputs[name]=create_output(outfiles[name],outformat,options,data,reference,nodata)
+                outputs[name].write_data(data, b.x_off, b.y_off)
+            Env.progress.update_progress(b.x_size*b.y_size)
+
+        results={}
+        for name,expr in expressions:
+            results[name]=save_output(outputs.pop(name),outfiles[name],outformat,options)
+    finally:HandlePool.close_all()
+    return results
+
+def calculate_window(expressions, datasets, window=None, extent=None):
+    ''' Evaluate expressions for a pixel window or map extent only, reading
+        just that window of the inputs, e.g. for previews or an area of interest.
+
+        @type expressions:  C{[(str,str),...]}
+        @param expressions: (name, expression) pairs, see calculate_outputs
+        @type datasets:     C{[(str,Dataset),...]}
+        @param datasets:    (variable, Dataset/Band) pairs
+        @type window:       C{[int,int,int,int]}
+        @param window:      x_off, y_off, x_size, y_size in pixels of the first
+                            dataset after the environment settings are applied
+        @type extent:       C{[float,float,float,float]}
+        @param extent:      xmin, ymin, xmax, ymax, if window is not given
+        @rtype:             C{(dict,tuple)}
+        @return:            name: ndarray of the window, and the geotransform of the window
+    '''
+    if window is None and extent is None:raise RuntimeError('A window or an extent is required')
+    names=[var for var,ds in datasets]+NAMESPACE.keys()
+    codes=[]
+    for name,expr in expressions:
+        expression=compile_expression(expr)
+        expression.validate(names)
+        codes.append((name,expression))
+
+    try:
+        variables=align(datasets)
+        reference=variables[0][1]
+        if window is not None:reference=reference.window(*window)
+        else:reference=reference.clip_to_extent(extent)
+        #Same window of all the inputs, they are aligned to the reference
+        variables=[(var,ds.clip_to_extent(reference.extent)) for var,ds in variables]
+        reference=variables[0][1]
+
+        b=Block(reference,0,0,reference._x_size,reference._y_size)
+        results=dict(evaluate_block(codes,variables,b,Env.enable_numexpr and not Env.nodata))
+    finally:HandlePool.close_all()
+    return results,reference._gt
+
+def evaluate_block(codes, variables, b, use_numexpr=False):
+    ''' Evaluate the expressions on a block of the first dataset, reading the
+        same block of the other datasets'''
+    reference=variables[0][1]
+    nodata=reference._nodata[0]
+    namespace={}
+    for var,ds in variables:
+        if ds is reference:data=b.data
+        else:data=ds.ReadAsArray(b.x_off, b.y_off, b.x_size, b.y_size)
+        if data.ndim==2:data=data[np.newaxis,:,:]
+        if Env.nodata:
+            mask=np.array([data[i,:,:]==ds._nodata[i] for i in range(data.shape[0])])
+            data=np.ma.MaskedArray(data,mask)
+            data.fill_value=nodata
+        namespace[var]=data
+
+    for name,expression in codes:
+        if use_numexpr and expression.numexpr:data=traced('op',expression.evaluate_numexpr)(namespace)
+        else:data=np.asanyarray(traced('op',expression)(namespace))
+        if data.ndim==3 and data.shape[0]==1:data=data[0]
+        if data.shape[-2:]!=(b.y_size,b.x_size):
+            raise RuntimeError('Expression "%s" does not return an array with the dimensions of the inputs'%name)
+        if data.dtype==np.bool:data=data.astype(np.uint8)
+        if isinstance(data,np.ma.MaskedArray):
+            data=data.filled(nodata if nodata is not None else 0)
+        yield name,data
+
+def align(datasets,window=None):
+    ''' Apply the environment settings to all datasets against the first one.
+        If a x_off, y_off, x_size, y_size window (in pixels of the first dataset
+        after the environment settings are applied) is given, the datasets are
+        views of that window, so only the window is read.'''
+    reference=datasets[0][1]
+    for var,ds in datasets[1:]:
+        reference,ds=reference.apply_environment(ds)
+    aligned=[(datasets[0][0],reference)]
+    for var,ds in datasets[1:]:
+        ref,ds=reference.apply_environment(ds)
+        aligned.append((var,ds))
+    if window is not None:aligned=[(var,ds.window(*window)) for var,ds in aligned]
+    return aligned
+
+def create_output(outfile,outformat,options,data,reference,nodata):
+    ''' Create the output directly if the driver supports it, else a temporary
+        dataset that is copied when complete'''
+    datatype=gdal_array.NumericTypeCodeToGDALTypeCode(data.dtype.type)
+    if not datatype:datatype=gdal.GDT_Byte
+    if data.ndim==2:nbands=1
+    else:nbands=data.shape[0]
+    if Env.nodata:nodata=[nodata]*nbands
+    else:nodata=reference._nodata[:1]*nbands
+
+    driver=gdal.GetDriverByName(outformat)
+    if driver is None:raise RuntimeError('Unknown output format %s'%outformat)
+    if driver.GetMetadataItem(gdal.DCAP_CREATE)=='YES':
+        if os.path.exists(outfile):driver.Delete(outfile)
+        return NewDataset(outfile,outformat,reference._x_size,reference._y_size,nbands,
+                          datatype,reference._srs,reference._gt,nodata,options)
+    return TemporaryDataset(reference._x_size,reference._y_size,nbands,
+                            datatype,reference._srs,reference._gt,nodata)
+
+def save_output(output,outfile,outformat,options):
+    ''' Close a complete output and return it as a Dataset'''
+    if isinstance(output,TemporaryDataset):
+        return output.save(outfile,outformat,options)
+    output.__write_statistics__(output._dataset)
+    output.FlushCache()
+    output=None #close it so it's complete on disk
+    return Dataset(outfile)
@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: expressions.py
+Purpose: Parse, validate and cache calculation expressions
+
+Notes: - see __init__.py
+'''
+__all__ = [ "Expression", "compile_expression"]
+
+import ast
+import numpy as np
+
+#AST nodes allowed in an expression, anything else (lambda, comprehensions,
+#yield etc...) is rejected
+NODES=['Expression','BinOp','UnaryOp','BoolOp','Compare','Call','IfExp',
+       'Name','Attribute','Subscript','Index','Slice','ExtSlice','Ellipsis',
+       'Num','Str','Bytes','NameConstant','Constant','Tuple','List','keyword',
+       'Load','operator','unaryop','boolop','cmpop']
+NODES=tuple([getattr(ast,n) for n in NODES if hasattr(ast,n)])
+
+#Nodes that each run one pass over the rasters
+OPERATIONS=(ast.BinOp,ast.UnaryOp,ast.Compare,ast.Call)
+
+#Functions that numexpr can evaluate
+NUMEXPR_FUNCTIONS=['abs','arccos','arccosh','arcsin','arcsinh','arctan','arctan2',
+                   'arctanh','ceil','conj','cos','cosh','exp','expm1','floor',
+                   'imag','log','log10','log1p','real','sin','sinh','sqrt','tan',
+                   'tanh','where']
+
+#Names available to expressions evaluated with numpy, numexpr functions are
+#included so an expression gives the same result with or without numexpr
+NAMESPACE=dict([(f,getattr(np,f)) for f in NUMEXPR_FUNCTIONS if hasattr(np,f)])
+NAMESPACE.update({'numpy':np,'np':np})
+
+#numpy attributes allowed in expressions (i.e. numpy.maximum, np.float32),
+#ufuncs and scalar types only so numpy.load, numpy.lib etc... can't be reached
+NUMPY_ATTRIBUTES=set(NUMEXPR_FUNCTIONS)
+for name in dir(np):
+    attr=getattr(np,name)
+    if isinstance(attr,np.ufunc) or (isinstance(attr,type) and issubclass(attr,np.generic)):
+        NUMPY_ATTRIBUTES.add(name)
+del name,attr
+
+#Attributes allowed on anything else, i.e. the variables and results: ndarray
+#(and masked array) reductions and conversions, and the read only Dataset/Band
+#API. Methods writing or deleting files (ndarray.tofile/dump, Dataset.save,
+#GDALDataset.GetDriver().Delete...) are not in the list
+ARRAY_ATTRIBUTES=['all','any','argmax','argmin','astype','clip','conj','copy',
+                  'count','cumprod','cumsum','dtype','filled','imag','mask','max',
+                  'mean','min','ndim','prod','ptp','real','reshape','round','shape',
+                  'size','squeeze','std','sum','T','transpose','var']
+RASTER_ATTRIBUTES=['band_statistics','BandStatistics','clip_to_extent','ClipToExtent',
+                   'extent','get_raster_band','GetRasterBand','ReadAsArray',
+                   'window','Window']
+ATTRIBUTES=set(ARRAY_ATTRIBUTES+RASTER_ATTRIBUTES)
+
+#Expressions already parsed, by expression string
+_cache={}
+
+def _numpy_import(name,*args,**kwargs):
+    ''' The only builtin of evaluated expressions, numpy imports some of its
+        own modules lazily (e.g. numpy.core._methods in ndarray.sum)'''
+    if name!='numpy' and not name.startswith('numpy.'):
+        raise ImportError('Import of %s is not allowed in expressions'%name)
+    return __import__(name,*args,**kwargs)
+
+def compile_expression(expr):
+    ''' Return the (cached) Expression object of an expression string'''
+    try:return _cache[expr]
+    except KeyError:
+        _cache[expr]=Expression(expr)
+        return _cache[expr]
+
+class Expression(object):
+    ''' An expression parsed and compiled once.
+
+        Private attributes (starting with "_") and statements are not allowed,
+        numpy/np may only be used for its ufuncs and scalar types (i.e.
+        numpy.maximum(a,b), a.astype(np.float32)) and other attributes must be
+        in ATTRIBUTES (i.e. a.sum(), ds.GetRasterBand(2)). Names are checked
+        against the variables when validate is called. Expressions are
+        evaluated without builtins.
+    '''
+    def __init__(self,expr):
+        self.expr=expr.strip()
+        tree=ast.parse(self.expr,mode='eval')
+        self.names=set()
+        self.ops=0
+        self.numexpr=True #Can numexpr evaluate it?
+        modules=set() #numpy Name nodes used as numpy.<attribute>
+        for node in ast.walk(tree):
+            if not isinstance(node,NODES):
+                raise RuntimeError('%s is not allowed in expression "%s"'%(type(node).__name__,self.expr))
+            if isinstance(node,ast.Attribute):
+                if node.attr.startswith('_'):
+                    raise RuntimeError('Private attribute %s is not allowed in expression "%s"'%(node.attr,self.expr))
+                if isinstance(node.value,ast.Name) and node.value.id in ('np','numpy'):
+                    if node.attr not in NUMPY_ATTRIBUTES:
+                        raise RuntimeError('%s.%s is not allowed in expression "%s"'%(node.value.id,node.attr,self.expr))
+                    modules.add(node.value)
+                elif node.attr not in ATTRIBUTES:
+                    raise RuntimeError('Attribute %s is not allowed in expression "%s"'%(node.attr,self.expr))
+                self.numexpr=False
+            elif isinstance(node,ast.Name):
+                if node.id.startswith('__'):
+                    raise RuntimeError('%s is not allowed in expression "%s"'%(node.id,self.expr))
+                if node.id in ('np','numpy') and node not in modules: #ast.walk visits the Attribute first
+                    raise RuntimeError('%s is only allowed as %s.<function> in expression "%s"'%(node.id,node.id,self.expr))
+                self.names.add(node.id)
+            elif isinstance(node,(ast.Subscript,ast.IfExp)):
+                self.numexpr=False
+            elif isinstance(node,ast.Call):
+                if not isinstance(node.func,ast.Name) or node.func.id not in NUMEXPR_FUNCTIONS:
+                    self.numexpr=False
+            if isinstance(node,OPERATIONS):self.ops+=1
+        #Function names aren't variables
+        self.variables=sorted(self.names-set(NUMEXPR_FUNCTIONS))
+        self.code=compile(tree,'<calc>','eval')
+        self._numexpr={}
+
+    def __repr__(self):
+        return 'Expression(%s)'%repr(self.expr)
+
+    def __call__(self,namespace,globals_=None):
+        ''' Evaluate the expression with numpy (or Dataset objects), without
+            builtins. The globals (default NAMESPACE) are copied, not modified.'''
+        if globals_ is None:globals_=NAMESPACE
+        globals_=dict(globals_)
+        globals_['__builtins__']={'__import__':_numpy_import} #Names starting with __ can't be used
+        return eval(self.code,globals_,namespace)
+
+    def validate(self,names):
+        ''' Check the names in the expression are known'''
+        unknown=self.names-set(names)
+        if unknown:
+            raise RuntimeError('Unknown name(s) %s in expression "%s"'%(', '.join(sorted(unknown)),self.expr))
+
+    def evaluate_numexpr(self,namespace):
+        ''' Evaluate the expression with numexpr, the compiled numexpr
+            function is cached by the data types of the arrays'''
+        import numexpr
+        if not self.numexpr:raise RuntimeError('numexpr can not evaluate expression "%s"'%self.expr)
+        arrays=[np.asarray(namespace[n]) for n in self.variables]
+        try:NumExpr=numexpr.NumExpr
+        except AttributeError:
+            return numexpr.evaluate(self.expr,local_dict=dict(zip(self.variables,arrays)))
+        key=tuple([a.dtype.str for a in arrays])
+        try:func=self._numexpr[key]
+        except KeyError:
+            signature=[(n,a.dtype.type) for n,a in zip(self.variables,arrays)]
+            func=self._numexpr[key]=NumExpr(self.expr,signature)
+        return func(*arrays)
@@ -22,14 +22,23 @@ Required parameters:
      --calc     : calculation in numpy syntax, rasters specified as using
                   any legal python variable name syntax, band numbers are
                   specified using square brackets (zero based indexing)
-     --outfile  : output filepath
+                  Multiple named calculations (--calc="name=expression") can
+                  be given, they are all evaluated in a single pass over the inputs
+     --outfile  : output filepath, for multiple calculations a template
+                  with a {name} field, e.g. --outfile="trmm_{name}.tif"
      --{*}      : filepaths for raster variables used in --calc
                   e.g. --calc='(someraster[0]+2)*c' --someraster='foo.tif' --c='bar.tif'
+                  In batch mode, glob patterns with {field} templates
+                  e.g. --a='3B42.{date}.*.7.tif'
 
 Optional parameters:
      --of            : GDAL format for output file (default "GTiff")')
      --co            : Creation option to the output format driver.
                        Multiple options may be listed.
+     --batch         : run the calculation for every group of files matched by the
+                       raster patterns, --outfile is a template with the same {field}s
+     --window        : "xoff yoff xsize ysize" pixel window of the first input,
+                       only the window is read and calculated
      --cellsize      : one of DEFAULT|MINOF|MAXOF|"xres yres"|xyres
                        (Default=DEFAULT, leftmost dataset in expression)
      --extent        : one of MINOF|INTERSECT|MAXOF|UNION|"xmin ymin xmax ymax"
@@ -54,6 +63,9 @@ Optional parameters:
     --tempdir        : filepath to temporary working directory (can also use /vsimem for in memory tempdir)
     --tempoptions    : list of GTIFF creation options to use when creating temp rasters
                        (Default = ['BIGTIFF=IF_SAFER'])
+    --trace          : write a Chrome trace JSON of the raster operations to this
+                       filepath and print a summary of the time spent
+    --workers        : number of worker processes in batch mode (Default=1)
 
 
 
@@ -63,6 +75,14 @@ Example:
             --red=../testdata/landsat_utm50.tif  \
             --nir=../testdata/landsat_geo.tif    \
             --overwrite --reproject --extent=MAXOF
+
+       gdal_calculator.py --outfile=../testdata/trmm_{name}.tif  \
+            --calc="sum=a+b+c" --calc="max=numpy.maximum(numpy.maximum(a,b),c)" \
+            --calc="wet=(a>=1).astype(numpy.uint8)+(b>=1)+(c>=1)" \
+            --a=day1.tif --b=day2.tif --c=day3.tif
+
+       gdal_calculator.py --batch --workers=4 --outfile=../testdata/trmm_{date}.tif  \
+            --calc="a.sum(axis=0)" --a="../testdata/3B42.{date}.*.7.tif"
 '''
 #-------------------------------------------------------------------------------
 # Copyright: (c) Luke Pinner 2013
@@ -86,11 +106,15 @@ Example:
 # THE SOFTWARE.
 #
 #-------------------------------------------------------------------------------
-import os, sys, numpy, tempfile
+import os, re, sys, atexit, numpy, tempfile
 from osgeo import gdal
 from gdal_dataset import *
 from environment import *
 from conversions import *
+from evaluation import align, calculate_outputs
+from batch import calculate_batch
+from expressions import NAMESPACE, compile_expression
+from tracing import Tracer
 import geometry
 from gdal_calculations import __version__
 
@@ -146,8 +170,8 @@ def main():
         del sys.argv[sys.argv.index('--redirect-stderr')]
 
     #Required parameters
-    argparser.add_argument('--calc', dest='calc', help='calculation in numpy syntax using +-/* or numpy array functions (i.e. numpy.logical_and())', required=True)
-    argparser.add_argument('--out', '--outfile', dest='outfile', help='output file to Generate.', required=True)
+    argparser.add_argument('--calc', dest='calc', action='append', help='calculation in numpy syntax using +-/* or numpy array functions (i.e. numpy.logical_and()). Multiple "name=calculation" may be listed.', required=True)
+    argparser.add_argument('--out', '--outfile', dest='outfile', help='output file to Generate, with a {name} field for multiple calculations.', required=True)
 
     #Optional parameters
     argparser.add_argument('-q', '--quiet', dest='quiet', default=False, action='store_true', help='Suppress progress meter')
@@ -163,6 +187,7 @@ def main():
         'options may be listed. See the GTIFF documentation for legal'
         'creation options.')
     argparser.add_argument('--cellsize', dest='cellsize', default='DEFAULT', help='Output extent - one of "DEFAULT", "MINOF", "MAXOF", "xres yres" , xyres')
+    argparser.add_argument('--window', dest='window', default='', help='Only calculate a pixel window of the first input - "xoff yoff xsize ysize"')
     argparser.add_argument('--extent', dest='extent', default='MINOF', help='Output extent - one of "MINOF", "INTERSECT", "MAXOF", "UNION", "xmin ymin xmax ymax"')
     argparser.add_argument("--nodata", dest="nodata", default=False, action='store_true', help='Account for nodata  (Note this uses masked arrays which can be much slower)')
     argparser.add_argument("--notile", dest='notile', default=False, action='store_true', help='Don\'t use tiled processing - True/False')
@@ -174,6 +199,9 @@ def main():
     argparser.add_argument('--tempdir', dest='tempdir', default=tempfile.gettempdir(), help='Temp working directory')
     argparser.add_argument('--tempoptions', dest='tempoptions', default=['BIGTIFF=IF_SAFER'], action='append', help='Creation GTIFF options for Temp rasters')
     argparser.add_argument('--ntiles', dest='ntiles', default=1, help='Number of tiles to process at a time')
+    argparser.add_argument('--batch', dest='batch', default=False, action='store_true', help='Raster filepaths are glob patterns with {field} templates (e.g. "3B42.{date}.*.7.tif"), run the calculation for each group of files')
+    argparser.add_argument('--trace', dest='trace', default='', help='Write a Chrome trace JSON of the raster operations to this file')
+    argparser.add_argument('--workers', dest='workers', default=1, help='Number of worker processes in batch mode')
 
     args, rasters = argparser.parse_known_args()
 
@@ -192,9 +220,63 @@ def main():
     Env.tiled=not args.notile
     Env.tempdir=args.tempdir
     Env.tempoptions=args.tempoptions
+    if args.trace:
+        Env.trace=True
+        def export_trace():
+            Tracer.export_chrome(args.trace)
+            if not args.quiet:print(Tracer.summary_table())
+        atexit.register(export_trace)
     
+    #Named calculations?
+    calcs=[]
+    for calc in args.calc:
+        match=re.match(r'^\s*([A-Za-z_]\w*)\s*=(?!=)(.*)$',calc)
+        if match:calcs.append((match.group(1),match.group(2).strip()))
+        else:calcs.append(('calc%s'%(len(calcs)+1),calc))
+    multiple=len(calcs)>1 or bool(re.match(r'^\s*[A-Za-z_]\w*\s*=(?!=)',args.calc[0]))
+
+    window=None
+    if args.window:
+        try:
+            window=map(int,args.window.split())
+            if len(window)!=4:raise ValueError('expected "xoff yoff xsize ysize"')
+        except Exception as e:
+            sys.stderr.write('\nInvalid --window %s: %s\n'%(args.window,e))
+            sys.exit(1)
+
+    if args.batch:
+        #All groups of files in this process (or a pool of workers)
+        patterns=[]
+        while rasters:
+            arg=rasters.pop(0)
+            try:var,path=arg.split('=',1)
+            except:
+                try:var,path=arg,rasters.pop(0)
+                except:break
+            patterns.append((var.lstrip('-'),path))
+        if not args.quiet:
+            print('Running batch')
+            Env.progress=Progress(1)
+        try:results=calculate_batch(calcs, patterns, args.outfile, args.outformat, args.creation_options, int(args.workers), window)
+        except Exception as e:
+            sys.stderr.write('\n%s: %s\n'%(type(e).__name__,e))
+            sys.exit(1)
+        failed=[(fields,r) for fields,r in results if isinstance(r,Exception)]
+        for fields,e in failed:
+            sys.stderr.write('\n%s %s: %s\n'%(fields,type(e).__name__,e))
+        if failed:sys.exit(1)
+        return
+
+    if multiple:
+        outfiles=dict([(name,args.outfile.replace('{name}',name)) for name,calc in calcs])
+        if len(set(outfiles.values()))<len(calcs):
+            sys.stderr.write('\n--outfile must contain {name} for multiple calculations\n')
+            sys.exit(1)
+    else:args.calc=calcs[0][1]
+
     #get Datset objects from input files
     datasets=[]
+    variables=[]
     while rasters:
         arg=rasters.pop(0)
         try:var,path=arg.split('=') # --arg=filepath?
@@ -209,16 +291,40 @@ def main():
             var=var.lstrip('-')
             locals()[var]=Dataset(path)
             datasets.append(locals()[var])
+            variables.append((var,locals()[var]))
+
+    if window and not multiple:
+        #Views of the window of the aligned inputs, so only the window is read
+        try:variables=align(variables,window)
+        except Exception as e:
+            sys.stderr.write('\n%s: %s\n'%(type(e).__name__,e))
+            sys.exit(1)
+        datasets=[ds for var,ds in variables]
+
+    if multiple:
+        #All outputs in a single pass, sharing the block reads
+        if not args.quiet:
+            print('Running calculations')
+            Env.progress=Progress(1)
+        try:calculate_outputs(calcs, variables, outfiles, args.outformat, args.creation_options, window)
+        except Exception as e:
+            sys.stderr.write('\n%s: %s\n'%(type(e).__name__,e))
+            sys.exit(1)
+        return
+
+    #Parse and validate the calculation once
+    try:
+        expression=compile_expression(args.calc)
+        expression.validate([var for var,ds in variables]+NAMESPACE.keys())
+    except Exception as e:
+        sys.stderr.write('\n%s: %s\n'%(type(e).__name__,e))
+        sys.exit(1)
+
     #Setup progress meter
     if not args.quiet:
-        try:
-            import ast
-            ops=ast.parse(args.calc,mode='eval')
-            #How many operations/method calls?
-            ops=len([i for i in ast.walk(ops.body) if isinstance(i,(ast.BinOp,ast.Call))])
-        except:ops=len(datasets)+1
+        #How many operations/method calls?
         print('Running calculation')
-        Env.progress=Progress(ops)
+        Env.progress=Progress(max(expression.ops,1))
 
     #Run the calculation
     try:
@@ -227,12 +333,13 @@ def main():
             #but can't use expressions like 'a[2]' or 'a.GetRasterBand(3)'
             #and no extent/cellsize/srs differences are handled
             import numexpr
-            outfile=ArrayDataset(numexpr.evaluate(args.calc), prototype_ds=datasets[0])
+            arrays=dict([(var,ds.ReadAsArray()) for var,ds in variables])
+            outfile=ArrayDataset(expression.evaluate_numexpr(arrays), prototype_ds=datasets[0])
             outfile.save(args.outfile,args.outformat,args.creation_options)
         else:raise Exception
     except:
         try:
-            outfile = eval(args.calc)
+            outfile = expression(dict(variables))
             if not args.quiet:print('Saving output')
             outfile.save(args.outfile,args.outformat,args.creation_options)
         except Exception as e:
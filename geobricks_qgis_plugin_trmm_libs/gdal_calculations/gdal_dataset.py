@@ -32,6 +32,7 @@ Notes: - see __init__.py
 #-------------------------------------------------------------------------------
 __all__ = [ "Dataset",          "ArrayDataset",
             "ConvertedDataset", "ClippedDataset",
+            "WindowedDataset",  "LazyDataset",
             "WarpedDataset",    "DatasetStack",
             "TemporaryDataset", "NewDataset",
             "Block"
@@ -39,9 +40,13 @@ __all__ = [ "Dataset",          "ArrayDataset",
 
 import numpy as np
 from osgeo import gdal, gdal_array, osr
-import os, tempfile, operator, sys
+import os, tempfile, operator, sys, warnings, threading
+from xml.sax.saxutils import escape
 
 from environment import Env,Progress
+from stats import Statistics
+from caching import HeaderCache, HandlePool
+from tracing import Tracer
 import geometry
 
 gdal.UseExceptions()
@@ -55,7 +60,10 @@ class Block(object):
         self.y_off = y_off
         self.x_size = x_size
         self.y_size = y_size
-        self.data = dataset_or_band.ReadAsArray(x_off, y_off, x_size, y_size,*args,**kwargs)
+        with Tracer.span('read',pixels=x_size*y_size) as span:
+            self.data = dataset_or_band.ReadAsArray(x_off, y_off, x_size, y_size,*args,**kwargs)
+            try:span.set(bytes=self.data.nbytes)
+            except AttributeError:pass
 
     def __getattr__(self, attr):
         '''Pass any other attribute or method calls
@@ -63,6 +71,33 @@ class Block(object):
         if attr in dir(np.ndarray):return getattr(self.data,attr)
         else:raise AttributeError("'Block' object has no attribute '%s'"%attr)
 
+def traced(name,func):
+    '''Wrap func so calls are recorded as Tracer spans (if Env.trace)'''
+    if not Env.trace:return func
+    def __traced__(*args,**kwargs):
+        with Tracer.span(name) as span:
+            data=func(*args,**kwargs)
+            try:span.set(pixels=data.size,bytes=data.nbytes)
+            except AttributeError:pass
+            return data
+    return __traced__
+
+#numpy methods reduced block by block when Env.tiled==True
+REDUCTIONS=['max','mean','min','ptp','std','sum','var']
+
+#ufuncs for the operators, so tiled operations can write into an out= buffer
+UFUNCS={operator.__add__:np.add,operator.__sub__:np.subtract,
+        operator.__mul__:np.multiply,operator.__truediv__:np.true_divide,
+        operator.__floordiv__:np.floor_divide,operator.__mod__:np.mod,
+        operator.__pow__:np.power,operator.__neg__:np.negative,
+        operator.__and__:np.bitwise_and,operator.__or__:np.bitwise_or,
+        operator.__xor__:np.bitwise_xor,operator.__inv__:np.invert,
+        operator.__lshift__:np.left_shift,operator.__rshift__:np.right_shift,
+        operator.__lt__:np.less,operator.__le__:np.less_equal,
+        operator.__eq__:np.equal,operator.__ne__:np.not_equal,
+        operator.__ge__:np.greater_equal,operator.__gt__:np.greater}
+if hasattr(operator,'__div__'):UFUNCS[operator.__div__]=np.divide #python 2 classic division
+
 class RasterLike(object):
     '''Super class for Band and Dataset objects to avoid duplication '''
 
@@ -75,23 +110,27 @@ class RasterLike(object):
         ''' Apply various environment settings and checks
             including snapping/extents/cellsizes/coordinate systems
         '''
-        dataset1,dataset2=self.__check_srs__(self,other)
-        dataset1,dataset2=self.__check_cellsize__(dataset1,dataset2)
-        dataset1,dataset2=self.__check_extent__(dataset1,dataset2)
+        with Tracer.span('apply_environment'):
+            dataset1,dataset2=self.__check_srs__(self,other)
+            dataset1,dataset2=self.__check_cellsize__(dataset1,dataset2)
+            dataset1,dataset2=self.__check_extent__(dataset1,dataset2)
         return dataset1,dataset2
     check_extent=apply_environment #synonym for backwards compatability with v. <0.5
 
     def create_copy(self,outpath,outformat='GTIFF',options=[]):
         ok=(os.path.exists(outpath) and Env.overwrite) or (not os.path.exists(outpath))
         if ok:
-            if Env.progress.enabled:callback=gdal.TermProgress_nocb
+            if Env.progress.enabled:callback=Env.progress.callback
             else:callback=None
             try:                   #Is it a Band
                 ds=self.dataset._dataset
             except AttributeError: #No, it's a Dataset
                 ds=self._dataset
             driver=gdal.GetDriverByName(outformat)
-            ds=driver.CreateCopy(outpath,ds,options=options,callback=callback)
+            pixels=ds.RasterXSize*ds.RasterYSize*ds.RasterCount
+            with Tracer.span('save',pixels=pixels,bytes=pixels*gdal.GetDataTypeSize(self._data_type)//8):
+                ds=driver.CreateCopy(outpath,ds,options=options,callback=callback)
+            self.__write_statistics__(ds)
             ds=None
             del ds
             return Dataset(outpath)
@@ -100,7 +139,13 @@ class RasterLike(object):
 
     def read_blocks_as_array(self, nblocks=None):
         '''Read GDAL Datasets/Bands block by block'''
+        for x_off,y_off,x_size,y_size in self.__blockwindows__(nblocks):
+            yield Block(self, x_off, y_off, x_size, y_size)
+    #CamelCase synonym
+    ReadBlocksAsArray=read_blocks_as_array
 
+    def __blockwindows__(self, nblocks=None):
+        '''x_off, y_off, x_size, y_size of each block, the first is the largest'''
         ncols=self._x_size
         nrows=self._y_size
         if nblocks is None:nblocks=Env.ntiles
@@ -124,9 +169,84 @@ class RasterLike(object):
                 else:
                     xsize = ncols - xoff
 
-                yield Block(self, xoff, yoff, xsize, ysize )
-    #CamelCase synonym
-    ReadBlocksAsArray=read_blocks_as_array
+                yield xoff, yoff, xsize, ysize
+
+    def clip_to_extent(self,extent):
+        ''' View of a map extent [xmin,ymin,xmax,ymax], operations on it
+            only read (and write) the extent, e.g. for previews'''
+        return self.__clip__(self,extent)
+
+    def window(self,x_off,y_off,x_size,y_size):
+        ''' View of a pixel window, operations on it only read (and write)
+            the window, e.g. for previews'''
+        xmin,ymax=geometry.PixelToMap(x_off,y_off,self._gt)
+        xmax,ymin=geometry.PixelToMap(x_off+x_size,y_off+y_size,self._gt)
+        return self.__clip__(self,[xmin,ymin,xmax,ymax])
+
+    def band_statistics(self,buckets=256):
+        ''' Statistics (count/sum/min/max/mean/std and a histogram) of each band,
+            collected block by block so any size of raster is read in constant
+            memory. NoData values are excluded if Env.nodata is True, NaNs always
+            (they are counted in Statistics.nans).
+
+            With Env.nthreads>1, blocks are read in turn by one thread and
+            processed by a pool of threads (numpy releases the GIL), the
+            partial statistics of each thread are merged at the end.
+        '''
+        if Env.nodata:nodata=self._nodata
+        else:nodata=[None]*len(self._nodata)
+
+        def update(stats,b):
+            if b.data.ndim==2:stats[0].update(b.data)
+            else:
+                for i in range(b.data.shape[0]):stats[i].update(b.data[i,:,:])
+
+        Env.progress.steps = self._x_size*self._y_size #pixels
+
+        if Env.nthreads<=1 or not Env.tiled:
+            stats=[Statistics(n,buckets) for n in nodata]
+            if Env.tiled:reader=self.ReadBlocksAsArray()
+            else: reader=[Block(self,0, 0,self._x_size, self._y_size)]
+            for b in reader:
+                update(stats,b)
+                Env.progress.update_progress(b.x_size*b.y_size)
+            return stats
+
+        from multiprocessing.pool import ThreadPool
+        local=threading.local()
+        partials=[]
+        queued=threading.BoundedSemaphore(Env.nthreads*2) #Limit the blocks in memory
+        def reader():
+            for b in self.ReadBlocksAsArray():
+                queued.acquire()
+                yield b
+        def process(b):
+            try:
+                try:stats=local.stats
+                except AttributeError:
+                    stats=local.stats=[Statistics(n,buckets) for n in nodata]
+                    partials.append(stats)
+                update(stats,b)
+                return b.x_size*b.y_size
+            finally:queued.release()
+
+        pool=ThreadPool(Env.nthreads)
+        try:
+            for pixels in pool.imap_unordered(process,reader()):
+                Env.progress.update_progress(pixels)
+        finally:
+            pool.close()
+            pool.join()
+        if not partials:return [Statistics(n,buckets) for n in nodata] #No blocks
+        stats=partials[0]
+        for partial in partials[1:]:
+            for s1,s2 in zip(stats,partial):s1.merge(s2)
+        return stats
+
+    #CamelCase synonyms
+    BandStatistics=band_statistics
+    ClipToExtent=clip_to_extent
+    Window=window
 
     #===========================================================================
     #Private methods
@@ -181,11 +301,18 @@ class RasterLike(object):
                 gt=[ext[0], dataset1._gt[1], dataset1._gt[2], ext[3], dataset1._gt[5], dataset1._gt[5]]
                 ext=geometry.SnapExtent(ext, gt, s_ext, s_gt)
 
-        if dataset1.extent!=ext: dataset1=ClippedDataset(dataset1,ext)
-        if dataset2.extent!=ext: dataset2=ClippedDataset(dataset2,ext)
+        if dataset1.extent!=ext: dataset1=self.__clip__(dataset1,ext)
+        if dataset2.extent!=ext: dataset2=self.__clip__(dataset2,ext)
 
         return dataset1,dataset2
 
+    def __clip__(self,dataset,ext):
+        #Clipping doesn't resample, so a window on the parent will do
+        #unless the grid is rotated
+        if dataset._gt[2]==0 and dataset._gt[4]==0:
+            return WindowedDataset(dataset,ext)
+        return ClippedDataset(dataset,ext)
+
     def __check_srs__(self,dataset1,dataset2):
         srs=Env.srs
 
@@ -210,6 +337,18 @@ class RasterLike(object):
         ext=geometry.GeoTransformToExtent(self._gt,self._x_size,self._y_size)
         return [ext[1][0],ext[1][1],ext[3][0],ext[3][1]]
 
+    def __write_statistics__(self,ds):
+        '''Store statistics collected while writing (see Env.stats) in a
+           saved copy so they don't have to be computed by rereading it'''
+        try:                   #Is it a Band
+            stats=self.dataset._stats
+        except AttributeError: #No, it's a Dataset
+            try:stats=self._stats
+            except AttributeError:stats=None
+        if not stats:return
+        for i,s in enumerate(stats):
+            s.set_band_statistics(ds.GetRasterBand(i+1))
+
     def __getnodes__(self, root, nodetype, name, index=True):
         '''Function for handling serialised VRT XML'''
         #Originally based on the  _xmlsearch function in GDAL autotest/gdrivers/vrtderived.py
@@ -265,6 +404,15 @@ class RasterLike(object):
             if not Env.enable_numexpr:return None
             if Env.enable_numexpr and Env.tiled:raise RuntimeError('Env.tiled must be False to use numexpr.eval.')
 
+        #Known from the metadata, no need to read anything
+        if attr in ['shape','ndim','size','dtype','itemsize','nbytes']:
+            if self._nbands==1:shape=(self._y_size,self._x_size)
+            else:shape=(self._nbands,self._y_size,self._x_size)
+            dtype=np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(self._data_type))
+            size=int(np.prod(shape))
+            return {'shape':shape,'ndim':len(shape),'size':size,'dtype':dtype,
+                    'itemsize':dtype.itemsize,'nbytes':size*dtype.itemsize}[attr]
+
         if Env.tiled:
             '''Pass attribute gets down to the first block.
                Obviously won't work for b.shape etc...'''
@@ -279,10 +427,13 @@ class RasterLike(object):
         def __method__(*args,**kwargs):
             if attr[:8] == '__array_': return None #This breaks numexpr
 
-            if Env.tiled:
-                reader=self.ReadBlocksAsArray()
-                xblock,yblock=self._block_size
-                Env.progress.steps = (self._x_size*self._y_size)/(xblock*yblock*Env.ntiles)
+            #Reductions of all the values are combined from the blocks
+            if Env.tiled and attr in REDUCTIONS and not args and kwargs.get('axis') is None:
+                if not set(kwargs)-set(['axis','ddof']):
+                    return self.__reduction__(attr,kwargs.get('ddof',0))
+
+            Env.progress.steps = self._x_size*self._y_size
+            if Env.tiled:reader=self.ReadBlocksAsArray()
             else: reader=[Block(self,0, 0,self._x_size, self._y_size)]
 
             tmpds=None
@@ -296,7 +447,7 @@ class RasterLike(object):
                     nodata=[self._nodata[0]]*self._nbands
                 else:nodata=self._nodata
 
-                data=getattr(b.data,attr)(*args,**kwargs)
+                data=traced('op',getattr(b.data,attr))(*args,**kwargs)
 
                 #Sanity check - returns array of same dimensions as block
                 if data.shape not in [((b.y_size,b.x_size)),(self._nbands,b.y_size,b.x_size)]:
@@ -316,7 +467,7 @@ class RasterLike(object):
                                            datatype,self._srs,self._gt, nodata)
 
                 tmpds.write_data(data, b.x_off, b.y_off)
-                Env.progress.update_progress()
+                Env.progress.update_progress(b.x_size*b.y_size)
 
             try:tmpds.FlushCache() #Fails when file is in /vsimem
             except:pass
@@ -325,6 +476,28 @@ class RasterLike(object):
 
         return __method__
 
+    def __reduction__(self,attr,ddof=0):
+        ''' Reduce all the values of all the bands to a scalar, see band_statistics'''
+        dtype=np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(self._data_type))
+        stats=Statistics(buckets=0)
+        for s in self.band_statistics(buckets=0):stats.merge(s)
+        if stats.nans:return dtype.type(np.nan) #as the numpy reduction of the whole array
+        if not stats.count:
+            if Env.nodata:return np.ma.masked
+            raise ValueError('zero-size array to reduction operation %s'%attr)
+        if attr=='sum':
+            if dtype.kind in 'iub':return int(round(stats.sum))
+            return stats.sum
+        elif attr=='mean':return stats.mean
+        elif attr=='min':return dtype.type(stats.min)
+        elif attr=='max':return dtype.type(stats.max)
+        elif attr=='ptp':return dtype.type(stats.max-stats.min)
+        elif attr=='var':return stats.var_ddof(ddof)
+        elif attr=='std':
+            var=stats.var_ddof(ddof)
+            if var is None:return None
+            return var**0.5
+
     def __operation__(self,op,other=None,swapped=False,*args,**kwargs):
         ''' Perform arithmetic/bitwise/boolean and return a temporary dataset.
             Set `swapped` to True to perform the operation
@@ -337,11 +510,13 @@ class RasterLike(object):
             else:
                 dataset1,dataset2=self.check_extent(other)
 
-        if Env.tiled:
-            reader=dataset1.ReadBlocksAsArray()
-            xblock,yblock=self._block_size
-            Env.progress.steps = (self._x_size*self._y_size)/(xblock*yblock*Env.ntiles)
-        else: reader=[Block(dataset1,0, 0,dataset1.RasterXSize, dataset1.RasterYSize)]
+        if Env.tiled and not Env.nodata and op in UFUNCS and not args and not kwargs:
+            return self.__ufuncoperation__(UFUNCS[op],dataset1,dataset2,swapped)
+        op=traced('op',op)
+
+        Env.progress.steps = dataset1._x_size*dataset1._y_size
+        if Env.tiled:reader=dataset1.ReadBlocksAsArray()
+        else: reader=[Block(dataset1,0, 0,dataset1._x_size, dataset1._y_size)]
         tmpds=None
         for b1 in reader:
             if Env.nodata:
@@ -380,12 +555,130 @@ class RasterLike(object):
                 except:tmpds=TemporaryDataset(dataset2._x_size,dataset2._y_size,dataset2._nbands,
                                        datatype,dataset1._srs,dataset1._gt,nodata)
             tmpds.write_data(data, b1.x_off, b1.y_off)
-            Env.progress.update_progress()
+            Env.progress.update_progress(b1.x_size*b1.y_size)
 
         try:tmpds.FlushCache()
         except:pass
         return tmpds
 
+    def __ufuncoperation__(self,ufunc,dataset1,dataset2=None,swapped=False):
+        ''' Tiled __operation__ without allocations in the block loop, blocks are
+            read into buffers allocated once (the first block is the largest)
+            and the ufunc writes into an output buffer with out='''
+        Env.progress.steps = dataset1._x_size*dataset1._y_size
+        israster=isinstance(dataset2,RasterLike)
+        ufunc=traced('op',ufunc)
+        buf1,buf2,out=None,None,None
+        tmpds=None
+        for x_off,y_off,x_size,y_size in dataset1.__blockwindows__():
+            if buf1 is None:buf1=dataset1.__blockbuffer__(x_size,y_size)
+            data1=dataset1.__readinto__(buf1,x_off,y_off,x_size,y_size)
+            if dataset2 is None:operands=(data1,)
+            else:
+                if israster:
+                    if buf2 is None:buf2=dataset2.__blockbuffer__(x_size,y_size)
+                    data2=dataset2.__readinto__(buf2,x_off,y_off,x_size,y_size)
+                else:data2=dataset2 #Not a Band/Dataset, try the op directly
+                if swapped:operands=(data2,data1)
+                else:operands=(data1,data2)
+
+            if out is None:
+                data=ufunc(*operands)
+                if data.dtype==np.bool:data=data.astype(np.uint8)
+                out=np.empty(data.size,data.dtype)
+                outshape=data.shape[:-2]
+            else:
+                data=out[:int(np.prod(outshape))*y_size*x_size].reshape(outshape+(y_size,x_size))
+                ufunc(*operands,out=data)
+
+            if not tmpds:
+                datatype=gdal_array.NumericTypeCodeToGDALTypeCode(data.dtype.type)
+                if not datatype:datatype=gdal.GDT_Byte
+                nodata=dataset1._nodata
+                try:tmpds=TemporaryDataset(dataset1._x_size,dataset1._y_size,dataset1._nbands,
+                                       datatype,dataset1._srs,dataset1._gt,nodata)
+                except:tmpds=TemporaryDataset(dataset2._x_size,dataset2._y_size,dataset2._nbands,
+                                       datatype,dataset1._srs,dataset1._gt,nodata)
+            tmpds.write_data(data, x_off, y_off)
+            Env.progress.update_progress(x_size*y_size)
+
+        try:tmpds.FlushCache()
+        except:pass
+        return tmpds
+
+    def __blockbuffer__(self,x_size,y_size):
+        '''Flat buffer for reading blocks of up to x_size*y_size pixels'''
+        dtype=gdal_array.GDALTypeCodeToNumericTypeCode(self._data_type)
+        return np.empty(self._nbands*y_size*x_size,dtype)
+
+    def __readinto__(self,buf,x_off,y_off,x_size,y_size):
+        '''Read a window into (a view of) a reusable flat buffer'''
+        if self._nbands==1:shape=(y_size,x_size)
+        else:shape=(self._nbands,y_size,x_size)
+        data=buf[:self._nbands*y_size*x_size].reshape(shape)
+        with Tracer.span('read',pixels=x_size*y_size,bytes=data.nbytes):
+            try:self.ReadAsArray(x_off,y_off,x_size,y_size,buf_obj=data)
+            except TypeError: #No buf_obj argument
+                data[...]=self.ReadAsArray(x_off,y_off,x_size,y_size)
+        return data
+
+    def __inplace__(self,op,other):
+        ''' Perform an augmented assignment (i.e. ds1 += ds2) by writing the result
+            back into self block by block, so an accumulation loop keeps updating
+            one raster instead of creating a new temporary dataset at each step.
+
+            Only writable datasets (NewDataset/TemporaryDataset) are updated, if the
+            environment doesn't change their extent/cellsize/coordinate system and
+            their datatype can hold the result (numpy "same_kind" casting).
+            Otherwise NotImplemented is returned and Python falls back to the
+            normal operator, which returns a new temporary dataset.
+
+            The shape and datatype of the result are only checked on the first
+            block, the only one that can fall back as nothing has been written
+            yet. The other blocks are computed the same way so can't differ.
+        '''
+        if not isinstance(self,NewDataset):return NotImplemented
+        dataset2=other
+        if isinstance(other,RasterLike):
+            dataset1,dataset2=self.apply_environment(other)
+            if dataset1 is not self:return NotImplemented
+        dtype=gdal_array.GDALTypeCodeToNumericTypeCode(self._data_type)
+
+        Env.progress.steps = self._x_size*self._y_size
+        if Env.tiled:reader=self.ReadBlocksAsArray()
+        else: reader=[Block(self,0, 0,self._x_size, self._y_size)]
+        first=True
+        for b1 in reader:
+            if Env.nodata:
+                if b1.data.ndim==2:mask=(b1.data==self._nodata[0])
+                else:mask=np.array([b1.data[i,:,:]==self._nodata[i] for i in range(b1.data.shape[0])])
+                b1.data=np.ma.MaskedArray(b1.data,mask)
+                b1.data.fill_value=self._nodata[0]
+
+            if isinstance(dataset2,RasterLike):
+                b2=Block(dataset2,b1.x_off, b1.y_off,b1.x_size, b1.y_size)
+                if Env.nodata:
+                    if b2.data.ndim==2:mask=(b2.data==dataset2._nodata[0])
+                    else:mask=np.array([b2.data[i,:,:]==dataset2._nodata[i] for i in range(b2.data.shape[0])])
+                    b2.data=np.ma.MaskedArray(b2.data,mask)
+                    b2.data.fill_value=self._nodata[0]
+                data=op(b1.data, b2.data)
+            else:
+                data=op(b1.data,dataset2)
+
+            if first:
+                #Nothing has been written yet, so it's not too late to fall back
+                if data.shape!=b1.data.shape or not np.can_cast(data.dtype,dtype,'same_kind'):
+                    return NotImplemented
+                self._stats=None #collected again as the blocks are rewritten
+                first=False
+            self.write_data(data.astype(dtype), b1.x_off, b1.y_off)
+            Env.progress.update_progress(b1.x_size*b1.y_size)
+
+        try:self.FlushCache()
+        except:pass
+        return self
+
     #===========================================================================
     #Arithmetic operations
     #===========================================================================
@@ -426,6 +719,23 @@ class RasterLike(object):
         return self.__operation__(operator.__mod__,other, swapped=1)
     def __rpow__(self,other):
         return self.__operation__(operator.__pow__,other, swapped=1)
+    #Augmented assignment, updates writable datasets in place
+    def __iadd__(self,other):
+        return self.__inplace__(operator.__add__,other)
+    def __isub__(self,other):
+        return self.__inplace__(operator.__sub__,other)
+    def __imul__(self,other):
+        return self.__inplace__(operator.__mul__,other)
+    def __idiv__(self,other):
+        return self.__inplace__(operator.__div__,other)
+    def __itruediv__(self,other):
+        return self.__inplace__(operator.__truediv__,other)
+    def __ifloordiv__(self,other):
+        return self.__inplace__(operator.__floordiv__,other)
+    def __imod__(self,other):
+        return self.__inplace__(operator.__mod__,other)
+    def __ipow__(self,other):
+        return self.__inplace__(operator.__pow__,other)
     #===========================================================================
     #Bitwise operations
     #===========================================================================
@@ -452,6 +762,17 @@ class RasterLike(object):
         return self.__operation__(operator.__or__,other, swapped=1)
     def __rxor__(self,other):
         return self.__operation__(operator.__xor__,other, swapped=1)
+    #Augmented assignment, updates writable datasets in place
+    def __iand__(self,other):
+        return self.__inplace__(operator.__and__,other)
+    def __ilshift__(self,other):
+        return self.__inplace__(operator.__lshift__,other)
+    def __irshift__(self,other):
+        return self.__inplace__(operator.__rshift__,other)
+    def __ior__(self,other):
+        return self.__inplace__(operator.__or__,other)
+    def __ixor__(self,other):
+        return self.__inplace__(operator.__xor__,other)
 
     #===========================================================================
     #Boolean operations
@@ -477,18 +798,23 @@ class Band(RasterLike):
         through to the underlying GDALBand/ndarray objects
     '''
     def __init__(self,band,dataset,bandnum=0):
-        self._band = band
         self.dataset=dataset #Keep a link to the parent Dataset object
 
         self._x_size=dataset._x_size
         self._y_size=dataset._y_size
         self._nbands=1
         self._bands=[bandnum]#Keep track of band number, zero based index
-        self._data_type=self.DataType
-        self._srs=dataset.GetProjectionRef()
-        self._gt=dataset.GetGeoTransform()
-        self._block_size=self.GetBlockSize()
-        self._nodata=[band.GetNoDataValue()]
+        if band is None: #LazyDataset band, borrowed when needed, see __getattr__
+            self._data_type=dataset._data_types[bandnum]
+            self._block_size=dataset._block_size
+            self._nodata=[dataset._nodata[bandnum]]
+        else:
+            self._band = band
+            self._data_type=self.DataType
+            self._block_size=self.GetBlockSize()
+            self._nodata=[band.GetNoDataValue()]
+        self._srs=dataset._srs
+        self._gt=dataset._gt
         self.extent=self.__get_extent__()
 
     def get_raster_band(self,*args,**kwargs):
@@ -501,6 +827,8 @@ class Band(RasterLike):
            through to the underlying GDALBand/ndarray objects'''
         if attr=='dtype':raise TypeError #so numpy ufuncs work
         #if attr in ('dtype','__array__struct__'):raise TypeError #so numpy ufuncs work
+        if attr=='_band': #Not kept, so the HandlePool can close the file
+            return self.dataset._dataset.GetRasterBand(self._bands[0]+1)
         if attr in dir(gdal.Band):return getattr(self._band, attr)
         elif attr in dir(np.ndarray):
             if callable(getattr(np.ndarray,attr)):return self.__ndarraymethod__(attr)
@@ -540,6 +868,7 @@ class Dataset(RasterLike):
         self._nbands=self.RasterCount
         self._bands=range(self.RasterCount)
         self._data_type=self.GetRasterBand(1).DataType
+        self._data_types=[b.DataType for b in self]
         self._srs=self.GetProjectionRef()
         self._block_size=self.GetRasterBand(1).GetBlockSize()
         self._nodata=[b.GetNoDataValue() for b in self]
@@ -594,6 +923,65 @@ class Dataset(RasterLike):
     #CamelCase synonym
     BandReadBlocksAsArray=band_read_blocks_as_array
 
+class LazyDataset(Dataset):
+    ''' Dataset that is only opened by GDAL when it is actually needed.
+
+        The grid, sizes, SRS, block size and nodata come from the HeaderCache,
+        so planning work (e.g. extents of a stack of files) doesn't keep file
+        handles open. The GDALDataset is opened on the first pixel read or
+        GDAL method call, the handle is borrowed from the HandlePool so it
+        may be closed and reopened transparently. Bands don't keep the
+        GDALRasterBand either, it is borrowed from the handle on each call.
+    '''
+    def __init__(self,filepath,*args):
+        if os.path.exists(filepath):filepath=os.path.abspath(filepath)
+        self._filename=filepath
+        self._args=args
+
+        header=HeaderCache.get(filepath)
+        if header['gt'][5] > 0: #positive NS pixel res. see Dataset (Issue 8)
+            Dataset.__init__(self,filepath,*args)
+            return
+
+        self._gt=tuple(header['gt'])
+        self._x_size=header['x_size']
+        self._y_size=header['y_size']
+        self._nbands=header['nbands']
+        self._bands=range(self._nbands)
+        self._data_type=header['data_type']
+        self._data_types=header['data_types']
+        self._srs=header['srs']
+        self._block_size=header['block_size']
+        self._nodata=header['nodata']
+        self.extent=self.__get_extent__()
+
+    def __getattr__(self, attr):
+        '''Get the GDALDataset from the handle pool'''
+        if attr=='_dataset':
+            return HandlePool.open(self._filename,*self._args)
+        return Dataset.__getattr__(self,attr)
+
+    def __len__(self):
+        return self._nbands
+
+    def __getitem__(self, key):
+        if '_dataset' in self.__dict__:return Dataset.__getitem__(self,key) #Not lazy, see __init__
+        if not 0<=key<self._nbands:raise IndexError('Band index out of range')
+        return Band(None,self,key)
+
+    def __iter__(self):
+        for i in xrange(self._nbands):
+            yield self[i]
+
+    def get_raster_band(self,i=1): #GDAL Dataset Band indexing starts at 1
+        return self[i-1]
+
+    #CamelCase synonym
+    GetRasterBand=get_raster_band
+
+    def __del__(self):
+        pass #The handle belongs to the HandlePool
+
 class ClippedDataset(Dataset):
     '''Use a VRT to "clip" to min extent of two rasters'''
 
@@ -756,7 +1144,8 @@ class ClippedDataset(Dataset):
         xmax,ymin=geometry.MapToPixel(extent[2],extent[1],gt) #
         xsize=xmax-xoff
         ysize=ymin-yoff #Pixel coords start from upper left
-        return (int(xoff+0.5),int(yoff+0.5),int(xsize+0.5),int(ysize+0.5))
+        #Round half up, int() would round negative offsets (outside the dataset) towards 0
+        return tuple([int(np.floor(v+0.5)) for v in (xoff,yoff,xsize,ysize)])
 
     def __del__(self):
         try:gdal.Unlink(self._filename)
@@ -766,6 +1155,82 @@ class ClippedDataset(Dataset):
         self._parent=None
         del self._parent
 
+class WindowedDataset(ClippedDataset):
+    ''' "Clip" to an extent without building a VRT.
+
+        Reads are mapped to offset ReadAsArray calls on the parent Dataset/Band
+        and padded with nodata (or 0) outside it. The underlying GDALDataset is
+        only created (as a ClippedDataset) if it is actually needed, e.g. to
+        access bands or save the dataset.
+    '''
+    def __init__(self,dataset_or_band,extent):
+        self._clipped=None
+        gt = dataset_or_band._gt
+        xoff,yoff,xsize,ysize=self._extent_to_offsets(extent,gt)
+        if isinstance(dataset_or_band,WindowedDataset): #Window of a window
+            xoff+=dataset_or_band._x_off
+            yoff+=dataset_or_band._y_off
+            dataset_or_band=dataset_or_band._parentds
+        self._parentds=dataset_or_band #keep a reference so it doesn't get garbage collected
+        self._x_off,self._y_off=xoff,yoff
+
+        self._gt=(extent[0],gt[1],gt[2],extent[3],gt[4],gt[5])
+        self._x_size=xsize
+        self._y_size=ysize
+        self._nbands=dataset_or_band._nbands
+        self._bands=range(self._nbands)
+        self._data_type=dataset_or_band._data_type
+        self._srs=dataset_or_band._srs
+        self._block_size=dataset_or_band._block_size
+        self._nodata=dataset_or_band._nodata
+        self.extent=self.__get_extent__()
+
+    def read_as_array(self,xoff=0,yoff=0,xsize=None,ysize=None,buf_obj=None):
+        if xsize is None:xsize=self._x_size-xoff
+        if ysize is None:ysize=self._y_size-yoff
+        parent=self._parentds
+
+        #Window in parent pixel coordinates
+        px,py=xoff+self._x_off,yoff+self._y_off
+        x0,y0=max(px,0),max(py,0)
+        x1,y1=min(px+xsize,parent._x_size),min(py+ysize,parent._y_size)
+        if (x0,y0,x1,y1)==(px,py,px+xsize,py+ysize):
+            if buf_obj is None:return parent.ReadAsArray(px,py,xsize,ysize)
+            return parent.__readinto__(buf_obj.ravel(),px,py,xsize,ysize)
+
+        #Partly or completely outside the parent
+        dtype=gdal_array.GDALTypeCodeToNumericTypeCode(self._data_type)
+        if buf_obj is not None:data=buf_obj.reshape((self._nbands,ysize,xsize))
+        elif self._nbands==1:data=np.empty((1,ysize,xsize),dtype)
+        else:data=np.empty((self._nbands,ysize,xsize),dtype)
+        for i,nodata in enumerate(self._nodata):
+            if nodata is None:data[i]=0
+            else:data[i]=nodata
+        if x1>x0 and y1>y0:
+            data[:,y0-py:y1-py,x0-px:x1-px]=parent.ReadAsArray(x0,y0,x1-x0,y1-y0)
+        if buf_obj is not None:return buf_obj
+        if self._nbands==1:return data[0]
+        return data
+
+    #CamelCase synonym
+    ReadAsArray=read_as_array
+
+    def __getattr__(self, attr):
+        '''Create the underlying GDALDataset on first use'''
+        if attr=='_dataset':
+            self._clipped=ClippedDataset(self._parentds,self.extent)
+            self._dataset=self._clipped._dataset
+            return self._dataset
+        return Dataset.__getattr__(self,attr)
+
+    def __len__(self):
+        return self._nbands
+
+    def __del__(self):
+        self.__dict__.pop('_dataset',None) #don't create it just to delete it
+        self._clipped=None
+        self._parentds=None
+
 class ConvertedDataset(Dataset):
     '''Use a VRT to "convert" between datatypes'''
 
@@ -862,6 +1327,7 @@ class NewDataset(Dataset):
             if not gt:gt=(0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
 
         self._filename=filename
+        self._stats=None
         self._driver=gdal.GetDriverByName(outformat)
         self._dataset=self._driver.Create (self._filename,cols,rows,bands,datatype,options)
 
@@ -879,13 +1345,23 @@ class NewDataset(Dataset):
         return Dataset.create_copy(self,outpath,outformat,options)
 
     def write_data(self, data, x_off=0, y_off=0):
-        if data.ndim==2:
-            tmpbnd=self._dataset.GetRasterBand(1)
-            tmpbnd.WriteArray(data, x_off, y_off)
-        else:
-            for i in range(data.shape[0]):
-                tmpbnd=self._dataset.GetRasterBand(i+1)
-                tmpbnd.WriteArray(data[i,:,:], x_off, y_off)
+        with Tracer.span('write',pixels=data.size,bytes=data.nbytes):
+            if Env.stats:
+                if not self._stats:self._stats=[Statistics(n) for n in self._nodata]
+            #Band handles are looked up once, not per block
+            bands=self.__dict__.get('_band_handles')
+            if bands is None:
+                bands=[self._dataset.GetRasterBand(i+1) for i in range(self._dataset.RasterCount)]
+                self._band_handles=bands
+            if data.ndim==2:
+                bands[0].WriteArray(data, x_off, y_off)
+                if self._stats:self._stats[0].update(data)
+            else:
+                try:self._dataset.WriteArray(data, x_off, y_off) #All bands in one call, GDAL>=3.1
+                except (AttributeError,TypeError):
+                    for i in range(data.shape[0]):bands[i].WriteArray(data[i,:,:], x_off, y_off)
+                if self._stats:
+                    for i in range(data.shape[0]):self._stats[i].update(data[i,:,:])
 
 class TemporaryDataset(NewDataset):
     def __init__(self,cols,rows,bands,datatype,srs='',gt=[],nodata=[]):
@@ -906,13 +1382,15 @@ class TemporaryDataset(NewDataset):
         else:
             self._filedescriptor,self._filename=tempfile.mkstemp(suffix='.tif')
 
-        NewDataset.__init__(self,self._filename,'GTIFF',
-                            cols,rows,bands,datatype,srs,gt,
-                            options=Env.tempoptions)
+        with Tracer.span('create_temporary',pixels=cols*rows*bands):
+            NewDataset.__init__(self,self._filename,'GTIFF',
+                                cols,rows,bands,datatype,srs,gt,nodata,
+                                options=Env.tempoptions)
 
     save=NewDataset.create_copy #synonym for backwards compatibility
 
     def __del__(self):
+        self.__dict__.pop('_band_handles',None) #they keep the file open
         self._dataset=None
         del self._dataset
         try:os.close(self._filedescriptor)
@@ -935,6 +1413,36 @@ class WarpedDataset(Dataset):
         except AttributeError: #No, it's a Dataset
             orig_ds=dataset_or_band._dataset
 
+        #Output grid
+        try:
+            gt,cols,rows=geometry.SuggestedWarpOutput(orig_ds.GetGeoTransform(),
+                                                      orig_ds.RasterXSize, orig_ds.RasterYSize,
+                                                      orig_ds.GetProjection(), wkt_srs)
+            if snap_ds:gt,cols,rows=self._snap_grid(gt, cols, rows, snap_ds, snap_cellsize)
+        except Exception:
+            gt=None
+
+        bands=dataset_or_band._bands
+        self._dataset=None
+        if gt is None: #Let AutoCreateWarpedVRT work it out
+            pass
+        elif Env.resampling not in self._resampling_names(): #No VRT/gdalwarp name, AutoCreateWarpedVRT takes any GRA_*
+            pass
+        elif cols*rows*len(bands)<=Env.warpinmemory and hasattr(gdal,'Warp') and \
+                list(bands)==range(orig_ds.RasterCount):
+            self._dataset=self._warp_in_memory(orig_ds,wkt_srs,gt,cols,rows)
+        else:
+            try:self._dataset=self._create_warped_VRT(orig_ds,wkt_srs,gt,cols,rows,bands)
+            except RuntimeError:pass #e.g. no filename for the VRT to refer to
+
+        if self._dataset is None:
+            self._dataset=self._auto_create_warped_VRT(orig_ds, wkt_srs, dataset_or_band, snap_ds, snap_cellsize)
+
+        if not use_exceptions:gdal.DontUseExceptions()
+        Dataset.__init__(self)
+
+    def _auto_create_warped_VRT(self, orig_ds, wkt_srs, dataset_or_band, snap_ds, snap_cellsize):
+        ''' Warp with AutoCreateWarpedVRT and patch the VRT XML to the snapped grid'''
         try: #Generate a warped VRT
             warped_ds=gdal.AutoCreateWarpedVRT(orig_ds,orig_ds.GetProjection(),wkt_srs, Env.resampling)
             #AutoCreateWarpedVRT doesn't create a vsimem filename and we need one
@@ -950,10 +1458,103 @@ class WarpedDataset(Dataset):
         #    raise RuntimeError('Unable to project on the fly. Make sure all input datasets have projections set.')
 
         if snap_ds:warped_ds=self._modify_vrt(warped_ds, orig_ds, snap_ds, snap_cellsize)
-        self._dataset=self._create_simple_VRT(warped_ds,dataset_or_band)
+        return self._create_simple_VRT(warped_ds,dataset_or_band)
+
+    def _create_warped_VRT(self, orig_ds, wkt_srs, gt, cols, rows, bands):
+        ''' Write the warped VRT XML for the output grid in one step'''
+        path=orig_ds.GetDescription()
+        if not path or orig_ds.GetDriver().ShortName=='MEM':
+            raise RuntimeError('Unable to create a warped VRT from a dataset without a filename')
+        if os.path.exists(path):path=os.path.abspath(path)
+
+        src_gt=orig_ds.GetGeoTransform()
+        src_wkt=orig_ds.GetProjection()
+        fmt=lambda gt:', '.join(['%.16g'%v for v in gt])
+        blocksize=orig_ds.GetRasterBand(1).GetBlockSize()
+        resampling=self._resampling_names()[Env.resampling][0]
 
-        if not use_exceptions:gdal.DontUseExceptions()
-        Dataset.__init__(self)
+        vrt=[]
+        vrt.append('<VRTDataset rasterXSize="%s" rasterYSize="%s" subClass="VRTWarpedDataset">' % (cols,rows))
+        vrt.append('  <SRS>%s</SRS>' % escape(wkt_srs))
+        vrt.append('  <GeoTransform>%s</GeoTransform>' % fmt(gt))
+        mappings=[]
+        for i,band in enumerate(bands):
+            rb=orig_ds.GetRasterBand(band+1) #gdal band index start at 1
+            nodata=rb.GetNoDataValue()
+            vrt.append('  <VRTRasterBand dataType="%s" band="%s" subClass="VRTWarpedRasterBand">' % (gdal.GetDataTypeName(rb.DataType), i+1))
+            if nodata is not None: # 0 is a valid value
+                vrt.append('    <NoDataValue>%s</NoDataValue>' % repr(nodata))
+            vrt.append('  </VRTRasterBand>')
+            mappings.append('      <BandMapping src="%s" dst="%s">' % (band+1,i+1))
+            if nodata is not None:
+                mappings.append('        <SrcNoDataReal>%s</SrcNoDataReal>' % repr(nodata))
+                mappings.append('        <SrcNoDataImag>0</SrcNoDataImag>')
+                mappings.append('        <DstNoDataReal>%s</DstNoDataReal>' % repr(nodata))
+                mappings.append('        <DstNoDataImag>0</DstNoDataImag>')
+            mappings.append('      </BandMapping>')
+        vrt.append('  <BlockXSize>%s</BlockXSize>' % blocksize[0])
+        vrt.append('  <BlockYSize>%s</BlockYSize>' % blocksize[1])
+        vrt.append('  <GDALWarpOptions>')
+        vrt.append('    <WarpMemoryLimit>6.71089e+07</WarpMemoryLimit>')
+        vrt.append('    <ResampleAlg>%s</ResampleAlg>' % resampling)
+        vrt.append('    <Option name="INIT_DEST">%s</Option>' % ('NO_DATA' if orig_ds.GetRasterBand(1).GetNoDataValue() is not None else '0'))
+        vrt.append('    <SourceDataset relativeToVRT="0">%s</SourceDataset>' % escape(path))
+        vrt.append('    <Transformer>')
+        vrt.append('      <ApproxTransformer>')
+        vrt.append('        <MaxError>0.125</MaxError>')
+        vrt.append('        <BaseTransformer>')
+        vrt.append('          <GenImgProjTransformer>')
+        vrt.append('            <SrcGeoTransform>%s</SrcGeoTransform>' % fmt(src_gt))
+        vrt.append('            <SrcInvGeoTransform>%s</SrcInvGeoTransform>' % fmt(geometry.InvGeoTransform(src_gt)))
+        vrt.append('            <DstGeoTransform>%s</DstGeoTransform>' % fmt(gt))
+        vrt.append('            <DstInvGeoTransform>%s</DstInvGeoTransform>' % fmt(geometry.InvGeoTransform(gt)))
+        if not osr.SpatialReference(src_wkt).IsSame(osr.SpatialReference(wkt_srs)):
+            vrt.append('            <ReprojectTransformer>')
+            vrt.append('              <ReprojectionTransformer>')
+            vrt.append('                <SourceSRS>%s</SourceSRS>' % escape(src_wkt))
+            vrt.append('                <TargetSRS>%s</TargetSRS>' % escape(wkt_srs))
+            vrt.append('              </ReprojectionTransformer>')
+            vrt.append('            </ReprojectTransformer>')
+        vrt.append('          </GenImgProjTransformer>')
+        vrt.append('        </BaseTransformer>')
+        vrt.append('      </ApproxTransformer>')
+        vrt.append('    </Transformer>')
+        vrt.append('    <BandList>')
+        vrt.extend(mappings)
+        vrt.append('    </BandList>')
+        vrt.append('  </GDALWarpOptions>')
+        vrt.append('</VRTDataset>')
+
+        vrt='\n'.join(vrt)
+        self.__write_vsimem__(self._warped_fn,vrt)
+        return gdal.Open(self._warped_fn)
+
+    def _warp_in_memory(self, orig_ds, wkt_srs, gt, cols, rows):
+        ''' Warp to a MEM dataset, for small outputs that are cheaper to compute once'''
+        ext=geometry.GeoTransformToExtent(gt,cols,rows)
+        #Nodata is excluded from the resampling and kept in the output, like the warped VRT
+        nodata=[orig_ds.GetRasterBand(i+1).GetNoDataValue() for i in range(orig_ds.RasterCount)]
+        if any(n is not None for n in nodata):
+            nodata=' '.join(['None' if n is None else repr(n) for n in nodata])
+        else:nodata=None
+        opts=gdal.WarpOptions(format='MEM', width=cols, height=rows,
+                              outputBounds=[ext[1][0],ext[1][1],ext[3][0],ext[3][1]],
+                              srcSRS=orig_ds.GetProjection(), dstSRS=wkt_srs,
+                              srcNodata=nodata, dstNodata=nodata,
+                              resampleAlg=self._resampling_names()[Env.resampling][1])
+        return gdal.Warp('',orig_ds,options=opts)
+
+    def _resampling_names(self):
+        ''' VRT and gdalwarp names of the gdal.GRA_* resampling methods'''
+        lut={ gdal.GRA_NearestNeighbour:('NearestNeighbour','near'),
+              gdal.GRA_Bilinear:('Bilinear','bilinear'),
+              gdal.GRA_Cubic:('Cubic','cubic'),
+              gdal.GRA_CubicSpline:('CubicSpline','cubicspline'),
+              gdal.GRA_Lanczos:('Lanczos','lanczos')}
+        if int(gdal.VersionInfo("VERSION_NUM"))>=1100000:
+            lut[gdal.GRA_Average]=('Average','average')
+            lut[gdal.GRA_Mode]=('Mode','mode')
+        return lut
 
     def _create_simple_VRT(self,warped_ds,dataset_or_band):
         ''' Create a simple VRT XML string from a warped VRT (GDALWarpOptions)'''
@@ -992,34 +1593,9 @@ class WarpedDataset(Dataset):
         orig_ext=[orig_ext[1][0],orig_ext[1][1],orig_ext[3][0],orig_ext[3][1]]
         blocksize=orig_ds.GetRasterBand(1).GetBlockSize()
 
-        warp_gt=warp_ds.GetGeoTransform()
-        warp_cols = warp_ds.RasterXSize
-        warp_rows = warp_ds.RasterYSize
-        warp_ext=geometry.GeoTransformToExtent(warp_gt,warp_cols,warp_rows)
-        warp_ext=geometry.GeoTransformToExtent(warp_gt,warp_cols,warp_rows)
-        warp_ext=[warp_ext[1][0],warp_ext[1][1],warp_ext[3][0],warp_ext[3][1]]
-
-        snap_gt=list(snap_ds._gt)
-        if snap_cellsize:
-            snap_px,snap_py=snap_cellsize
-            snap_gt[1]=snap_px
-            snap_gt[5]=-snap_px
-            snap_cols = int(snap_ds._gt[1]/snap_px*snap_ds._x_size)
-            snap_rows = int(abs(snap_ds._gt[5])/snap_py*snap_ds._y_size)
-        else:
-            snap_px=snap_gt[1]
-            snap_py=abs(snap_gt[5])
-            snap_cols = snap_ds._x_size
-            snap_rows = snap_ds._y_size
-        snap_ext=geometry.GeoTransformToExtent(snap_gt,snap_cols,snap_rows)
-        snap_ext=[snap_ext[1][0],snap_ext[1][1],snap_ext[3][0],snap_ext[3][1]]
-
-        new_ext=geometry.SnapExtent(warp_ext, warp_gt, snap_ext, snap_gt)
-        new_px=snap_px
-        new_py=snap_py
-        new_cols = round((new_ext[2]-new_ext[0])/new_px)
-        new_rows = round((new_ext[3]-new_ext[1])/new_py)
-        new_gt=(new_ext[0],new_px,0,new_ext[3],0,-new_py)
+        new_gt,new_cols,new_rows=self._snap_grid(warp_ds.GetGeoTransform(),
+                                                 warp_ds.RasterXSize, warp_ds.RasterYSize,
+                                                 snap_ds, snap_cellsize)
         new_invgt=gdal.InvGeoTransform(new_gt)[1]
 
         #Read XML from vsimem, requires gdal VSIF*
@@ -1060,6 +1636,34 @@ class WarpedDataset(Dataset):
         self.__write_vsimem__(self._warped_fn, vrtxml)
         return gdal.Open(self._warped_fn)
 
+    def _snap_grid(self, warp_gt, warp_cols, warp_rows, snap_ds, snap_cellsize):
+        '''Snap a warped grid to the pixel size and alignment of snap_ds'''
+        warp_ext=geometry.GeoTransformToExtent(warp_gt,warp_cols,warp_rows)
+        warp_ext=[warp_ext[1][0],warp_ext[1][1],warp_ext[3][0],warp_ext[3][1]]
+
+        snap_gt=list(snap_ds._gt)
+        if snap_cellsize:
+            snap_px,snap_py=snap_cellsize
+            snap_gt[1]=snap_px
+            snap_gt[5]=-snap_px
+            snap_cols = int(snap_ds._gt[1]/snap_px*snap_ds._x_size)
+            snap_rows = int(abs(snap_ds._gt[5])/snap_py*snap_ds._y_size)
+        else:
+            snap_px=snap_gt[1]
+            snap_py=abs(snap_gt[5])
+            snap_cols = snap_ds._x_size
+            snap_rows = snap_ds._y_size
+        snap_ext=geometry.GeoTransformToExtent(snap_gt,snap_cols,snap_rows)
+        snap_ext=[snap_ext[1][0],snap_ext[1][1],snap_ext[3][0],snap_ext[3][1]]
+
+        new_ext=geometry.SnapExtent(warp_ext, warp_gt, snap_ext, snap_gt)
+        new_px=snap_px
+        new_py=snap_py
+        new_cols = round((new_ext[2]-new_ext[0])/new_px)
+        new_rows = round((new_ext[3]-new_ext[1])/new_py)
+        new_gt=(new_ext[0],new_px,0,new_ext[3],0,-new_py)
+        return new_gt,int(new_cols),int(new_rows)
+
     def __del__(self):
         try:Dataset.__del__(self)
         except:pass
@@ -1069,6 +1673,15 @@ class WarpedDataset(Dataset):
         except:pass
 
 class ArrayDataset(TemporaryDataset):
+    ''' Dataset over a numpy array.
+
+        The array buffer is used directly by a MEM dataset (DATAPOINTER), so
+        nothing is copied or written until the dataset is saved. The array is
+        copied on the first in-place operation (i.e. ds += 1), so the caller's
+        array is never changed. Arrays GDAL can't address (negative strides,
+        byte swapped, read only, unsupported types) are copied to a
+        TemporaryDataset instead.
+    '''
     def __init__(self,array,extent=[],srs='',gt=[],nodata=[],prototype_ds=None):
         use_exceptions=gdal.GetUseExceptions()
         gdal.UseExceptions()
@@ -1094,21 +1707,90 @@ class ArrayDataset(TemporaryDataset):
             px,py=(xmax-xmin)/cols,(ymax-ymin)/rows
             gt=[xmin,px,0,ymax,0,-py]
 
+        if self.__wrap__(array,cols,rows,bands,datatype,srs,gt,nodata):
+            self._shared=True #the buffer belongs to the caller
+            if not use_exceptions:gdal.DontUseExceptions()
+            return
+
         TemporaryDataset.__init__(self,cols,rows,bands,datatype,srs,gt,nodata)
         self.write_data(array,0,0)
+        self._shared=False
+
+    def __wrap__(self,array,cols,rows,bands,datatype,srs,gt,nodata):
+        ''' Create a MEM dataset over the array buffer, returns False if
+            the array can't be used directly'''
+        if datatype is None or array.dtype==np.bool:return False
+        if gdal.GetDataTypeSize(datatype)!=array.dtype.itemsize*8:return False #i.e int8
+        if not (array.dtype.isnative and array.flags.aligned and array.flags.writeable):return False
+        if array.ndim==2:strides=array.strides+(0,)
+        else:strides=array.strides #rows,cols,bands
+        if min(strides[:2])<=0 or strides[2]<0:return False
+
+        driver=gdal.GetDriverByName('MEM')
+        try:ds=driver.Create('',cols,rows,0,datatype)
+        except RuntimeError:return False
+        pointer=array.__array_interface__['data'][0]
+        for i in range(bands):
+            ds.AddBand(datatype,['DATAPOINTER=%d'%(pointer+i*strides[2]),
+                                 'PIXELOFFSET=%d'%strides[1],
+                                 'LINEOFFSET=%d'%strides[0]])
+
+        self._array=array #keep a reference, the MEM dataset doesn't own the buffer
+        self._filedescriptor=-1
+        self._filename=''
+        self._stats=None
+        self._driver=driver
+        self._dataset=ds
+        if not gt:gt=(0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+        self._dataset.SetGeoTransform(gt)
+        self._dataset.SetProjection(srs)
+        for i,val in enumerate(nodata[:bands]):
+            try:self._dataset.GetRasterBand(i+1).SetNoDataValue(val)
+            except TypeError:pass
+        Dataset.__init__(self)
+        return True
+
+    def __inplace__(self,op,other):
+        ''' Copy the caller's array before the first write'''
+        if self._shared:
+            array=self._array.copy()
+            self.__dict__.pop('_band_handles',None)
+            self._dataset=None #release the MEM dataset before the array
+            self.__wrap__(array,self._x_size,self._y_size,self._nbands,self._data_type,
+                          self._srs,self._gt,self._nodata)
+            self._shared=False
+        return TemporaryDataset.__inplace__(self,op,other)
+
+    def __del__(self):
+        self.__dict__.pop('_band_handles',None)
+        self._dataset=None #release the MEM dataset before the array
+        del self._dataset
+        try:TemporaryDataset.__del__(self)
+        except:pass
+        self._array=None
 
 class DatasetStack(Dataset):
     ''' Stack of bands from multiple datasets
+
+        The stack_* methods reduce the layers of the stack pixel by pixel
+        (i.e. along the band axis). They read aligned windows of all layers
+        at a time, with the window size set so memory use stays below
+        Env.stackmemory, and return a TemporaryDataset.
+        NoData values of the layers are excluded.
     '''
     def __init__(self, filepaths, band=0):
         self._datasets=[]#So they don't go out of scope and get GC'd
 
         #Get a reference dataset so can apply env setting to all datasets
-        reference_ds=Dataset(filepaths[0])
+        reference_ds=LazyDataset(filepaths[0])
         for f in filepaths[1:]:
-            d=Dataset(f)
+            d=LazyDataset(f)
             reference_ds,d=reference_ds.apply_environment(d)
 
+        #Let the VRT open any number of layers with bounded handles
+        if Env.maxhandles and gdal.GetConfigOption('GDAL_MAX_DATASET_POOL_SIZE') is None:
+            gdal.SetConfigOption('GDAL_MAX_DATASET_POOL_SIZE',str(max(Env.maxhandles,2)))
+
         vrtxml=self.buildvrt(reference_ds, filepaths, band)
 
         #Temp in memory VRT file
@@ -1121,25 +1803,38 @@ class DatasetStack(Dataset):
     def buildvrt(self, reference_ds, filepaths, band):
         ''' Create a simple VRT stack'''
         vrt=[]
-        vrt.append('<VRTDataset rasterXSize="%s" rasterYSize="%s">' % (reference_ds.RasterXSize,reference_ds.RasterYSize))
-        vrt.append('  <SRS>%s</SRS>' % reference_ds.GetProjection())
-        vrt.append('  <GeoTransform>%s</GeoTransform>' % ', '.join(map(str,reference_ds.GetGeoTransform())))
+        vrt.append('<VRTDataset rasterXSize="%s" rasterYSize="%s">' % (reference_ds._x_size,reference_ds._y_size))
+        vrt.append('  <SRS>%s</SRS>' % reference_ds._srs)
+        vrt.append('  <GeoTransform>%s</GeoTransform>' % ', '.join(map(str,reference_ds._gt)))
 
         for f in filepaths:
-            d=Dataset(f)
+            d=LazyDataset(f)
             reference_ds,d=reference_ds.apply_environment(d)
             self._datasets.append(d)
 
-            rb=d.GetRasterBand(band+1) #gdal band index start at 1
-            nodata=rb.GetNoDataValue()
-            path=d.GetDescription()
+            #Refer to the files directly, so they are only opened by the VRT
+            src=d
+            xoff,yoff=0,0
+            if isinstance(d,WindowedDataset):
+                src=d._parentds
+                xoff,yoff=d._x_off,d._y_off
+            if isinstance(src,LazyDataset):
+                path=src._filename
+                datatype=src._data_types[band]
+                nodata=src._nodata[band]
+            else:
+                xoff,yoff=0,0
+                rb=d.GetRasterBand(band+1) #gdal band index start at 1
+                path=d.GetDescription()
+                datatype=rb.DataType
+                nodata=rb.GetNoDataValue()
             rel=not os.path.isabs(path)
-            vrt.append('  <VRTRasterBand dataType="%s" band="%s">' % (gdal.GetDataTypeName(rb.DataType), band+1))
+            vrt.append('  <VRTRasterBand dataType="%s" band="%s">' % (gdal.GetDataTypeName(datatype), len(self._datasets)))
             vrt.append('    <SimpleSource>')
             vrt.append('      <SourceFilename relativeToVRT="%s">%s</SourceFilename>' % (int(rel),path))
             vrt.append('      <SourceBand>%s</SourceBand>'%(band+1))
-            vrt.append('      <SrcRect xOff="0" yOff="0" xSize="%s" ySize="%s" />' % (d.RasterXSize,d.RasterYSize))
-            vrt.append('      <DstRect xOff="0" yOff="0" xSize="%s" ySize="%s" />' % (d.RasterXSize,d.RasterYSize))
+            vrt.append('      <SrcRect xOff="%s" yOff="%s" xSize="%s" ySize="%s" />' % (xoff,yoff,d._x_size,d._y_size))
+            vrt.append('      <DstRect xOff="0" yOff="0" xSize="%s" ySize="%s" />' % (d._x_size,d._y_size))
             vrt.append('    </SimpleSource>')
             if nodata is not None: # 0 is a valid value
                 vrt.append('    <NoDataValue>%s</NoDataValue>' % nodata)
@@ -1149,6 +1844,100 @@ class DatasetStack(Dataset):
         vrt='\n'.join(vrt)
         return vrt
 
+    def stack_count_above(self,threshold):
+        '''Number of layers with values greater than threshold'''
+        def count(data):
+            with np.errstate(invalid='ignore'):
+                return (data>threshold).sum(axis=0)
+        return self.__stackreduction__(count,gdal.GDT_UInt16)
+
+    def stack_mean(self):
+        '''Mean of the layers'''
+        return self.__stackreduction__(lambda data:np.nanmean(data,axis=0))
+
+    def stack_median(self):
+        '''Median of the layers'''
+        return self.__stackreduction__(lambda data:np.nanmedian(data,axis=0))
+
+    def stack_percentile(self,q):
+        '''Percentile(s) of the layers, q in range 0-100.
+           A sequence of percentiles returns one band per percentile.'''
+        return self.__stackreduction__(lambda data:np.nanpercentile(data,q,axis=0))
+
+    def stack_std(self,ddof=0):
+        '''Standard deviation of the layers'''
+        return self.__stackreduction__(lambda data:np.nanstd(data,axis=0,ddof=ddof))
+
+    #CamelCase synonyms
+    StackCountAbove=stack_count_above
+    StackMean=stack_mean
+    StackMedian=stack_median
+    StackPercentile=stack_percentile
+    StackStd=stack_std
+
+    def __stackreduction__(self,func,datatype=None):
+        ''' Apply func to aligned windows of all layers and
+            write the results to a temporary dataset.
+
+            func receives a (layers,rows,cols) float array with NaN for NoData
+            and must return a (rows,cols) or (bands,rows,cols) array.
+        '''
+        if gdal.GetDataTypeSize(self._data_type)>32:dtype=np.float64
+        else:dtype=np.float32
+        if datatype is None:
+            datatype=gdal_array.NumericTypeCodeToGDALTypeCode(dtype)
+            nodata=self._nodata[0]
+            if nodata is None:nodata=np.nan
+        else:nodata=None
+
+        windows=self.__stackwindows__(np.dtype(dtype).itemsize)
+        Env.progress.steps=self._x_size*self._y_size
+        tmpds=None
+        for xoff,yoff,xsize,ysize in windows:
+            data=self._dataset.ReadAsArray(xoff,yoff,xsize,ysize).astype(dtype)
+            if data.ndim==2:data=data[np.newaxis,:,:]
+            for i,nd in enumerate(self._nodata):
+                if nd is not None:data[i][data[i]==nd]=np.nan
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore',RuntimeWarning) #All-NaN slices
+                out=func(data)
+            if nodata is not None:out[np.isnan(out)]=nodata
+
+            if not tmpds:
+                if out.ndim==2:nbands=1
+                else:nbands=out.shape[0]
+                tmpds=TemporaryDataset(self._x_size,self._y_size,nbands,
+                                       datatype,self._srs,self._gt,[nodata]*nbands)
+            tmpds.write_data(out,xoff,yoff)
+            Env.progress.update_progress(xsize*ysize)
+
+        try:tmpds.FlushCache()
+        except:pass
+        return tmpds
+
+    def __stackwindows__(self,itemsize):
+        ''' Windows (xoff,yoff,xsize,ysize) covering the stack, sized so all the
+            layers of a window (and a working copy) fit in Env.stackmemory'''
+        ncols,nrows=self._x_size,self._y_size
+        xblock,yblock=self._block_size
+        pixels=max(1,int(Env.stackmemory//(self._nbands*itemsize*2)))
+
+        if pixels>=ncols:
+            xsize=ncols
+            ysize=min(nrows,pixels//ncols)
+            if ysize>yblock:ysize-=ysize%yblock #Align to blocks
+        else:
+            xsize=pixels
+            if xsize>xblock:xsize-=xsize%xblock
+            ysize=1
+
+        windows=[]
+        for yoff in xrange(0,nrows,ysize):
+            for xoff in xrange(0,ncols,xsize):
+                windows.append((xoff,yoff,min(xsize,ncols-xoff),min(ysize,nrows-yoff)))
+        return windows
+
     def __del__(self):
         self._dataset=None
         del self._dataset
@@ -23,6 +23,7 @@
 ''' Geometry helper functions '''
 
 import os,math,warnings,tempfile,re
+import numpy as np
 from osgeo import gdal
 from osgeo import gdalconst
 from osgeo import osr
@@ -40,6 +41,36 @@ def ApplyGeoTransform(inx,iny,gt):
     outy = gt[3] + inx*gt[4] + iny*gt[5]
     return (outx,outy)
 
+def ApplyGeoTransformArray(inx,iny,gt):
+    ''' Apply a geotransform to arrays of coordinates in one NumPy expression
+        @param  inx:       Input x coordinates (array_like)
+        @param  iny:       Input y coordinates (array_like)
+        @param  gt:        Input geotransform (six doubles)
+
+        @return: outx,outy Output coordinates (two float64 ndarrays)
+    '''
+    inx=np.asarray(inx,dtype=np.float64)
+    iny=np.asarray(iny,dtype=np.float64)
+    outx = gt[0] + inx*gt[1] + iny*gt[2]
+    outy = gt[3] + inx*gt[4] + iny*gt[5]
+    return (outx,outy)
+
+def CachedInvGeoTransform(gt):
+    ''' Inverse geotransform, computed once per grid.
+        @param  gt:  Input geotransform (six doubles)
+        @return: Output geotransform (six doubles) or None if the
+                 equation is uninvertable.
+    '''
+    key=tuple(gt)
+    try:return _inv_gt_cache[key]
+    except KeyError:pass
+    if len(_inv_gt_cache)>=1024:_inv_gt_cache.clear()
+    inv_gt=InvGeoTransform(gt)
+    if inv_gt is not None:inv_gt=tuple(inv_gt)
+    _inv_gt_cache[key]=inv_gt
+    return inv_gt
+_inv_gt_cache={}
+
 def CellSize(gt):
     ''' Get cell size from a geotransform
 
@@ -144,6 +175,29 @@ def GeoTransformToExtent(gt,cols,rows):
         larr.reverse()
     return extent
 
+def GeoTransformToExtentArray(gts,cols,rows):
+    ''' Form the extent lists of many rasters at once, see GeoTransformToExtent.
+
+        @type gts:   C{sequence of tuple/list}
+        @param gts: geotransforms, one per raster
+        @type cols:   C{int/sequence}
+        @param cols: number of columns in each dataset
+        @type rows:   C{int/sequence}
+        @param rows: number of rows in each dataset
+        @rtype:    C{ndarray}
+        @return:   (n,4,2) array of x,y coordinate pairs, corners in the same
+                   order as GeoTransformToExtent: UL, LL, LR, UR
+    '''
+    gts=np.asarray(gts,dtype=np.float64).reshape(-1,6)
+    cols=np.broadcast_to(np.asarray(cols,dtype=np.float64),gts.shape[:1])
+    rows=np.broadcast_to(np.asarray(rows,dtype=np.float64),gts.shape[:1])
+    zeros=np.zeros_like(cols)
+    px=np.stack([zeros,zeros,cols,cols],axis=1)
+    py=np.stack([zeros,rows,rows,zeros],axis=1)
+    x=gts[:,0:1]+px*gts[:,1:2]+py*gts[:,2:3]
+    y=gts[:,3:4]+px*gts[:,4:5]+py*gts[:,5:6]
+    return np.stack([x,y],axis=2)
+
 def GeoTransformToGCPs(gt,cols,rows):
     ''' Form a gcp list from a geotransform using the 4 corners.
 
@@ -317,10 +371,23 @@ def MapToPixel(mx,my,gt):
         px = (mx - gt[0]) / gt[1]
         py = (my - gt[3]) / gt[5]
     else:
-        px,py=ApplyGeoTransform(mx,my,InvGeoTransform(gt))
+        inv_gt=CachedInvGeoTransform(gt)
+        if inv_gt is None:raise ValueError('Geotransform %s is not invertible'%(gt,))
+        px,py=ApplyGeoTransform(mx,my,inv_gt)
     #return int(px),int(py)
     return px,py
 
+def MapToPixelArray(mx,my,gt):
+    ''' Convert arrays of map coordinates to pixel coordinates, see MapToPixel
+        @param  mx:    Input map x coordinates (array_like)
+        @param  my:    Input map y coordinates (array_like)
+        @param  gt:    Input geotransform (six doubles)
+        @return: px,py Output coordinates (two float64 ndarrays)
+    '''
+    inv_gt=CachedInvGeoTransform(gt)
+    if inv_gt is None:raise ValueError('Geotransform %s is not invertible'%(gt,))
+    return ApplyGeoTransformArray(mx,my,inv_gt)
+
 def MaxExtent(ext1,ext2):
     xmin=min(ext1[0],ext2[0])
     ymin=min(ext1[1],ext2[1])
@@ -349,6 +416,15 @@ def PixelToMap(px,py,gt):
     mx,my=ApplyGeoTransform(px,py,gt)
     return mx,my
 
+def PixelToMapArray(px,py,gt):
+    ''' Convert arrays of pixel coordinates to map coordinates, see PixelToMap
+        @param  px:    Input pixel x coordinates (array_like)
+        @param  py:    Input pixel y coordinates (array_like)
+        @param  gt:    Input geotransform (six doubles)
+        @return: mx,my Output coordinates (two float64 ndarrays)
+    '''
+    return ApplyGeoTransformArray(px,py,gt)
+
 def ReprojectGeom(geom,src_srs,tgt_srs):
     ''' Reproject a geometry object.
 
@@ -381,6 +457,53 @@ def Rotation(gt):
     try:return math.degrees(math.tanh(gt[2]/gt[5]))
     except:return 0
 
+def SuggestedWarpOutput(gt,cols,rows,src_wkt,dst_wkt,samples=20):
+    ''' Suggest the output grid of a warp, like GDALSuggestedWarpOutput.
+
+        The edges of the input are sampled and reprojected to get the output extent,
+        the pixel size preserves the number of pixels along the diagonal.
+
+        @type gt:   C{tuple/list}
+        @param gt: input geotransform
+        @type cols:   C{int}
+        @param cols: number of columns in the input
+        @type rows:   C{int}
+        @param rows: number of rows in the input
+        @type src_wkt:  C{str}
+        @param src_wkt: input SRS WKT string
+        @type dst_wkt:  C{str}
+        @param dst_wkt: output SRS WKT string
+        @type samples:   C{int}
+        @param samples: number of steps along each edge
+        @rtype:    C{(tuple,int,int)}
+        @return:   output geotransform, columns and rows
+    '''
+    src_srs=osr.SpatialReference(src_wkt)
+    dst_srs=osr.SpatialReference(dst_wkt)
+    try: #GDAL>=3 would otherwise use the authority (i.e lat/lon) axis order
+        src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    except AttributeError:pass
+    ct=osr.CoordinateTransformation(src_srs,dst_srs)
+
+    pixels=[]
+    for i in range(samples+1):
+        px=cols*float(i)/samples
+        py=rows*float(i)/samples
+        pixels.extend([(px,0),(px,rows),(0,py),(cols,py)])
+    points=ct.TransformPoints([ApplyGeoTransform(px,py,gt) for px,py in pixels])
+    xs=[p[0] for p in points]
+    ys=[p[1] for p in points]
+    xmin,ymin,xmax,ymax=min(xs),min(ys),max(xs),max(ys)
+
+    ulx,uly=ct.TransformPoint(*ApplyGeoTransform(0,0,gt))[:2]
+    lrx,lry=ct.TransformPoint(*ApplyGeoTransform(cols,rows,gt))[:2]
+    res=math.hypot(lrx-ulx,lry-uly)/math.hypot(cols,rows)
+
+    out_cols=int((xmax-xmin)/res+0.5)
+    out_rows=int((ymax-ymin)/res+0.5)
+    return (xmin,res,0.0,ymax,0.0,-res),out_cols,out_rows
+
 def SceneCentre(gt,cols,rows):
     ''' Get scene centre from a geotransform.
 
@@ -452,3 +575,50 @@ def SnapExtent(in_ext,in_gt,snap_ext,snap_gt):
     oymax=oymin+irows*iy
 
     return [oxmin,oymin,oxmax,oymax]
+
+def SnapExtentArray(in_exts,in_gts,snap_ext,snap_gt):
+    '''Snap many extents to snap_ext at once, see SnapExtent
+
+        @type in_exts:  C{sequence of tuple/list}
+        @param in_exts: extents, [xmin,ymin,xmax,ymax] per raster
+        @type in_gts:   C{sequence of tuple/list}
+        @param in_gts: geotransforms, one per raster
+        @type snap_ext:  C{tuple/list}
+        @param snap_ext: extent coordinates
+        @type snap_gt:   C{tuple/list}
+        @param snap_gt: geotransform
+        @rtype:    C{ndarray}
+        @return:   (n,4) array of snapped extents
+    '''
+    in_exts=np.asarray(in_exts,dtype=np.float64).reshape(-1,4)
+    in_gts=np.asarray(in_gts,dtype=np.float64).reshape(-1,6)
+
+    #Input grid dimensions
+    ixmin,iymin,ixmax,iymax = in_exts.T
+    ix,iy=in_gts[:,1],np.abs(in_gts[:,5])
+    icols=np.floor((ixmax-ixmin)/ix+0.5) #same as round() for positive values
+    irows=np.floor((iymax-iymin)/iy+0.5)
+
+    #Snap grid dimensions
+    sxmin,symin = snap_ext[0],snap_ext[1]
+    sx,sy=snap_gt[1],abs(snap_gt[5])
+
+    #how many pixels difference?
+    xmindif = (sxmin-ixmin) / ix
+    ymindif = (symin-iymin) / iy
+
+    #how far (part pixel) do we need to shift it?
+    xminmod = (((((xmindif % 1) * ix) / sx) % 1) * sx) / ix
+    yminmod = (((((ymindif % 1) * iy) / sy) % 1) * sy) / iy
+
+    #shift to the nearest pixel
+    xminmod = np.where(np.abs(xminmod)>=0.5, np.where(xminmod>=0, xminmod-1, xminmod+1), xminmod)
+    yminmod = np.where(np.abs(yminmod)>=0.5, np.where(yminmod>=0, yminmod-1, yminmod+1), yminmod)
+
+    #Output origin
+    oxmin=ixmin+xminmod*ix
+    oymin=iymin+yminmod*iy
+    oxmax=oxmin+icols*ix
+    oymax=oymin+irows*iy
+
+    return np.stack([oxmin,oymin,oxmax,oymax],axis=1)
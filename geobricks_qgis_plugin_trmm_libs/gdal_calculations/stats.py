@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: stats.py
+Purpose: Single pass, mergeable band statistics and histograms
+
+Notes: - see __init__.py
+'''
+__all__ = [ "Statistics"]
+
+import numpy as np
+
+class Statistics(object):
+    ''' Running min/max/mean/std and histogram of a single band.
+
+        Blocks are added with `update` and partial results combined with `merge`,
+        so statistics of a raster of any size are collected while it is being
+        written instead of re-reading it afterwards.
+
+        The histogram has a fixed number of buckets, its range grows as values
+        fall outside of it by doubling the bucket width (adjacent buckets are
+        merged), so no prior knowledge of the value range is required.
+        Set buckets=0 to only collect count/sum/min/max/mean/std.
+        NaNs are excluded and counted in `nans`.
+    '''
+    def __init__(self,nodata=None,buckets=256):
+        if buckets and (buckets<2 or buckets%2):raise ValueError('buckets must be 0 or an even number >= 2')
+        self.nodata=nodata
+        self.buckets=int(buckets)
+        self.count=0
+        self.nans=0
+        self.sum=0.0
+        self.min=None
+        self.max=None
+        self._mean=0.0
+        self._m2=0.0
+        self._hist=None
+        self._hmin=None
+        self._hwidth=None
+
+    #===========================================================================
+    #Public methods
+    #===========================================================================
+    @property
+    def mean(self):
+        if not self.count:return None
+        return self._mean
+
+    @property
+    def std(self):
+        if not self.count:return None
+        return (self._m2/self.count)**0.5
+
+    @property
+    def var(self):
+        if not self.count:return None
+        return self._m2/self.count
+
+    def var_ddof(self,ddof=0):
+        ''' Variance with ddof delta degrees of freedom, as numpy.var'''
+        if self.count<=ddof:return None
+        return self._m2/(self.count-ddof)
+
+    def histogram(self):
+        ''' Returns (min, max, counts), as used by GDALRasterBand::SetDefaultHistogram'''
+        if self._hist is None:return None
+        return self._hmin,self.__hmax__(),[int(c) for c in self._hist]
+
+    def update(self,data):
+        ''' Add a block (ndarray or MaskedArray) of values'''
+        data=self.__valid__(data)
+        n=data.size
+        if not n:return self
+        data=data.astype(np.float64)
+        dmin,dmax=float(data.min()),float(data.max())
+        dsum=float(data.sum())
+        dmean=dsum/n
+        dm2=float(((data-dmean)**2).sum())
+        self.__combine__(n,dsum,dmin,dmax,dmean,dm2)
+
+        if not self.buckets:return self
+        self.__cover__(dmin,dmax)
+        counts,edges=np.histogram(data,bins=self.buckets,range=(self._hmin,self.__hmax__()))
+        self._hist+=counts
+        return self
+
+    def merge(self,other):
+        ''' Combine with the Statistics of another (disjoint) set of values'''
+        self.nans+=other.nans
+        if not other.count:return self
+        self.__combine__(other.count,other.sum,other.min,other.max,other._mean,other._m2)
+        if not self.buckets or not other.buckets:return self
+
+        #Histograms only share bucket edges if they grew from the same origin,
+        #so rebin the other histogram on its bucket centres.
+        ohmin,ohmax,ocounts=other.histogram()
+        self.__cover__(ohmin,ohmax)
+        width=(ohmax-ohmin)/other.buckets
+        centres=ohmin+width*(np.arange(other.buckets)+0.5)
+        centres=np.clip(centres,other.min,other.max)
+        counts,edges=np.histogram(centres,bins=self.buckets,range=(self._hmin,self.__hmax__()),weights=ocounts)
+        self._hist+=counts.astype(np.int64)
+        return self
+
+    def set_band_statistics(self,band):
+        ''' Write statistics and the default histogram to a gdal.Band so
+            GDAL (and QGIS) don't need to scan the raster to compute them.
+            For GeoTIFFs these are stored in the .aux.xml sidecar/metadata.'''
+        if not self.count:return
+        band.SetStatistics(self.min,self.max,self.mean,self.std)
+        if not self.buckets:return
+        hmin,hmax,counts=self.histogram()
+        band.SetDefaultHistogram(hmin,hmax,counts)
+    #CamelCase synonym
+    SetBandStatistics=set_band_statistics
+
+    #===========================================================================
+    #Private methods
+    #===========================================================================
+    def __valid__(self,data):
+        '''Flatten the block and drop masked, nodata and NaN values'''
+        if isinstance(data,np.ma.MaskedArray):data=data.compressed()
+        else:data=np.asarray(data).ravel()
+        if self.nodata is not None:data=data[data!=self.nodata]
+        if data.dtype.kind in 'fc':
+            nan=np.isnan(data)
+            nans=int(nan.sum())
+            if nans:
+                self.nans+=nans
+                data=data[~nan]
+        return data
+
+    def __combine__(self,n,dsum,dmin,dmax,dmean,dm2):
+        '''Parallel (Chan et al.) update of the running moments'''
+        self.sum+=dsum
+        count=self.count+n
+        delta=dmean-self._mean
+        self._mean+=delta*n/count
+        self._m2+=dm2+delta**2*self.count*n/count
+        self.count=count
+        self.min=dmin if self.min is None else min(self.min,dmin)
+        self.max=dmax if self.max is None else max(self.max,dmax)
+
+    def __hmax__(self):
+        return self._hmin+self._hwidth*self.buckets
+
+    def __cover__(self,vmin,vmax):
+        '''Grow the histogram range until it covers vmin..vmax'''
+        if self._hist is None:
+            self._hist=np.zeros(self.buckets,np.int64)
+            self._hmin=vmin
+            self._hwidth=(vmax-vmin)/self.buckets
+            if not self._hwidth>0:self._hwidth=max(abs(vmin),1.0)/self.buckets
+            return
+
+        half=self.buckets//2
+        while vmin<self._hmin or vmax>self.__hmax__():
+            hist=np.zeros(self.buckets,np.int64)
+            merged=self._hist[0::2]+self._hist[1::2]
+            if vmin<self._hmin: #Grow downwards, keep the upper edge
+                hmax=self.__hmax__()
+                hist[half:]=merged
+                self._hwidth*=2
+                self._hmin=hmax-self._hwidth*self.buckets
+            else:               #Grow upwards, keep the lower edge
+                hist[:half]=merged
+                self._hwidth*=2
+            self._hist=hist
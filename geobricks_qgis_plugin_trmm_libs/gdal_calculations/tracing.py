@@ -0,0 +1,107 @@
+# -*- coding: UTF-8 -*-
+'''
+Name: tracing.py
+Purpose: Opt-in spans of the raster operations, exported as Chrome trace JSON
+
+Notes: - see __init__.py
+'''
+__all__ = [ "Tracer"]
+
+import json, os, threading, time
+
+from environment import Env
+
+class Span(object):
+    ''' A timed step, see Tracer.span'''
+    def __init__(self,tracer,name,args):
+        self.tracer=tracer
+        self.name=name
+        self.args=args
+
+    def __enter__(self):
+        self.start=time.time()
+        return self
+
+    def __exit__(self,*exc_info):
+        self.tracer.add(self.name,self.start,time.time()-self.start,self.args)
+
+    def set(self,**args):
+        ''' Add or update arguments, i.e. bytes once they are known'''
+        self.args.update(args)
+
+class NullSpan(object):
+    ''' Does nothing, returned when tracing is disabled'''
+    def __enter__(self):return self
+    def __exit__(self,*exc_info):pass
+    def set(self,**args):pass
+
+NullSpan=NullSpan()
+
+class Tracer(object):
+    ''' Records spans (name, start, duration, thread and arguments such as
+        bytes and pixels) of the raster operations when Env.trace is True.
+
+        Spans are recorded for apply_environment, block reads (read), the numpy
+        operations (op), block writes (write), temporary dataset creation
+        (create_temporary) and saves (save).
+    '''
+    def __init__(self):
+        self.events=[]
+        self._lock=threading.Lock()
+
+    def span(self,name,**args):
+        ''' Context manager timing a step, i.e.
+            with Tracer.span('read',pixels=n) as span:
+                ...
+                span.set(bytes=data.nbytes)
+        '''
+        if not Env.trace:return NullSpan
+        return Span(self,name,args)
+
+    def add(self,name,start,duration,args=None):
+        with self._lock:
+            self.events.append((name,start,duration,threading.current_thread().ident,args or {}))
+
+    def clear(self):
+        with self._lock:self.events=[]
+
+    def export_chrome(self,filepath):
+        ''' Write the spans as Chrome trace JSON (chrome://tracing, Perfetto)'''
+        with self._lock:events=list(self.events)
+        if events:origin=min([e[1] for e in events])
+        else:origin=0
+        trace=[]
+        for name,start,duration,thread,args in events:
+            trace.append({'name':name,'cat':'gdal_calculations','ph':'X',
+                          'ts':(start-origin)*1e6,'dur':duration*1e6,
+                          'pid':os.getpid(),'tid':thread,'args':args})
+        with open(filepath,'w') as f:
+            json.dump({'traceEvents':trace,'displayTimeUnit':'ms'},f)
+
+    def summary(self):
+        ''' Spans aggregated by name, sorted by total time
+            @rtype:  C{[dict,...]}
+            @return: name, count, seconds, mean, max, bytes and pixels
+        '''
+        totals={}
+        with self._lock:events=list(self.events)
+        for name,start,duration,thread,args in events:
+            t=totals.setdefault(name,{'name':name,'count':0,'seconds':0.0,'max':0.0,'bytes':0,'pixels':0})
+            t['count']+=1
+            t['seconds']+=duration
+            t['max']=max(t['max'],duration)
+            t['bytes']+=args.get('bytes',0)
+            t['pixels']+=args.get('pixels',0)
+        for t in totals.values():t['mean']=t['seconds']/t['count']
+        return sorted(totals.values(),key=lambda t:-t['seconds'])
+
+    def summary_table(self):
+        ''' The summary as a text table'''
+        lines=['%-20s %8s %10s %10s %10s %12s %12s'%('span','count','total s','mean ms','max ms','MB','Mpixels')]
+        for t in self.summary():
+            lines.append('%-20s %8d %10.3f %10.3f %10.3f %12.1f %12.1f'%(
+                t['name'],t['count'],t['seconds'],t['mean']*1e3,t['max']*1e3,
+                t['bytes']/1024.0**2,t['pixels']/1e6))
+        return '\n'.join(lines)
+
+Tracer=Tracer()
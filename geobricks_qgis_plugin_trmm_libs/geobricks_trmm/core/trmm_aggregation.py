@@ -0,0 +1,111 @@
+from collections import deque
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import LazyDataset
+
+
+def aggregate_daily(layers, aggregation):
+    """
+    Reduce the 3-hourly layers of a day to a single raster.
+    @param layers: Paths of the layers of the day, '.tfw' files are skipped.
+    @type layers: list
+    @param aggregation: 'SUM' or 'AVG'
+    @type aggregation: str
+    @return: Dataset with the daily aggregate.
+    """
+    datasets = [LazyDataset(l) for l in layers if '.tif' in l]
+    if len(datasets) == 0:
+        raise RuntimeError('No layers to aggregate')
+    total = datasets[0]
+    # The first sum is a new temporary raster, the following ones update it in place
+    for ds in datasets[1:]:
+        total += ds
+    if aggregation == 'AVG':
+        total /= len(datasets)
+    return total
+
+
+def daily_operations(layers, aggregation):
+    """
+    Number of raster operations of aggregate_daily, e.g. to reset Env.progress, which counts the pixels of each.
+    @return: The operations, 0 if there is nothing to aggregate.
+    """
+    tifs = len([l for l in layers if '.tif' in l])
+    if tifs == 0:
+        return 0
+    return tifs - 1 + (1 if aggregation == 'AVG' else 0)
+
+
+class RollingWindow:
+    """
+    Running total of the last N daily rasters (e.g. 3, 7 or 30 days).
+
+    The total is kept on an accumulator raster: each new day is added to it and
+    the day leaving the window is subtracted, so the cost of an output day is
+    two raster operations whatever the window length. Every N days the total is
+    rebuilt from the days in the window, so floating point rounding can't drift,
+    that adds on average one more operation per day.
+    """
+
+    def __init__(self, days):
+        """
+        @param days: Window length, in days.
+        @type days: int
+        """
+        if days < 1:
+            raise ValueError('The window must be at least one day long')
+        self.days = days
+        self.window = deque()
+        self.total = None
+        self.pushed = 0
+
+    def push(self, daily):
+        """
+        Add the raster of a new day to the window.
+        @param daily: Daily aggregate, see aggregate_daily.
+        @type daily: Dataset
+        @return: The running total, or None until the window is full. It is the accumulator,
+            updated in place by the next push: save it first, or keep a snapshot.
+        """
+        self.window.append(daily)
+        self.pushed += 1
+        leaving = self.window.popleft() if len(self.window) > self.days else None
+        if self.total is None or self.pushed % self.days == 0:
+            self.resync()
+        else:
+            self.total += daily
+            if leaving is not None:
+                self.total -= leaving
+        if len(self.window) < self.days:
+            return None
+        return self.total
+
+    def snapshot(self):
+        """
+        Copy of the running total, which the next pushes don't change.
+        @return: Dataset, or None until the window is full.
+        """
+        if self.total is None or len(self.window) < self.days:
+            return None
+        return self.total * 1
+
+    def resync(self):
+        """
+        Rebuild the total from the days in the window.
+        """
+        days = list(self.window)
+        # Multiply to get a new raster, the first day must not be modified in place
+        total = days[0] * 1
+        for ds in days[1:]:
+            total += ds
+        self.total = total
+
+
+def rolling_window_days(aggregation):
+    """
+    Window length of a rolling aggregation code.
+    @param aggregation: e.g. 'SUM_7D'
+    @type aggregation: str
+    @return: The number of days, or None for daily aggregations.
+    """
+    if aggregation is None or not aggregation.startswith('SUM_') or not aggregation.endswith('D'):
+        return None
+    return int(aggregation[4:-1])
@@ -0,0 +1,195 @@
+import calendar
+import json
+import os
+import numpy
+from osgeo import gdal
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import NewDataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import TemporaryDataset
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import aggregate_daily
+
+
+NODATA = -9999.0
+
+
+def invalid_mask(data, nodata):
+    """
+    NaN and nodata pixels of a block. The comparison is made in the data type of the block,
+    e.g. a Float32 nodata of -9999.9 is -9999.900390625 once the block is cast to Float64.
+    @param data: Block, in the data type of the band.
+    @type data: numpy.ndarray
+    @param nodata: Nodata value of the band, or None.
+    @return: Boolean array, True where the pixel is not valid.
+    """
+    invalid = numpy.isnan(data)
+    if nodata is not None:
+        invalid |= data == numpy.asarray(nodata, data.dtype)
+    return invalid
+
+
+class PixelStatistics:
+    """
+    Per pixel running count, mean and sum of squared differences (Welford),
+    stored as three Float64 rasters so they can be updated one layer at a time
+    and reused across sessions.
+    """
+
+    def __init__(self, prefix, prototype_ds):
+        """
+        @param prefix: Path of the rasters without the '_COUNT.tif', '_MEAN.tif' and '_M2.tif' suffixes.
+        @type prefix: str
+        @param prototype_ds: Dataset with the grid of the layers.
+        @type prototype_ds: Dataset
+        """
+        self.datasets = {}
+        for name in ('COUNT', 'MEAN', 'M2'):
+            path = prefix + '_' + name + '.tif'
+            if os.path.isfile(path):
+                self.datasets[name] = Dataset(path, gdal.GA_Update)
+            else:
+                self.datasets[name] = NewDataset(path, bands=1, datatype=gdal.GDT_Float64, nodata=[None], prototype_ds=prototype_ds)
+
+    def update(self, dataset):
+        """
+        Add a layer, block by block.
+        @param dataset: Layer on the same grid as the statistics.
+        @type dataset: Dataset
+        """
+        count = self.datasets['COUNT']
+        if (dataset._x_size, dataset._y_size, tuple(dataset._gt)) != (count._x_size, count._y_size, tuple(count._gt)):
+            raise RuntimeError('The layer grid does not match the climatology grid')
+        nodata = dataset._nodata[0]
+        for b in dataset.ReadBlocksAsArray():
+            window = (b.x_off, b.y_off, b.x_size, b.y_size)
+            valid = ~invalid_mask(b.data, nodata)
+            x = b.data.astype(numpy.float64)
+            n, mean, m2 = [self.read(name, window) for name in ('COUNT', 'MEAN', 'M2')]
+            n[valid] += 1
+            delta = numpy.where(valid, x - mean, 0)
+            mean += numpy.where(valid, delta / numpy.maximum(n, 1), 0)
+            m2 += numpy.where(valid, delta * (x - mean), 0)
+            for name, data in (('COUNT', n), ('MEAN', mean), ('M2', m2)):
+                self.datasets[name].GetRasterBand(1).WriteArray(data, b.x_off, b.y_off)
+        for ds in self.datasets.values():
+            ds.FlushCache()
+
+    def read(self, name, window):
+        return self.datasets[name].GetRasterBand(1).ReadAsArray(*window).astype(numpy.float64)
+
+    def read_std(self, window):
+        n = self.read('COUNT', window)
+        m2 = self.read('M2', window)
+        return numpy.sqrt(m2 / numpy.maximum(n, 1))
+
+
+class Climatology:
+    """
+    Long-term per calendar month and per day of year mean and standard deviation
+    of TRMM rainfall, cached in a folder so the baseline is computed once and
+    anomalies only read the target period.
+
+    Days of the year are keyed by month and day ('0731'), so leap years don't
+    shift the calendar. Monthly statistics are computed on monthly totals and
+    only complete months are included.
+    """
+
+    def __init__(self, folder):
+        """
+        @param folder: Cache folder, created if missing.
+        @type folder: str
+        """
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.index_file = os.path.join(folder, 'climatology.json')
+        self.index = {'days': [], 'months': []}
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+
+    def build(self, daily_layers):
+        """
+        Add daily totals to the baseline. Days and months already in the cache are skipped,
+        so the baseline can be extended when new data are available.
+        @param daily_layers: Daily totals, e.g. the '_SUM.tif' files produced by the plugin.
+        @type daily_layers: dict of datetime.date: path
+        """
+        dates = sorted(daily_layers.keys())
+        done_days = set(self.index['days'])
+        done_months = set(self.index['months'])
+        for d in dates:
+            code = d.isoformat()
+            if code not in done_days:
+                ds = Dataset(daily_layers[d])
+                self.statistics('DAY', d, ds).update(ds)
+                done_days.add(code)
+        months = {}
+        for d in dates:
+            months.setdefault((d.year, d.month), []).append(daily_layers[d])
+        for (year, month), layers in sorted(months.items()):
+            code = '%04d-%02d' % (year, month)
+            if code in done_months or len(layers) < calendar.monthrange(year, month)[1]:
+                continue
+            total = aggregate_daily(layers, 'SUM')
+            self.statistics('MONTH', (year, month), total).update(total)
+            done_months.add(code)
+        self.index['days'] = sorted(done_days)
+        self.index['months'] = sorted(done_months)
+        with open(self.index_file, 'w') as f:
+            json.dump(self.index, f, indent=2)
+
+    def statistics(self, period, key, prototype_ds=None):
+        """
+        @param period: 'DAY' or 'MONTH'
+        @type period: str
+        @param key: A date for 'DAY', a date or a (year, month) tuple for 'MONTH'
+        @return: The PixelStatistics of the calendar day or month.
+        """
+        prefix = os.path.join(self.folder, period + '_' + self.calendar_key(period, key))
+        if prototype_ds is None and not os.path.isfile(prefix + '_COUNT.tif'):
+            raise RuntimeError('No climatology for ' + period + ' ' + self.calendar_key(period, key))
+        return PixelStatistics(prefix, prototype_ds)
+
+    def calendar_key(self, period, key):
+        if period == 'DAY':
+            return '%02d%02d' % (key.month, key.day)
+        elif period == 'MONTH':
+            month = key[1] if type(key) is tuple else key.month
+            return '%02d' % month
+        raise ValueError('period must be one of "DAY"|"MONTH"')
+
+    def anomaly(self, target, period, key, standardized=False):
+        """
+        Difference between a daily or monthly total and the long-term mean, optionally
+        divided by the long-term standard deviation (standardized anomaly).
+        @param target: Daily or monthly total, a path, a Dataset or a list of daily totals for 'MONTH'.
+        @param period: 'DAY' or 'MONTH'
+        @type period: str
+        @param key: Date of the target, see statistics.
+        @param standardized: Divide by the standard deviation.
+        @type standardized: bool
+        @return: Float32 TemporaryDataset, NODATA where the anomaly is undefined.
+        """
+        if type(target) is list:
+            target = aggregate_daily(target, 'SUM')
+        elif not hasattr(target, 'ReadBlocksAsArray'):
+            target = Dataset(target)
+        baseline = self.statistics(period, key)
+        nodata = target._nodata[0]
+        out = TemporaryDataset(target._x_size, target._y_size, 1, gdal.GDT_Float32, target._srs, target._gt, [NODATA])
+        for b in target.ReadBlocksAsArray():
+            window = (b.x_off, b.y_off, b.x_size, b.y_size)
+            invalid = invalid_mask(b.data, nodata) | (baseline.read('COUNT', window) == 0)
+            x = b.data.astype(numpy.float64)
+            data = x - baseline.read('MEAN', window)
+            if standardized:
+                std = baseline.read_std(window)
+                invalid |= std == 0
+                data /= numpy.where(std == 0, 1, std)
+            data[invalid] = NODATA
+            out.write_data(data.astype(numpy.float32), b.x_off, b.y_off)
+        out.FlushCache()
+        return out
+
+    def standardized_anomaly(self, target, period, key):
+        return self.anomaly(target, period, key, standardized=True)
@@ -1,7 +1,12 @@
 from ftplib import FTP
+from ftplib import all_errors
 import datetime
 import os
+import time
 import webbrowser
+from osgeo import gdal
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import HandlePool
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_telemetry import Telemetry
 
 
 conf = {
@@ -11,10 +16,42 @@ conf = {
             "base_url": "arthurhou.pps.eosdis.nasa.gov",
             "data_dir": "/pub/trmmdata/GIS/"
         }
-    }
+    },
+    # Product versions, in order of preference, e.g. 3B42.20150731.03.7A.tif over 3B42.20150731.03.7.tif
+    "versions": ["7A", "7"]
 }
 
 
+def resolve_products(file_names, versions=None):
+    """
+    Select one version of each product and timestamp of a listing.
+    @param file_names: File names of a day folder, e.g. ['3B42.20150731.03.7.tfw', '3B42.20150731.03.7.tif']
+    @type file_names: list
+    @param versions: Accepted versions, in order of preference. Default is conf['versions'].
+    @type versions: list
+    @return: The selected .tif layers, each followed by its .tfw when listed.
+    """
+    if versions is None:
+        versions = conf['versions']
+    products = {}
+    for file_name in file_names:
+        parts = file_name.split('.')
+        if len(parts) != 5 or parts[4] != 'tif' or parts[3] not in versions:
+            continue
+        key = '.'.join(parts[0:3])
+        rank = versions.index(parts[3])
+        if key not in products or rank < products[key][0]:
+            products[key] = (rank, file_name)
+    listed = set(file_names)
+    out = []
+    for key in sorted(products):
+        layer = products[key][1]
+        out.append(layer)
+        if layer.replace('.tif', '.tfw') in listed:
+            out.append(layer.replace('.tif', '.tfw'))
+    return out
+
+
 def list_years(username, password):
     """
     List all the available years.
@@ -157,31 +194,29 @@ def list_layers_subset(username, password, year, month, from_day, to_day):
                 ftp.cwd('../')
             ftp.cwd(days[i])
             l = ftp.nlst()
-            l.sort()
-            fao_layers = filter(lambda x: '.tif' in x, l)
+            fao_layers = filter(lambda x: x.endswith('.tif'), resolve_products(l))
             for layer in fao_layers:
-                if '.7.' in layer or '.7A.' in layer:
-                    code = layer
-                    hour = layer[0:layer.index('.tif')].split('.')[2]
-                    label = layer[0:layer.index('.tif')].split('.')[0]
-                    label += ' ('
-                    label += '-'.join([year, month, days[i]])
-                    label += ', ' + hour + ')'
-                    file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
-                    out.append({
-                        'file_name': code,
-                        'file_path': file_path,
-                        'label': label,
-                        'size': None
-                    })
-                    code = code.replace('.tif', '.tfw')
-                    file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
-                    out.append({
-                        'file_name': code,
-                        'file_path': file_path,
-                        'label': label,
-                        'size': None
-                    })
+                code = layer
+                hour = layer[0:layer.index('.tif')].split('.')[2]
+                label = layer[0:layer.index('.tif')].split('.')[0]
+                label += ' ('
+                label += '-'.join([year, month, days[i]])
+                label += ', ' + hour + ')'
+                file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
+                out.append({
+                    'file_name': code,
+                    'file_path': file_path,
+                    'label': label,
+                    'size': None
+                })
+                code = code.replace('.tif', '.tfw')
+                file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
+                out.append({
+                    'file_name': code,
+                    'file_path': file_path,
+                    'label': label,
+                    'size': None
+                })
         ftp.quit()
         return out
 
@@ -213,31 +248,29 @@ def list_layers_month_subset(username, password, year, month):
                 ftp.cwd('../')
             ftp.cwd(days[i])
             l = ftp.nlst()
-            l.sort()
-            fao_layers = filter(lambda x: '.tif' in x, l)
+            fao_layers = filter(lambda x: x.endswith('.tif'), resolve_products(l))
             for layer in fao_layers:
-                if '.7.' in layer or '.7A.' in layer:
-                    code = layer
-                    hour = layer[0:layer.index('.tif')].split('.')[2]
-                    label = layer[0:layer.index('.tif')].split('.')[0]
-                    label += ' ('
-                    label += '-'.join([year, month, days[i]])
-                    label += ', ' + hour + ')'
-                    file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
-                    out.append({
-                        'file_name': code,
-                        'file_path': file_path,
-                        'label': label,
-                        'size': None
-                    })
-                    code = code.replace('.tif', '.tfw')
-                    file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
-                    out.append({
-                        'file_name': code,
-                        'file_path': file_path,
-                        'label': label,
-                        'size': None
-                    })
+                code = layer
+                hour = layer[0:layer.index('.tif')].split('.')[2]
+                label = layer[0:layer.index('.tif')].split('.')[0]
+                label += ' ('
+                label += '-'.join([year, month, days[i]])
+                label += ', ' + hour + ')'
+                file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
+                out.append({
+                    'file_name': code,
+                    'file_path': file_path,
+                    'label': label,
+                    'size': None
+                })
+                code = code.replace('.tif', '.tfw')
+                file_path = file_path_root + year + '/' + month + '/' + days[i] + '/' + code
+                out.append({
+                    'file_name': code,
+                    'file_path': file_path,
+                    'label': label,
+                    'size': None
+                })
         ftp.quit()
         return out
 
@@ -247,38 +280,207 @@ def create_account():
     pass
 
 
-def list_layers(username, password, year, month, day, download_path):
+def list_layers(username, password, year, month, day, download_path, telemetry=None, retries=2, progress=None):
+    """
+    Download the layers of a day, files already in the download folder are skipped.
+    Only the preferred version of each timestamp is downloaded, see resolve_products.
+    @param year: e.g. '2010'
+    @type year: str | int
+    @param month: e.g. '02'
+    @type month: str | int
+    @param day: e.g. '02'
+    @type day: str | int
+    @param download_path: Root of the year/month/day download folders.
+    @type download_path: str
+    @param telemetry: Collects the latencies, transfers and counters of the run.
+    @type telemetry: Telemetry
+    @param retries: Attempts after a failed transfer.
+    @type retries: int
+    @param progress: Reset to the bytes to download and updated as they are received.
+    @type progress: Progress
+    @return: Paths of the downloaded layers.
+    """
+    if telemetry is None:
+        telemetry = Telemetry()
     month = month if type(month) is str else str(month)
     month = month if len(month) == 2 else '0' + month
     day = day if type(day) is str else str(day)
     day = day if len(day) == 2 else '0' + day
     if conf['source']['type'] == 'FTP':
-        ftp = FTP(conf['source']['ftp']['base_url'])
-        ftp.login(username, password)
-        ftp.cwd(conf['source']['ftp']['data_dir'])
-        ftp.cwd(str(year))
-        ftp.cwd(month)
-        ftp.cwd(day)
-        l = ftp.nlst()
-        l.sort()
-        fao_layers = l
+        ftp, fao_layers = open_day(username, password, year, month, day, telemetry)
         out = []
         final_folder = os.path.join(download_path, str(year), str(month), str(day))
         if not os.path.exists(final_folder):
             os.makedirs(final_folder)
+        if progress is not None:
+            missing = [l for l in fao_layers if os.path.isfile(os.path.join(final_folder, l)) is False]
+            progress.reset(transfer_size(ftp, missing))
         for layer in fao_layers:
-            if '.7.' in layer or '.7A.' in layer:
-                local_filename = os.path.join(final_folder, layer)
-                out.append(local_filename)
-                if os.path.isfile(local_filename) is False:
-                    file = open(local_filename, 'wb+')
-                    ftp.retrbinary('RETR %s' % layer, file.write)
+            local_filename = os.path.join(final_folder, layer)
+            out.append(local_filename)
+            if os.path.isfile(local_filename) is False:
+                download(ftp, layer, local_filename, telemetry, retries, progress)
+            else:
+                telemetry.count('files_skipped')
+                telemetry.count('bytes_skipped', os.path.getsize(local_filename))
         ftp.quit()
         return out
 
+
+def stream_layers(username, password, year, month, day, telemetry=None, retries=2, progress=None):
+    """
+    Download the layers of a day in memory (/vsimem), nothing is written to disk.
+    The layers must be freed with release_layers once they have been processed.
+    @param year: e.g. '2010'
+    @type year: str | int
+    @param month: e.g. '02'
+    @type month: str | int
+    @param day: e.g. '02'
+    @type day: str | int
+    @param telemetry: Collects the latencies, transfers and counters of the run.
+    @type telemetry: Telemetry
+    @param retries: Attempts after a failed transfer.
+    @type retries: int
+    @param progress: Reset to the bytes to download and updated as they are received.
+    @type progress: Progress
+    @return: /vsimem paths of the layers.
+    """
+    if telemetry is None:
+        telemetry = Telemetry()
+    month = month if type(month) is str else str(month)
+    month = month if len(month) == 2 else '0' + month
+    day = day if type(day) is str else str(day)
+    day = day if len(day) == 2 else '0' + day
+    if conf['source']['type'] == 'FTP':
+        ftp, fao_layers = open_day(username, password, year, month, day, telemetry)
+        folder = '/vsimem/trmm/' + '/'.join([str(year), month, day]) + '/'
+        out = []
+        try:
+            if progress is not None:
+                progress.reset(transfer_size(ftp, fao_layers))
+            for layer in fao_layers:
+                out.append(folder + layer)
+                download(ftp, layer, folder + layer, telemetry, retries, progress)
+        except:
+            # Any failure, also e.g. out of memory, frees what was downloaded
+            release_layers(out)
+            raise
+        finally:
+            try:
+                ftp.quit()
+            except all_errors:
+                ftp.close()
+        return out
+
+
+def release_layers(layers):
+    """
+    Free the layers downloaded in memory by stream_layers.
+    @param layers: /vsimem paths of the layers.
+    @type layers: list
+    """
+    for layer in layers:
+        HandlePool.close(layer)
+        gdal.Unlink(layer)
+
+
+def open_day(username, password, year, month, day, telemetry):
+    """
+    Connect to the FTP and list the folder of a day.
+    @return: The FTP connection, in the day folder, and the layers to download, see resolve_products.
+    """
+    ftp = connect(username, password, telemetry)
+    with telemetry.timer('ftp_cwd'):
+        ftp.cwd(conf['source']['ftp']['data_dir'])
+        ftp.cwd(str(year))
+        ftp.cwd(month)
+        ftp.cwd(day)
+    with telemetry.timer('ftp_listing'):
+        l = ftp.nlst()
+    return ftp, resolve_products(l)
+
+
+def connect(username, password, telemetry):
+    """
+    Connect and login to the FTP, timing both steps.
+    @return: The FTP connection, in the root folder.
+    """
+    with telemetry.timer('ftp_connect'):
+        ftp = FTP(conf['source']['ftp']['base_url'])
+    with telemetry.timer('ftp_login'):
+        ftp.login(username, password)
+    return ftp
+
+
+def transfer_size(ftp, file_names):
+    """
+    @return: The total size in bytes of files of the current FTP folder, 0 if the server doesn't report it.
+    """
+    try:
+        # SIZE is only reliable in binary mode
+        ftp.voidcmd('TYPE I')
+        return sum(ftp.size(file_name) or 0 for file_name in file_names)
+    except all_errors:
+        return 0
+
+
+def download(ftp, file_name, local_filename, telemetry, retries=2, progress=None):
+    """
+    Download a file of the current FTP folder. A failed transfer is retried,
+    partial files are removed so they are not skipped by the next run.
+    """
+    for attempt in range(retries + 1):
+        start = time.time()
+        try:
+            size = retrieve(ftp, file_name, local_filename, progress)
+            telemetry.add_transfer(file_name, size, time.time() - start)
+            return
+        except all_errors:
+            if local_filename.startswith('/vsimem/'):
+                gdal.Unlink(local_filename)
+            elif os.path.isfile(local_filename):
+                os.remove(local_filename)
+            if attempt == retries:
+                telemetry.count('failed_transfers')
+                raise
+            telemetry.count('retries')
+
 # print list_layers('guido.barbaglia@gmail.com', 'guido.barbaglia@gmail.com', 2015, 7, 31, '/Users/simona/Desktop/QGIS_TEST')
 
 
+def retrieve(ftp, file_name, local_filename, progress=None):
+    """
+    Write a file of the current FTP folder chunk by chunk, /vsimem/ paths are written in memory.
+    @param progress: Updated with the bytes of each chunk.
+    @type progress: Progress
+    @return: The number of bytes written.
+    """
+    if local_filename.startswith('/vsimem/'):
+        f = gdal.VSIFOpenL(local_filename, 'wb')
+        write = lambda data: gdal.VSIFWriteL(data, 1, len(data), f)
+        close = lambda: gdal.VSIFCloseL(f)
+    else:
+        f = open(local_filename, 'wb')
+        write, close = f.write, f.close
+    size = [0]
+
+    def callback(data):
+        size[0] += len(data)
+        write(data)
+        if progress is not None:
+            progress.update_progress(len(data))
+    try:
+        ftp.retrbinary('RETR %s' % file_name, callback)
+    except all_errors:
+        # The partial file is downloaded again
+        if progress is not None:
+            progress.update_progress(-size[0])
+        raise
+    finally:
+        close()
+    return size[0]
+
+
 def date_range(start_date, end_date):
     dates = []
     delta = end_date - start_date
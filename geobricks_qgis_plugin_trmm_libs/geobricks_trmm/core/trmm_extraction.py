@@ -0,0 +1,306 @@
+import csv
+import os
+import numpy
+from osgeo import gdal
+from osgeo import ogr
+from osgeo import osr
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import geometry
+
+
+def extract_vector(layers, vector_path, field, output):
+    """
+    Extract the time series of the layers at the features of a vector layer: values
+    at points, or zonal statistics for polygons. Features are reprojected to the
+    coordinate system of the layers when both are known, otherwise they must be in
+    the coordinate system of the layers, i.e. longitude and latitude for TRMM.
+    @param layers: Paths of the layers, '.tfw' files are skipped.
+    @type layers: list
+    @param vector_path: OGR readable point or polygon layer.
+    @type vector_path: str
+    @param field: Attribute identifying the features.
+    @type field: str
+    @param output: CSV or Parquet ('.parquet') file.
+    @type output: str
+    @return: The number of rows written.
+    """
+    layers = [l for l in layers if '.tif' in l]
+    vector = ogr.Open(vector_path)
+    if vector is None:
+        raise RuntimeError('Unable to open ' + vector_path)
+    layer = vector.GetLayer(0)
+    if ogr.GT_Flatten(layer.GetGeomType()) in (ogr.wkbPoint, ogr.wkbMultiPoint):
+        transform = None
+        if len(layers) > 0:
+            transform = layer_transform(layer, gdal.Open(layers[0]).GetProjection())
+        points = []
+        for f in layer:
+            g = f.GetGeometryRef().Centroid()
+            if transform is not None:
+                g.Transform(transform)
+            points.append((f.GetField(field), g.GetX(), g.GetY()))
+        return extract_points(layers, points, output)
+    return extract_zonal(layers, vector_path, field, output)
+
+
+def extract_points(layers, points, output):
+    """
+    Extract the time series of the layers at a set of points, without loading whole rasters.
+    Only the window covering the points is read from each layer.
+    @param layers: Paths of the layers, e.g. the 3-hourly TIFFs or the daily aggregates.
+    @type layers: list
+    @param points: (id, x, y) tuples, in the coordinate system of the layers.
+    @type points: list
+    @param output: CSV or Parquet ('.parquet') file with 'layer', 'id' and 'value' columns, nodata is empty.
+    @type output: str
+    @return: The number of rows written.
+    """
+    ids = [p[0] for p in points]
+    xs = numpy.array([p[1] for p in points], dtype=numpy.float64)
+    ys = numpy.array([p[2] for p in points], dtype=numpy.float64)
+    grids = {}
+    rows = 0
+    writer = TableWriter(output, ['layer', 'id', 'value'])
+    try:
+        for path in layers:
+            ds = gdal.Open(path)
+            band = ds.GetRasterBand(1)
+            key = (ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize)
+            if key not in grids:
+                grids[key] = point_pixels(xs, ys, *key)
+            px, py, inside, window = grids[key]
+            if window is None:
+                raise RuntimeError('None of the points are inside ' + path + ', check their coordinate system')
+            values = numpy.empty(len(ids), dtype=numpy.float64)
+            values.fill(numpy.nan)
+            data = band.ReadAsArray(*window)
+            sample = data[py[inside] - window[1], px[inside] - window[0]]
+            # Nodata is compared in the data type of the band, e.g. Float32 -9999.9
+            values[inside] = numpy.where(invalid_mask(sample, band.GetNoDataValue()), numpy.nan, sample)
+            ds = None
+            writer.write({'layer': [os.path.basename(path)] * len(ids), 'id': ids, 'value': values})
+            rows += len(ids)
+    finally:
+        writer.close()
+    return rows
+
+
+def extract_zonal(layers, vector_path, field, output):
+    """
+    Extract zonal statistics (polygon count, sum, mean, min and max) of the layers.
+    Polygons are rasterized once per grid and only the window covering them is read from each layer.
+    Cells are assigned to the polygon containing their centre, polygons smaller than a cell
+    (containing no cell centre) use the cells they touch.
+    @param layers: Paths of the layers, e.g. the 3-hourly TIFFs or the daily aggregates.
+    @type layers: list
+    @param vector_path: OGR readable polygon layer, e.g. a Shapefile of districts.
+    @type vector_path: str
+    @param field: Attribute identifying the zones.
+    @type field: str
+    @param output: CSV or Parquet ('.parquet') file with 'layer', 'zone', 'count', 'sum', 'mean', 'min' and 'max' columns.
+    @type output: str
+    @return: The number of rows written.
+    """
+    vector = ogr.Open(vector_path)
+    if vector is None:
+        raise RuntimeError('Unable to open ' + vector_path)
+    names = [f.GetField(field) for f in vector.GetLayer(0)]
+    grids = {}
+    rows = 0
+    writer = TableWriter(output, ['layer', 'zone', 'count', 'sum', 'mean', 'min', 'max'])
+    try:
+        for path in layers:
+            ds = gdal.Open(path)
+            band = ds.GetRasterBand(1)
+            key = (ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize, ds.GetProjection())
+            if key not in grids:
+                grids[key] = rasterize_zones(vector.GetLayer(0), *key)
+            ids, window, touched = grids[key]
+            if window is None:
+                raise RuntimeError('None of the zones of ' + vector_path + ' overlap ' + path + ', check their coordinate system')
+            out = {'count': numpy.zeros(len(names)), 'sum': numpy.zeros(len(names))}
+            out['min'] = numpy.empty(len(names))
+            out['max'] = numpy.empty(len(names))
+            out['min'].fill(numpy.nan)
+            out['max'].fill(numpy.nan)
+            raw = band.ReadAsArray(*window)
+            invalid = invalid_mask(raw, band.GetNoDataValue())
+            data = raw.astype(numpy.float64)
+            valid = (ids > 0) & ~invalid
+            zone_ids = ids[valid]
+            values = data[valid]
+            out['count'] = numpy.bincount(zone_ids, minlength=len(names) + 1)[1:].astype(numpy.float64)
+            out['sum'] = numpy.bincount(zone_ids, weights=values, minlength=len(names) + 1)[1:]
+            if len(values) > 0:
+                order = numpy.lexsort((values, zone_ids))
+                sorted_ids = zone_ids[order]
+                present = numpy.unique(sorted_ids)
+                first = numpy.searchsorted(sorted_ids, present, side='left')
+                last = numpy.searchsorted(sorted_ids, present, side='right') - 1
+                out['min'][present - 1] = values[order][first]
+                out['max'][present - 1] = values[order][last]
+            for zone, ys, xs in touched:
+                values = data[ys, xs][~invalid[ys, xs]]
+                out['count'][zone - 1] = len(values)
+                if len(values) > 0:
+                    out['sum'][zone - 1] = values.sum()
+                    out['min'][zone - 1] = values.min()
+                    out['max'][zone - 1] = values.max()
+            ds = None
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                mean = out['sum'] / out['count']
+            writer.write({'layer': [os.path.basename(path)] * len(names), 'zone': names,
+                          'count': out['count'], 'sum': out['sum'], 'mean': mean,
+                          'min': out['min'], 'max': out['max']})
+            rows += len(names)
+    finally:
+        writer.close()
+    return rows
+
+
+def point_pixels(xs, ys, gt, cols, rows):
+    """
+    Pixel indices of map coordinates on a grid, and the window covering those inside it.
+    @return: px, py, inside (boolean array) and (xoff, yoff, xsize, ysize) or None.
+    """
+    px, py = geometry.MapToPixelArray(xs, ys, gt)
+    px = numpy.floor(px).astype(numpy.int64)
+    py = numpy.floor(py).astype(numpy.int64)
+    inside = (px >= 0) & (px < cols) & (py >= 0) & (py < rows)
+    if not inside.any():
+        return px, py, inside, None
+    xoff, yoff = int(px[inside].min()), int(py[inside].min())
+    window = (xoff, yoff, int(px[inside].max()) - xoff + 1, int(py[inside].max()) - yoff + 1)
+    return px, py, inside, window
+
+
+def rasterize_zones(layer, gt, cols, rows, srs):
+    """
+    Burn the 1-based index of each polygon on a grid, the polygons are reprojected to the grid
+    coordinate system when both are known. Polygons containing no cell centre are rasterized
+    again on their own, with the cells they touch.
+    @return: The zone index array of the window covering the polygons, the window (or None),
+    and (zone, rows, cols) in the window of the polygons smaller than a cell.
+    """
+    transform = layer_transform(layer, srs)
+    target = layer.GetSpatialRef()
+    if transform is not None:
+        target = osr.SpatialReference(srs)
+    driver = ogr.GetDriverByName('Memory')
+    source = driver.CreateDataSource('zones')
+    zones = source.CreateLayer('zones', target, ogr.wkbMultiPolygon)
+    zones.CreateField(ogr.FieldDefn('zone', ogr.OFTInteger))
+    layer.ResetReading()
+    count = 0
+    for i, feature in enumerate(layer):
+        geometry = feature.GetGeometryRef().Clone()
+        if transform is not None:
+            geometry.Transform(transform)
+        zone = ogr.Feature(zones.GetLayerDefn())
+        zone.SetGeometry(geometry)
+        zone.SetField('zone', i + 1)
+        zones.CreateFeature(zone)
+        count = i + 1
+
+    def rasterize(options, datatype):
+        ds = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, datatype)
+        ds.SetGeoTransform(gt)
+        ds.SetProjection(srs)
+        gdal.RasterizeLayer(ds, [1], zones, burn_values=[1], options=options)
+        return ds.GetRasterBand(1).ReadAsArray()
+
+    ids = rasterize(['ATTRIBUTE=zone'], gdal.GDT_Int32)
+    touched = []
+    for zone in sorted(set(range(1, count + 1)) - set(numpy.unique(ids))):
+        zones.SetAttributeFilter('zone = %d' % zone)
+        ys, xs = numpy.nonzero(rasterize(['ALL_TOUCHED=TRUE'], gdal.GDT_Byte))
+        if len(xs) > 0:
+            touched.append((zone, ys, xs))
+    zones.SetAttributeFilter(None)
+    ys, xs = numpy.nonzero(ids)
+    ys = numpy.concatenate([ys] + [t[1] for t in touched])
+    xs = numpy.concatenate([xs] + [t[2] for t in touched])
+    if len(xs) == 0:
+        return None, None, []
+    window = (int(xs.min()), int(ys.min()), int(xs.max() - xs.min()) + 1, int(ys.max() - ys.min()) + 1)
+    ids = ids[window[1]:window[1] + window[3], window[0]:window[0] + window[2]].copy()
+    touched = [(zone, ys - window[1], xs - window[0]) for zone, ys, xs in touched]
+    return ids, window, touched
+
+
+def layer_transform(layer, projection):
+    """
+    @param layer: OGR layer.
+    @param projection: WKT of the raster coordinate system.
+    @type projection: str
+    @return: The osr.CoordinateTransformation from the layer to the raster coordinate system,
+    None if they are the same or one of them is unknown.
+    """
+    source = layer.GetSpatialRef()
+    if source is None or not projection:
+        return None
+    source = source.Clone()
+    target = osr.SpatialReference(projection)
+    if source.IsSame(target):
+        return None
+    for srs in (source, target):
+        # GDAL 3 uses the axis order of the authority (latitude first for EPSG:4326)
+        if hasattr(srs, 'SetAxisMappingStrategy'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(source, target)
+
+
+def invalid_mask(data, nodata):
+    """
+    NaN and nodata values, compared in the data type of the band: a Float32 nodata
+    of -9999.9 is -9999.900390625 once the data are cast to Float64.
+    @return: Boolean array, True where the value is not valid.
+    """
+    invalid = numpy.isnan(data)
+    if nodata is not None:
+        invalid |= data == numpy.asarray(nodata, data.dtype)
+    return invalid
+
+
+class TableWriter:
+    """
+    Stream rows to a CSV file or, when the path ends with '.parquet' and pyarrow
+    is installed, to a Parquet file (one row group per write).
+    """
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.parquet = path.lower().endswith('.parquet')
+        if self.parquet:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError('pyarrow is required to write Parquet files')
+            self.pyarrow = pyarrow
+            self.path = path
+            self.writer = None
+        else:
+            self.file = open(path, 'wb')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(columns)
+
+    def write(self, data):
+        """
+        @param data: Column name: values, all the same length.
+        @type data: dict
+        """
+        if self.parquet:
+            table = self.pyarrow.Table.from_arrays([self.pyarrow.array(list(data[c])) for c in self.columns], self.columns)
+            if self.writer is None:
+                self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            columns = [[None if v != v else v for v in data[c]] if c not in ('layer', 'id', 'zone') else data[c] for c in self.columns]
+            self.writer.writerows(zip(*columns))
+
+    def close(self):
+        if self.parquet:
+            if self.writer is not None:
+                self.writer.close()
+        else:
+            self.file.close()
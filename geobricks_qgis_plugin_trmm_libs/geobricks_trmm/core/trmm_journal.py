@@ -0,0 +1,116 @@
+import json
+import os
+
+
+class Journal:
+    """
+    Append-only record of the outputs of a download folder, one JSON line per
+    processed date and aggregation with its parameters, inputs and output
+    (path, name, size, mtime). A date whose parameters are the same and whose
+    output and local inputs are unchanged doesn't need to be processed again,
+    also when a previous run was interrupted.
+    """
+
+    def __init__(self, path):
+        """
+        @param path: Journal file, e.g. <download_path>/trmm_journal.json
+        @type path: str
+        """
+        self.path = path
+        self.entries = {}
+        lines = 0
+        broken = False
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of an interrupted run
+                        broken = True
+                        continue
+                    self.entries[entry['key']] = entry
+                    lines += 1
+        # Dates processed again leave old lines behind, rewrite the journal once they are the majority
+        if broken or lines > 2 * len(self.entries):
+            self.compact()
+
+    def is_current(self, key, parameters):
+        """
+        @param key: e.g. the date and aggregation, '2015-07-31_SUM'
+        @type key: str
+        @param parameters: Parameters of the processing, e.g. {'aggregation': 'SUM'}
+        @type parameters: dict
+        @return: True if the output of key is up to date.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['parameters'] != parameters or entry['output'] is None:
+            return False
+        if file_signature(entry['output']['path']) != entry['output']:
+            return False
+        for recorded in entry['inputs']:
+            # Inputs that were not on disk (e.g. /vsimem) can't be checked
+            if recorded['size'] is not None and file_signature(recorded['path']) != recorded:
+                return False
+        return True
+
+    def record(self, key, parameters, inputs, output):
+        """
+        Record a processed date, the line is written immediately.
+        @param key: e.g. the date and aggregation, '2015-07-31_SUM'
+        @type key: str
+        @param parameters: Parameters of the processing, e.g. {'aggregation': 'SUM'}
+        @type parameters: dict
+        @param inputs: Paths of the inputs.
+        @type inputs: list
+        @param output: Path of the output.
+        @type output: str
+        """
+        entry = {
+            'key': key,
+            'parameters': parameters,
+            'inputs': [file_signature(i) for i in inputs],
+            'output': file_signature(output) if output is not None else None
+        }
+        self.entries[key] = entry
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def output(self, key):
+        """
+        @param key: e.g. the date and aggregation, '2015-07-31_SUM'
+        @type key: str
+        @return: The path of the recorded output of key, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['output'] is None:
+            return None
+        return entry['output']['path']
+
+    def compact(self):
+        """
+        Rewrite the journal with the latest line of each key.
+        """
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            for key in sorted(self.entries):
+                f.write(json.dumps(self.entries[key], sort_keys=True) + '\n')
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        os.rename(temporary, self.path)
+
+
+def file_signature(path):
+    """
+    @param path: File path.
+    @type path: str
+    @return: path, name, size and mtime, size and mtime are None if the file is not on disk.
+    """
+    signature = {'path': path, 'name': os.path.basename(path), 'size': None, 'mtime': None}
+    try:
+        st = os.stat(path)
+        signature['size'] = st.st_size
+        signature['mtime'] = st.st_mtime
+    except OSError:
+        pass
+    return signature
@@ -0,0 +1,130 @@
+import contextlib
+import json
+import time
+
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class Telemetry:
+    """
+    Counters, latencies and transfers of a download/processing run, e.g. FTP
+    connect and login times, listing round-trips, per file MB/s, retries and
+    files skipped because they were already downloaded.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.latencies = {}
+        self.transfers = []
+
+    def count(self, name, value=1):
+        """
+        @param name: Counter, e.g. 'retries'
+        @type name: str
+        @param value: Increment.
+        @type value: int
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Time a step, e.g. with telemetry.timer('ftp_login'): ftp.login(username, password)
+        @param name: Latency name.
+        @type name: str
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.latencies.setdefault(name, []).append(time.time() - start)
+
+    def add_transfer(self, file_name, size, seconds):
+        """
+        Record a downloaded file.
+        @param file_name: Remote file name.
+        @type file_name: str
+        @param size: Bytes transferred.
+        @type size: int
+        @param seconds: Transfer time.
+        @type seconds: float
+        """
+        self.transfers.append({'file_name': file_name, 'bytes': size, 'seconds': seconds,
+                               'mb_s': size / 1024.0 ** 2 / seconds if seconds > 0 else None})
+        self.latencies.setdefault('transfer', []).append(seconds)
+        self.count('files_downloaded')
+        self.count('bytes_downloaded', size)
+
+    def report(self):
+        """
+        @return: The run report, a JSON serializable dict.
+        """
+        seconds = sum(t['seconds'] for t in self.transfers)
+        size = sum(t['bytes'] for t in self.transfers)
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'duration': time.time() - self.started,
+            'counters': dict(self.counters),
+            'latencies': dict((name, latency_summary(values)) for name, values in self.latencies.items()),
+            'throughput_mb_s': size / 1024.0 ** 2 / seconds if seconds > 0 else None,
+            'transfers': list(self.transfers)
+        }
+
+    def save(self, path):
+        """
+        Write the run report to a JSON file.
+        @param path: Output file.
+        @type path: str
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def summary(self):
+        """
+        @return: The report as text lines, e.g. for QgsMessageLog.
+        """
+        report = self.report()
+        lines = ['Run time: %.1f s' % report['duration']]
+        if report['throughput_mb_s'] is not None:
+            lines.append('Throughput: %.2f MB/s' % report['throughput_mb_s'])
+        for name in sorted(report['counters']):
+            lines.append('%s: %s' % (name, report['counters'][name]))
+        for name in sorted(report['latencies']):
+            l = report['latencies'][name]
+            lines.append('%s: %d in %.2f s, mean %.3f s, p90 %.3f s, max %.3f s' % (
+                name, l['count'], l['total'], l['mean'], l['p90'], l['max']))
+        return lines
+
+
+def latency_summary(values):
+    """
+    @param values: Latencies, in seconds.
+    @type values: list
+    @return: count, total, mean, min, p50, p90, max and a histogram with the upper bound of each bucket.
+    """
+    values = sorted(values)
+    histogram = []
+    for bound in LATENCY_BUCKETS + [None]:
+        n = len([v for v in values if bound is None or v <= bound]) - sum(h['count'] for h in histogram)
+        histogram.append({'le': bound, 'count': n})
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'mean': sum(values) / len(values),
+        'min': values[0],
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'max': values[-1],
+        'histogram': histogram
+    }
+
+
+def percentile(values, q):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    index = int(round(q / 100.0 * (len(values) - 1)))
+    return values[index]
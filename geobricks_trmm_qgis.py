@@ -21,16 +21,34 @@
  ***************************************************************************/
 """
 import os.path
+import contextlib
+import datetime
 from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
 from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import format_progress
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import HandlePool
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import HeaderCache
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Progress
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import aggregate_daily
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import daily_operations
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import rolling_window_days
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import RollingWindow
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import conf
 from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import date_range
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_extraction import extract_vector
 from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import list_layers
 from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import open_browser_registration
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import release_layers
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import stream_layers
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_journal import Journal
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_telemetry import Telemetry
 from PyQt4.QtCore import QSettings
 from PyQt4.QtCore import QTranslator
 from PyQt4.QtCore import qVersion
 from PyQt4.QtCore import QCoreApplication
 from PyQt4.QtCore import QDate
+from PyQt4.QtCore import QObject
+from PyQt4.QtCore import pyqtSignal
 from PyQt4.QtGui import QAction
 from PyQt4.QtGui import QIcon
 from PyQt4.QtGui import QFileDialog
@@ -88,6 +106,9 @@ class GeobricksTRMM:
         self.frequency = QComboBox()
         self.frequency.addItem(self.tr('Daily Sum'), 'SUM')
         self.frequency.addItem(self.tr('Daily Average'), 'AVG')
+        self.frequency.addItem(self.tr('3-Day Running Total'), 'SUM_3D')
+        self.frequency.addItem(self.tr('7-Day Running Total'), 'SUM_7D')
+        self.frequency.addItem(self.tr('30-Day Running Total'), 'SUM_30D')
         self.frequency.addItem(self.tr('None'), 'NONE')
         self.from_date = QCalendarWidget()
         self.to_date = QCalendarWidget()
@@ -110,6 +131,8 @@ class GeobricksTRMM:
         self.password_widget = QWidget()
         self.password_layout = QVBoxLayout()
         self.progressBar = QProgressBar()
+        self.progress_signal = ProgressSignal()
+        self.progress_signal.progress.connect(self.show_progress)
         self.progress_label = QLabel('<b>' + self.tr('Progress') + '</b>')
         self.login_widget = QWidget()
         self.login_layout = QHBoxLayout()
@@ -120,6 +143,16 @@ class GeobricksTRMM:
         self.close_button = QPushButton(self.tr('Close Window'))
         self.add_to_canvas = QCheckBox(self.tr('Add output layer to canvas'))
         self.add_to_canvas.setChecked(True)
+        self.in_memory = QCheckBox(self.tr('Keep only the daily SUM/AVG layers (download the 3-hourly layers in memory)'))
+        self.in_memory.setChecked(False)
+        self.lbl_8 = QLabel('<b>' + self.tr('Extract Time Series (optional)') + '</b>')
+        self.extraction_layer = QLineEdit()
+        self.extraction_layer.setPlaceholderText(self.tr('Points or polygons, e.g. gauges.shp'))
+        self.extraction_layer_button = QPushButton(self.tr('...'))
+        self.extraction_field = QLineEdit()
+        self.extraction_field.setPlaceholderText(self.tr('ID field, e.g. NAME'))
+        self.extraction_widget = QWidget()
+        self.extraction_layout = QHBoxLayout()
         self.to_date_widget = QWidget()
         self.to_date_widget_layout = QVBoxLayout()
         self.spacing = 16
@@ -205,6 +238,15 @@ class GeobricksTRMM:
         self.download_folder_layout.addWidget(self.download_folder)
         self.download_folder_layout.addWidget(self.download_folder_button)
 
+        # Extraction panel
+        self.extraction_layout.setContentsMargins(0, 0, 0, 0)
+        self.extraction_layout.setSpacing(0)
+        self.extraction_widget.setLayout(self.extraction_layout)
+        self.extraction_layer_button.clicked.connect(self.select_extraction_layer)
+        self.extraction_layout.addWidget(self.extraction_layer)
+        self.extraction_layout.addWidget(self.extraction_layer_button)
+        self.extraction_layout.addWidget(self.extraction_field)
+
         # Download button
         self.download_button.clicked.connect(self.start)
 
@@ -219,7 +261,10 @@ class GeobricksTRMM:
         self.layout.addWidget(self.dates_widget)
         self.layout.addWidget(self.lbl_5)
         self.layout.addWidget(self.download_folder_widget)
+        self.layout.addWidget(self.lbl_8)
+        self.layout.addWidget(self.extraction_widget)
         self.layout.addWidget(self.add_to_canvas)
+        self.layout.addWidget(self.in_memory)
         self.layout.addWidget(self.download_button)
         self.layout.addWidget(self.progress_label)
         self.layout.addWidget(self.progressBar)
@@ -242,6 +287,10 @@ class GeobricksTRMM:
         self.last_download_folder = filename
         self.download_folder.setText(self.last_download_folder)
 
+    def select_extraction_layer(self):
+        filename = QFileDialog.getOpenFileName(self.dlg, self.tr('Select Layer'), filter='*.shp *.gpkg *.geojson')
+        self.extraction_layer.setText(filename)
+
     def tr(self, message):
         return QCoreApplication.translate('geobricks_trmm_qgis', message)
 
@@ -297,23 +346,115 @@ class GeobricksTRMM:
         if p is not None:
             self.progressBar.setMaximum(100)
             self.progressBar.setValue(0)
-            i = 0
+            telemetry = Telemetry()
+            # The caches live as long as QGIS, only this run's hits and misses are reported
+            counters = cache_counters()
             try:
-                range = date_range(p['from_date'], p['to_date'])
-                for current_date in range:
-                    layers = list_layers(p['username'], p['password'], current_date.year, current_date.month, current_date.day, p['download_path'])
-                    if p['frequency'] is not 'NONE':
-                        self.aggregate_layers(layers, current_date)
+                window = rolling_window_days(p['frequency'])
+                rolling = None
+                from_date = p['from_date']
+                if window is not None:
+                    # Read the days before the first date, so its window is full
+                    rolling = RollingWindow(window)
+                    from_date -= datetime.timedelta(days=window - 1)
+                range = date_range(from_date, p['to_date'])
+                extraction = []
+                extract = p['extraction_layer'] is not None and len(p['extraction_layer']) > 0
+                # Each date is downloaded (bytes) and processed (pixels), the extraction runs once at the end
+                steps = 2 * len(range) + (1 if extract else 0)
+                progress = Progress(0, [self.progress_signal], interval=0.5)
+                # Daily SUM/AVG outputs are journaled, dates already up to date are skipped
+                daily = p['frequency'] in ('SUM', 'AVG') and not extract
+                journal = Journal(p['download_path'] + '/trmm_journal.json')
+                parameters = {'aggregation': p['frequency'], 'versions': conf['versions']}
+                # Daily SUM/AVG don't need the 3-hourly layers on disk
+                in_memory = p['in_memory'] and daily
+                for i, current_date in enumerate(range):
+                    key = '%s_%s' % (current_date, p['frequency'])
+                    if daily and journal.is_current(key, parameters):
+                        telemetry.count('dates_up_to_date')
+                        if p['open_in_qgis'] is True:
+                            file_name = journal.output(key)
+                            self.show_aggregate(file_name, current_date, p['frequency'], Dataset(file_name))
+                        self.progress_signal.phase(2 * i + 1, steps, str(current_date))
+                        self.progress_signal(1.0)
+                        continue
+                    self.progress_signal.phase(2 * i, steps, str(current_date) + self.tr(' download'))
+                    if in_memory:
+                        layers, file_name = self.stream_day(p, current_date, telemetry, progress, 2 * i + 1, steps)
+                        journal.record(key, parameters, layers, file_name)
+                        continue
+                    layers = list_layers(p['username'], p['password'], current_date.year, current_date.month, current_date.day, p['download_path'], telemetry, progress=progress)
+                    self.progress_signal.phase(2 * i + 1, steps, str(current_date) + self.tr(' aggregation'))
+                    if extract:
+                        extraction += layers
+                    elif rolling is not None:
+                        self.rolling_layers(rolling, layers, current_date, current_date >= p['from_date'], progress)
+                    elif p['frequency'] != 'NONE':
+                        with telemetry.timer('aggregation'):
+                            file_name = self.aggregate_layers(layers, current_date, progress)
+                        journal.record(key, parameters, layers, file_name)
                     else:
                         if p['open_in_qgis'] is True:
                             for l in layers:
                                 if '.tfw' not in l:
                                     self.iface.addRasterLayer(l, str(l))
-                    i += 1
-                    percent = (i/float(len(range))) * 100
-                    self.progressBar.setValue(percent)
+                    self.progress_signal(1.0)
+                if len(extraction) > 0:
+                    self.progress_signal.phase(steps - 1, steps, self.tr('extraction'))
+                    self.progress_signal(0.0)
+                    with telemetry.timer('extraction'):
+                        self.extract_layers(extraction, p)
+                    self.progress_signal(1.0)
             except Exception, e:
+                telemetry.count('errors')
                 self.bar.pushMessage(None, str(e), level=QgsMessageBar.CRITICAL)
+            finally:
+                # Don't keep the layers of the run open, they may be deleted or downloaded again
+                HandlePool.close_all()
+            if telemetry.counters.get('dates_up_to_date'):
+                message = self.tr('Dates already up to date: ') + str(telemetry.counters['dates_up_to_date'])
+                self.bar.pushMessage(None, message, level=QgsMessageBar.INFO)
+            self.report_telemetry(telemetry, p, counters)
+
+    def stream_day(self, p, d, telemetry, progress, step, steps):
+        """
+        Download the layers of a day in memory and save only the daily aggregate.
+        @param progress: Progress of the download, then of the aggregation.
+        @type progress: Progress
+        @param step: Step of the run of the aggregation, see ProgressSignal.phase
+        @type step: int
+        @return: The (released) layers and the path of the aggregate.
+        """
+        layers = stream_layers(p['username'], p['password'], d.year, d.month, d.day, telemetry, progress=progress)
+        self.progress_signal.phase(step, steps, str(d) + self.tr(' aggregation'))
+        try:
+            with environment(tempdir='/vsimem'), telemetry.timer('aggregation'):
+                file_name = self.aggregate_layers(layers, d, progress)
+        finally:
+            release_layers(layers)
+        self.progress_signal(1.0)
+        return layers, file_name
+
+    def show_progress(self, percent, text):
+        self.progressBar.setValue(percent)
+        self.progressBar.setFormat(text)
+
+    def report_telemetry(self, telemetry, p, counters):
+        """
+        Log the run metrics in the message log and save them as a JSON report in the download folder.
+        @param counters: cache_counters() at the start of the run.
+        @type counters: dict
+        """
+        for name, value in sorted(cache_counters().items()):
+            telemetry.count(name, value - counters[name])
+        for line in telemetry.summary():
+            QgsMessageLog.logMessage(line, 'Geobricks TRMM')
+        file_name = p['download_path'] + '/trmm_run_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'
+        try:
+            telemetry.save(file_name)
+        except IOError, e:
+            QgsMessageLog.logMessage(str(e), 'Geobricks TRMM')
 
     def collect_parameters(self):
         p = {
@@ -323,7 +464,10 @@ class GeobricksTRMM:
             'from_date': self.from_date.selectedDate().toPyDate(),
             'to_date': self.to_date.selectedDate().toPyDate(),
             'download_path': self.download_folder.text(),
-            'open_in_qgis': self.add_to_canvas.isChecked()
+            'open_in_qgis': self.add_to_canvas.isChecked(),
+            'in_memory': self.in_memory.isChecked(),
+            'extraction_layer': self.extraction_layer.text(),
+            'extraction_field': self.extraction_field.text()
         }
         if p['username'] is None or len(p['username']) == 0:
             self.bar.pushMessage(None, self.tr('Please insert the username'), level=QgsMessageBar.CRITICAL)
@@ -331,58 +475,187 @@ class GeobricksTRMM:
             self.bar.pushMessage(None, self.tr('Please insert the password'), level=QgsMessageBar.CRITICAL)
         elif p['download_path'] is None or len(p['download_path']) == 0:
             self.bar.pushMessage(None, self.tr('Please select the download folder'), level=QgsMessageBar.CRITICAL)
+        elif len(p['extraction_layer']) > 0 and len(p['extraction_field']) == 0:
+            self.bar.pushMessage(None, self.tr('Please insert the ID field of the extraction layer'), level=QgsMessageBar.CRITICAL)
         else:
             return p
 
-    def aggregate_layers(self, layers, d):
+    def aggregate_layers(self, layers, d, progress):
+        """
+        Save the daily aggregate of the layers.
+        @param progress: Reset to the raster operations of the aggregation, see daily_operations.
+        @type progress: Progress
+        @return: The path of the aggregate, None if the frequency isn't a daily aggregation.
+        """
         aggregation = self.frequency.itemData(self.frequency.currentIndex())
         month = str(d.month)
         month = month if len(month) == 2 else '0' + month
         day = str(d.day)
         day = day if len(day) == 2 else '0' + day
-        filtered_layers = filter(lambda x: '.tif' in x, layers)
-        datasets = []
         file_name = None
-        for l in filtered_layers:
-            datasets.append(Dataset(l))
-        sum = datasets[0]
-        for i in range(1,len(datasets)-1):
-            sum += datasets[i]
+        output = None
+        if aggregation in ('SUM', 'AVG'):
+            file_name = self.download_folder.text() + '/' + str(d.year) + '_' + month + '_' + day + '_' + aggregation + '.tif'
+            progress.reset(daily_operations(layers, aggregation))
+            with environment(progress=progress):
+                total = aggregate_daily(layers, aggregation)
+            # Not in the progress, the GDAL callback of the copy would restart it from 0
+            with environment(overwrite=True, stats=True):
+                output = total.save(file_name)
+        if self.add_to_canvas.isChecked() is True:
+            self.show_aggregate(file_name, d, aggregation, output)
+        return file_name
+
+    def show_aggregate(self, file_name, d, aggregation, output):
+        """
+        Add the aggregate of a day to the canvas.
+        @param output: Saved aggregate, for its stored statistics.
+        @type output: Dataset | None
+        """
+        month = str(d.month)
+        month = month if len(month) == 2 else '0' + month
+        day = str(d.day)
+        day = day if len(day) == 2 else '0' + day
+        self.bar.pushMessage(None, str(file_name), level=QgsMessageBar.INFO)
+        title = None
         if aggregation == 'SUM':
-            Env.overwrite = True
-            avg = sum
-            file_name = self.download_folder.text() + '/' + str(d.year) + '_' + month + '_' + day + '_SUM.tif'
-            avg.save(file_name)
+            title = self.tr('TRMM Aggregate (Sum): ') + str(d.year) + '-' + str(month) + '-' + str(day)
         elif aggregation == 'AVG':
-            Env.overwrite = True
-            avg = sum
-            avg /= len(datasets)
-            file_name = self.download_folder.text() + '/' + str(d.year) + '_' + month + '_' + day + '_AVG.tif'
-            avg.save(file_name)
+            title = self.tr('TRMM Aggregate (Average): ') + str(d.year) + '-' + str(month) + '-' + str(day)
+        self.add_aggregate_layer(file_name, title, output)
+
+    def extract_layers(self, layers, p):
+        """
+        Write the time series of the downloaded layers at the features of the extraction layer,
+        instead of aggregating the rasters and adding them to the canvas.
+        """
+        name = os.path.splitext(os.path.basename(p['extraction_layer']))[0]
+        file_name = p['download_path'] + '/' + name + '_' + str(p['from_date']) + '_' + str(p['to_date']) + '.csv'
+        extract_vector(layers, p['extraction_layer'], p['extraction_field'], file_name)
+        self.bar.pushMessage(None, str(file_name), level=QgsMessageBar.INFO)
+
+    def rolling_layers(self, rolling, layers, d, save, progress):
+        month = str(d.month)
+        month = month if len(month) == 2 else '0' + month
+        day = str(d.day)
+        day = day if len(day) == 2 else '0' + day
+        # The daily sum, and usually 2 operations to update the window, see RollingWindow.push
+        progress.reset(daily_operations(layers, 'SUM') + 2)
+        with environment(progress=progress):
+            total = rolling.push(aggregate_daily(layers, 'SUM'))
+        if total is None or save is False:
+            return
+        file_name = self.download_folder.text() + '/' + str(d.year) + '_' + month + '_' + day + '_SUM_' + str(rolling.days) + 'D.tif'
+        with environment(overwrite=True, stats=True):
+            output = total.save(file_name)
         if self.add_to_canvas.isChecked() is True:
             self.bar.pushMessage(None, str(file_name), level=QgsMessageBar.INFO)
-            title = None
-            if aggregation == 'SUM':
-                title = self.tr('TRMM Aggregate (Sum): ') + str(d.year) + '-' + str(month) + '-' + str(day)
-            elif aggregation == 'AVG':
-                title = self.tr('TRMM Aggregate (Average): ') + str(d.year) + '-' + str(month) + '-' + str(day)
-            rl = self.iface.addRasterLayer(file_name, title)
-            fcn = QgsColorRampShader()
-            fcn.setColorRampType(QgsColorRampShader.INTERPOLATED)
-            lst = [
-                QgsColorRampShader.ColorRampItem(0, QColor(247, 251, 255, 0), '< 2.6 [mm]'),
-                QgsColorRampShader.ColorRampItem(2.6, QColor(222, 235, 247), '< 5.2 [mm]'),
-                QgsColorRampShader.ColorRampItem(5.2, QColor(199, 220, 239), '< 7.8 [mm]'),
-                QgsColorRampShader.ColorRampItem(7.8, QColor(162, 203, 226), '< 10.4 [mm]'),
-                QgsColorRampShader.ColorRampItem(10.4, QColor(114, 178, 215), '< 13 [mm]'),
-                QgsColorRampShader.ColorRampItem(13, QColor(73, 151, 201), '< 15.6 [mm]'),
-                QgsColorRampShader.ColorRampItem(15.6, QColor(40, 120, 184), '< 18 [mm]'),
-                QgsColorRampShader.ColorRampItem(18, QColor(13, 87, 161), '< 20 [mm]'),
-                QgsColorRampShader.ColorRampItem(20, QColor(8, 48, 107), '>= 20 [mm]')
-            ]
-            fcn.setColorRampItemList(lst)
-            shader = QgsRasterShader()
-            shader.setRasterShaderFunction(fcn)
-            renderer = QgsSingleBandPseudoColorRenderer(rl.dataProvider(), 1, shader)
-            rl.setRenderer(renderer)
-            rl.triggerRepaint()
+            title = self.tr('TRMM Running Total (') + str(rolling.days) + self.tr(' days): ') + str(d.year) + '-' + str(month) + '-' + str(day)
+            self.add_aggregate_layer(file_name, title, output)
+
+    def add_aggregate_layer(self, file_name, title, output):
+        rl = self.iface.addRasterLayer(file_name, title)
+        fcn = QgsColorRampShader()
+        fcn.setColorRampType(QgsColorRampShader.INTERPOLATED)
+        lst = [
+            QgsColorRampShader.ColorRampItem(0, QColor(247, 251, 255, 0), '< 2.6 [mm]'),
+            QgsColorRampShader.ColorRampItem(2.6, QColor(222, 235, 247), '< 5.2 [mm]'),
+            QgsColorRampShader.ColorRampItem(5.2, QColor(199, 220, 239), '< 7.8 [mm]'),
+            QgsColorRampShader.ColorRampItem(7.8, QColor(162, 203, 226), '< 10.4 [mm]'),
+            QgsColorRampShader.ColorRampItem(10.4, QColor(114, 178, 215), '< 13 [mm]'),
+            QgsColorRampShader.ColorRampItem(13, QColor(73, 151, 201), '< 15.6 [mm]'),
+            QgsColorRampShader.ColorRampItem(15.6, QColor(40, 120, 184), '< 18 [mm]'),
+            QgsColorRampShader.ColorRampItem(18, QColor(13, 87, 161), '< 20 [mm]'),
+            QgsColorRampShader.ColorRampItem(20, QColor(8, 48, 107), '>= 20 [mm]')
+        ]
+        fcn.setColorRampItemList(lst)
+        shader = QgsRasterShader()
+        shader.setRasterShaderFunction(fcn)
+        renderer = QgsSingleBandPseudoColorRenderer(rl.dataProvider(), 1, shader)
+        statistics = self.stored_statistics(output)
+        if statistics is not None:
+            shader.setMinimumValue(statistics[0])
+            shader.setMaximumValue(statistics[1])
+            renderer.setClassificationMin(statistics[0])
+            renderer.setClassificationMax(statistics[1])
+        rl.setRenderer(renderer)
+        rl.triggerRepaint()
+
+    def stored_statistics(self, dataset):
+        """
+        Read the statistics written with the aggregate, without scanning the raster.
+        @param dataset: Saved aggregate
+        @type dataset: Dataset | None
+        @return: [min, max, mean, std] or None when no statistics are stored.
+        """
+        if dataset is None:
+            return None
+        try:
+            statistics = dataset.GetRasterBand(1).GetStatistics(False, False)
+        except RuntimeError:
+            return None
+        if statistics is None or statistics[3] < 0:
+            return None
+        return statistics
+
+
+def cache_counters():
+    """
+    @return: The hits and misses of the HeaderCache and HandlePool so far.
+    """
+    return {
+        'header_cache_hits': HeaderCache.hits,
+        'header_cache_misses': HeaderCache.misses,
+        'handle_pool_hits': HandlePool.hits,
+        'handle_pool_misses': HandlePool.misses
+    }
+
+
+@contextlib.contextmanager
+def environment(**settings):
+    """
+    Set Env properties for the plugin's own calculations only, the previous values are
+    restored afterwards so other users of gdal_calculations in QGIS are not affected.
+    e.g. with environment(overwrite=True, stats=True): aggregate_daily(layers, 'SUM').save(file_name)
+    """
+    previous = dict((name, getattr(Env, name)) for name in settings)
+    try:
+        for name, value in settings.items():
+            setattr(Env, name, value)
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(Env, name, value)
+
+
+class ProgressSignal(QObject):
+    """
+    Progress sink emitting the percentage of the run and the progress text (with the rate and ETA
+    of the current phase, e.g. bytes/s of a download or pixels/s of an aggregation) as a Qt signal.
+    """
+
+    progress = pyqtSignal(int, str)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self.step = 0
+        self.steps = 1
+        self.label = ''
+
+    def phase(self, step, steps, label):
+        """
+        Start a phase of the run, the fractions passed to the sink are of this phase.
+        @param step: Phases of the run already done.
+        @type step: int
+        @param steps: Phases of the run.
+        @type steps: int
+        @param label: e.g. '2015-07-31 download'
+        @type label: str
+        """
+        self.step = step
+        self.steps = steps
+        self.label = label
+
+    def __call__(self, fraction, rate=None, eta=None):
+        run = (self.step + fraction) / float(max(self.steps, 1))
+        self.progress.emit(int(run * 100), self.label + ' ' + format_progress(fraction, rate, eta))
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Allocations and run time of tiled raster operations.
+
+Run with python -m test.benchmarks.benchmark_operation, allocations are
+only measured where tracemalloc is available. The exit status is 1 if an
+operation allocates more than PEAK_BLOCKS blocks, test/test_benchmarks.py
+runs the same check.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import sys
+import tempfile
+import time
+
+import numpy
+from osgeo import gdal
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset, Env
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Peak allocations of an operation, in blocks: the input and output buffers
+# (see RasterLike.__ufuncoperation__), the first result and some slack
+PEAK_BLOCKS = 6
+# Bytes of a block of create_raster, a row of tiles
+BLOCK = 1440 * 128 * 4
+
+
+def create_raster(path, cols=1440, rows=400, block=128, seed=0):
+    """Create a tiled Float32 raster the size of a TRMM 3B42 layer."""
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, cols, rows, 1, gdal.GDT_Float32,
+                       ['TILED=YES', 'BLOCKXSIZE=%d' % block, 'BLOCKYSIZE=%d' % block])
+    ds.SetGeoTransform((-180, 0.25, 0, 50, 0, -0.25))
+    data = numpy.random.RandomState(seed).gamma(0.5, 5, (rows, cols)).astype(numpy.float32)
+    ds.GetRasterBand(1).WriteArray(data)
+    ds = None
+    return path
+
+
+def measure(function, repeat=5):
+    """Run a function and return the best time and the peak traced memory in bytes."""
+    times = []
+    peak = None
+    for i in range(repeat):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+        if tracemalloc is not None:
+            current, traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak = traced if peak is None else max(peak, traced)
+    return min(times), peak
+
+
+def run(repeat=5):
+    """
+    Time the operations and measure their allocations.
+    @return: [(name, seconds, peak blocks or None)] and the failures, operations above PEAK_BLOCKS.
+    """
+    # Env.tempdir is tempfile.tempdir by default, which is None until it is first used
+    tempdir, tiled = Env.tempdir or tempfile.gettempdir(), Env.tiled
+    Env.tempdir = '/vsimem'
+    Env.tiled = True
+    a = Dataset(create_raster('/vsimem/benchmark_a.tif', seed=0))
+    b = Dataset(create_raster('/vsimem/benchmark_b.tif', seed=1))
+    results, failures = [], []
+    try:
+        for name, function in [('a + b', lambda: a + b),
+                               ('a * 2', lambda: a * 2),
+                               ('a > b', lambda: a > b)]:
+            seconds, peak = measure(function, repeat)
+            blocks = None if peak is None else float(peak) / BLOCK
+            results.append((name, seconds, blocks))
+            if blocks is not None and blocks > PEAK_BLOCKS:
+                failures.append('%s: peak %.1f blocks > %d' % (name, blocks, PEAK_BLOCKS))
+    finally:
+        a = b = None
+        gdal.Unlink('/vsimem/benchmark_a.tif')
+        gdal.Unlink('/vsimem/benchmark_b.tif')
+        Env.tempdir, Env.tiled = tempdir, tiled
+    return results, failures
+
+
+def main():
+    results, failures = run()
+    for name, seconds, blocks in results:
+        if blocks is None:
+            print('%-8s %8.4f s' % (name, seconds))
+        else:
+            print('%-8s %8.4f s  peak %6.1f blocks' % (name, seconds, blocks))
+    for failure in failures:
+        print('FAILED ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# coding=utf-8
+"""Benchmarks of the raster and download hot paths on synthetic TRMM data.
+
+Run with python -m test.benchmarks.suite [results.json], the wall time, peak RSS
+growth and bytes written of each benchmark are compared with thresholds.json and
+the exit status is 1 if any threshold is exceeded. test/test_benchmarks.py runs
+the QUICK benchmarks with LOOSE thresholds, and all of them when TRMM_BENCHMARKS
+is set.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+from osgeo import osr
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import DatasetStack
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import WarpedDataset
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core import trmm_core
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import aggregate_daily
+from test.benchmarks import synthetic
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+THRESHOLDS = os.path.join(os.path.dirname(__file__), 'thresholds.json')
+DATE = datetime.date(2015, 7, 31)
+# Benchmarks run by default by the tests, with the thresholds multiplied by LOOSE
+# so a slow or busy machine doesn't fail them
+QUICK = ['operation', 'daily_sum', 'windowed_dataset', 'ftp_listing']
+LOOSE = 5.0
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far, in MB (None if unknown)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024.0 ** 2
+    return rss / 1024.0
+
+
+def status_mb(field):
+    """A field of /proc/self/status in MB, e.g. VmRSS or VmHWM (None if unknown)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        return None
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux 4.0+).
+    @return: True if it was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def written_bytes():
+    """Bytes written by the process so far, from /proc/self/io (None if unknown)."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        return None
+
+
+def measure(function):
+    """
+    Run a benchmark.
+    @return: seconds, rss_mb (peak RSS during the benchmark above the RSS before it)
+        and io_mb (bytes written).
+    """
+    written = written_bytes()
+    rss = status_mb('VmRSS')
+    if rss is not None and reset_peak_rss():
+        peak = lambda: status_mb('VmHWM')
+    else:
+        # Only the growth of the peak of the process is known, a lower bound
+        peak = peak_rss_mb
+        rss = peak()
+    start = time.time()
+    function()
+    result = {'seconds': time.time() - start, 'rss_mb': None, 'io_mb': None}
+    if rss is not None:
+        result['rss_mb'] = max(peak() - rss, 0.0)
+    if written is not None:
+        result['io_mb'] = (written_bytes() - written) / 1024.0 ** 2
+    return result
+
+
+def benchmarks(folder):
+    """
+    Create the synthetic data in a folder.
+    @return: (name, function) pairs.
+    """
+    layers = synthetic.create_day(os.path.join(folder, 'layers'), DATE)
+    ftp_root = os.path.join(folder, 'ftp')
+    synthetic.create_ftp_tree(ftp_root, trmm_core.conf['source']['ftp']['data_dir'], [DATE])
+    synthetic.LocalFTP.root = ftp_root
+    a, b = Dataset(layers[0]), Dataset(layers[1])
+    mercator = osr.SpatialReference()
+    mercator.ImportFromEPSG(3857)
+
+    def operation():
+        (a + b).FlushCache()
+
+    def daily_sum():
+        aggregate_daily(layers, 'SUM').FlushCache()
+
+    def daily_avg():
+        aggregate_daily(layers, 'AVG').FlushCache()
+
+    def stack_mean():
+        DatasetStack(layers).stack_mean()
+
+    def clip():
+        # The extents of the operands are checked (and clipped) by every operation
+        window = a.clip_to_extent([-20.0, -10.0, 40.0, 30.0])
+        for i in range(100):
+            b.check_extent(window)
+
+    def warp():
+        WarpedDataset(a, mercator.ExportToWkt())
+
+    def ftp_listing():
+        trmm_core.list_layers_month_subset('user', 'password', DATE.year, DATE.month)
+
+    def ftp_download():
+        download = tempfile.mkdtemp(dir=folder)
+        trmm_core.list_layers('user', 'password', DATE.year, DATE.month, DATE.day, download)
+
+    def ftp_stream():
+        layers = trmm_core.stream_layers('user', 'password', DATE.year, DATE.month, DATE.day)
+        try:
+            Env.tempdir = '/vsimem'
+            aggregate_daily(layers, 'SUM').save(tempfile.mktemp(suffix='.tif', dir=folder))
+        finally:
+            Env.tempdir = folder
+            trmm_core.release_layers(layers)
+
+    return [('operation', operation),
+            ('daily_sum', daily_sum),
+            ('daily_avg', daily_avg),
+            ('stack_mean', stack_mean),
+            ('windowed_dataset', clip),
+            ('warped_dataset', warp),
+            ('ftp_listing', ftp_listing),
+            ('ftp_download', ftp_download),
+            ('ftp_stream', ftp_stream)]
+
+
+def check(results, thresholds, factor=1.0):
+    """
+    Compare results with thresholds.
+    @param factor: Multiplier of the thresholds.
+    @type factor: float
+    @return: Messages of the exceeded thresholds.
+    """
+    failures = []
+    for name, result in sorted(results.items()):
+        for metric, limit in sorted(thresholds.get(name, {}).items()):
+            value = result.get(metric)
+            limit *= factor
+            if value is not None and value > limit:
+                failures.append('%s %s %.3f > %.3f' % (name, metric, value, limit))
+    return failures
+
+
+def run(output=None, names=None, factor=1.0):
+    """
+    Run the benchmarks.
+    @param output: Optional JSON file for the results.
+    @type output: str
+    @param names: Benchmarks to run, all of them if None.
+    @type names: list
+    @param factor: Multiplier of the thresholds, see check.
+    @type factor: float
+    @return: The results and the messages of the exceeded thresholds.
+    """
+    folder = tempfile.mkdtemp(prefix='trmm_benchmarks_')
+    tempdir, ftp = Env.tempdir, trmm_core.FTP
+    try:
+        Env.tempdir = folder
+        trmm_core.FTP = synthetic.LocalFTP
+        results = {}
+        for name, function in benchmarks(folder):
+            if names is None or name in names:
+                results[name] = measure(function)
+    finally:
+        Env.tempdir = tempdir
+        trmm_core.FTP = ftp
+        synthetic.remove(folder)
+    with open(THRESHOLDS) as f:
+        failures = check(results, json.load(f), factor)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'results': results, 'failures': failures}, f, indent=2, sort_keys=True)
+    return results, failures
+
+
+def main():
+    results, failures = run(sys.argv[1] if len(sys.argv) > 1 else None)
+    for name in sorted(results):
+        r = results[name]
+        print('%-16s %8.3f s %10s MB rss %10s MB written' % (
+            name, r['seconds'], '%.1f' % r['rss_mb'] if r['rss_mb'] is not None else '-',
+            '%.1f' % r['io_mb'] if r['io_mb'] is not None else '-'))
+    for failure in failures:
+        sys.stderr.write('REGRESSION %s\n' % failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# coding=utf-8
+"""Synthetic TRMM 3B42 layers and a local FTP stand-in for benchmarks.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import os
+import posixpath
+import shutil
+
+import numpy
+from osgeo import gdal
+
+from test.utilities import TemporaryFolderTestCase
+
+NODATA = -9999.9
+COLS = 1440
+ROWS = 400
+GEOTRANSFORM = (-180.0, 0.25, 0.0, 50.0, 0.0, -0.25)
+HOURS = ['00', '03', '06', '09', '12', '15', '18', '21']
+
+
+def create_layer(path, seed=0, nodata=NODATA):
+    """
+    Create a Float32 GeoTIFF with the grid of a TRMM 3B42 layer (0.25 degrees, 50N-50S)
+    and its world file, with rainfall like values and some nodata.
+    @param path: GeoTIFF path.
+    @type path: str
+    @return: The path.
+    """
+    random = numpy.random.RandomState(seed)
+    data = random.gamma(0.5, 5, (ROWS, COLS)).astype(numpy.float32)
+    data[random.rand(ROWS, COLS) < 0.05] = nodata
+    ds = gdal.GetDriverByName('GTiff').Create(path, COLS, ROWS, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform(GEOTRANSFORM)
+    ds.SetProjection('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+                     'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]')
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.WriteArray(data)
+    ds = None
+    with open(path.replace('.tif', '.tfw'), 'w') as tfw:
+        tfw.write('\n'.join(str(v) for v in (GEOTRANSFORM[1], 0, 0, GEOTRANSFORM[5],
+                                                GEOTRANSFORM[0] + GEOTRANSFORM[1] / 2,
+                                                GEOTRANSFORM[3] + GEOTRANSFORM[5] / 2)))
+    return path
+
+
+def create_day(folder, date, version='7'):
+    """
+    Create the 8 3-hourly layers of a day, named as on the TRMM FTP (e.g. 3B42.20150731.03.7.tif).
+    @param folder: Output folder, created if missing.
+    @type folder: str
+    @param date: Day of the layers.
+    @type date: datetime.date
+    @return: Paths of the GeoTIFFs.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    layers = []
+    for i, hour in enumerate(HOURS):
+        name = '3B42.%s.%s.%s.tif' % (date.strftime('%Y%m%d'), hour, version)
+        layers.append(create_layer(os.path.join(folder, name), seed=date.toordinal() * 8 + i))
+    return layers
+
+
+def create_ftp_tree(root, data_dir, dates):
+    """
+    Create the year/month/day folders of the TRMM FTP under a local folder.
+    @param root: Local folder standing in for the FTP root.
+    @type root: str
+    @param data_dir: e.g. '/pub/trmmdata/GIS/'
+    @type data_dir: str
+    @param dates: Days to create.
+    @type dates: list
+    """
+    for date in dates:
+        folder = os.path.join(root, data_dir.strip('/'), date.strftime('%Y'), date.strftime('%m'), date.strftime('%d'))
+        create_day(folder, date)
+
+
+class LocalFTP:
+    """
+    Stand-in for ftplib.FTP serving a local folder, with the methods used by trmm_core.
+    Set LocalFTP.root before use.
+    """
+
+    root = None
+
+    def __init__(self, host=None):
+        self.host = host
+        self.cwd_path = '/'
+        self.retrieved = 0
+
+    def login(self, username=None, password=None):
+        return '230 Login successful.'
+
+    def cwd(self, path):
+        path = posixpath.normpath(posixpath.join(self.cwd_path, path))
+        if not os.path.isdir(self.local(path)):
+            raise IOError('550 %s: No such file or directory' % path)
+        self.cwd_path = path
+        return '250 Directory successfully changed.'
+
+    def voidcmd(self, command):
+        return '200 Command okay.'
+
+    def nlst(self, *args):
+        return sorted(os.listdir(self.local(self.cwd_path)))
+
+    def size(self, name):
+        return os.path.getsize(self.local(posixpath.join(self.cwd_path, name)))
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        name = command.split(' ', 1)[1]
+        with open(self.local(posixpath.join(self.cwd_path, name)), 'rb') as f:
+            if rest:
+                f.seek(int(rest))
+            while True:
+                data = f.read(blocksize)
+                if not data:
+                    break
+                self.retrieved += len(data)
+                callback(data)
+        return '226 Transfer complete.'
+
+    def quit(self):
+        return '221 Goodbye.'
+
+    def close(self):
+        pass
+
+    def local(self, path):
+        return os.path.join(self.root, *[p for p in path.split('/') if p])
+
+
+class SyntheticLayersTestCase(TemporaryFolderTestCase):
+    """Base class of the tests on synthetic TRMM layers, created in the test folder."""
+
+    def create_layer(self, name, seed=0, nodata=NODATA):
+        """
+        Create a synthetic layer in the test folder, see create_layer.
+        @return: The path.
+        """
+        return create_layer(self.path(name), seed, nodata)
+
+    def read(self, path, band=1):
+        """
+        @return: The values of a band of a raster.
+        """
+        return gdal.Open(path).GetRasterBand(band).ReadAsArray()
+
+
+def remove(folder):
+    """Remove a benchmark folder."""
+    shutil.rmtree(folder, ignore_errors=True)
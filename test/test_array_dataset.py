@@ -0,0 +1,44 @@
+# coding=utf-8
+"""Array dataset test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ArrayDataset
+
+
+class ArrayDatasetTest(unittest.TestCase):
+    """Test the array passed in is read directly and never changed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.array = numpy.arange(200 * 300, dtype=numpy.float32).reshape(200, 300)
+        self.expected = self.array.copy()
+
+    def test_inplace(self):
+        """Test in-place operations update the dataset and not the array."""
+        ds = ArrayDataset(self.array, extent=[0, 0, 300, 200])
+        numpy.testing.assert_array_equal(ds.ReadAsArray(), self.expected)
+        ds += 1
+        numpy.testing.assert_array_equal(ds.ReadAsArray(), self.expected + 1)
+        ds *= 2
+        numpy.testing.assert_array_equal(ds.ReadAsArray(), (self.expected + 1) * 2)
+        numpy.testing.assert_array_equal(self.array, self.expected)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ArrayDatasetTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
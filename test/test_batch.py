@@ -0,0 +1,110 @@
+# coding=utf-8
+"""Multiple outputs and batch calculations test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+from osgeo import gdal
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import calculate_batch
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import calculate_outputs
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import find_groups
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+EXPRESSIONS = [('sum', 'a + m'), ('wet', '(a >= 1) * m')]
+
+
+class FindGroupsTest(SyntheticLayersTestCase):
+    """Test files are grouped by the values of the {field} templates."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        for name in ('3B42.20150731.00.7.tif', '3B42.20150731.03.7.tif', '3B42.20150801.00.7.tif',
+                     'mask_20150731.tif', 'land.tif'):
+            self.write(name, '')
+
+    def test_groups(self):
+        """Test groups are sorted, with the files of each pattern and the files without fields in all."""
+        groups = find_groups([('a', self.path('3B42.{date}.*.7.tif')), ('l', self.path('land.tif'))])
+        self.assertEqual(groups, [
+            ({'date': '20150731'}, [('a', [self.path('3B42.20150731.00.7.tif'), self.path('3B42.20150731.03.7.tif')]),
+                                    ('l', [self.path('land.tif')])]),
+            ({'date': '20150801'}, [('a', [self.path('3B42.20150801.00.7.tif')]),
+                                    ('l', [self.path('land.tif')])])])
+
+    def test_missing(self):
+        """Test only the field values found for all the patterns make a group."""
+        groups = find_groups([('a', self.path('3B42.{date}.*.7.tif')), ('m', self.path('mask_{date}.tif'))])
+        self.assertEqual([fields for fields, paths in groups], [{'date': '20150731'}])
+
+    def test_errors(self):
+        """Test patterns without fields or files are rejected."""
+        self.assertRaises(RuntimeError, find_groups, [('l', self.path('land.tif'))])
+        self.assertRaises(RuntimeError, find_groups, [('a', self.path('3B42.{date}.*.7.tif')),
+                                                      ('x', self.path('missing.tif'))])
+
+
+class OutputsTest(SyntheticLayersTestCase):
+    """Test outputs of a single pass equal separate calculations, also on different grids."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.days = ['20150731', '20150801']
+        for i, day in enumerate(self.days):
+            self.create_layer('a_%s.tif' % day, seed=i)
+        # A mask on a smaller grid, the outputs are calculated on the intersection
+        mask = self.create_layer('full_mask.tif', seed=5)
+        gdal.Translate(self.path('mask.tif'), mask, srcWin=[10, 20, 300, 200])
+
+    def separate(self, a, day):
+        """Calculate each expression on its own."""
+        results = {}
+        for name, expr in EXPRESSIONS:
+            outfile = self.path('separate_%s_%s.tif' % (name, day))
+            calculate_outputs([(name, expr)], [('a', Dataset(a)), ('m', Dataset(self.path('mask.tif')))], {name: outfile})
+            results[name] = outfile
+        return results
+
+    def assert_outputs(self, outputs, expected):
+        for name, expr in EXPRESSIONS:
+            ds, other = gdal.Open(outputs[name]), gdal.Open(expected[name])
+            self.assertEqual((ds.RasterXSize, ds.RasterYSize), (300, 200))
+            numpy.testing.assert_allclose(ds.GetGeoTransform(), other.GetGeoTransform())
+            numpy.testing.assert_array_equal(ds.ReadAsArray(), other.ReadAsArray())
+
+    def test_single_pass(self):
+        """Test the outputs of calculate_outputs equal the separate calculations."""
+        a = self.path('a_20150731.tif')
+        outfiles = dict((name, self.path('%s.tif' % name)) for name, expr in EXPRESSIONS)
+        calculate_outputs(EXPRESSIONS, [('a', Dataset(a)), ('m', Dataset(self.path('mask.tif')))], outfiles)
+        self.assert_outputs(outfiles, self.separate(a, '20150731'))
+
+    def test_batch(self):
+        """Test each group of a batch equals the separate calculations of its files."""
+        results = calculate_batch(EXPRESSIONS, [('a', self.path('a_{date}.tif')), ('m', self.path('mask.tif'))],
+                                  self.path('{name}_{date}.tif'))
+        self.assertEqual([fields for fields, outputs in results], [{'date': day} for day in self.days])
+        for fields, outputs in results:
+            self.assertFalse(isinstance(outputs, Exception), outputs)
+            day = fields['date']
+            self.assert_outputs(outputs, self.separate(self.path('a_%s.tif' % day), day))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(FindGroupsTest), unittest.makeSuite(OutputsTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
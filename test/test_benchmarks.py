@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Benchmark regression test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import json
+import os
+import unittest
+
+from test.benchmarks import benchmark_operation
+from test.benchmarks import suite as benchmarks
+
+
+class BenchmarksTest(unittest.TestCase):
+    """Test the hot paths stay within the thresholds of thresholds.json."""
+
+    def test_quick(self):
+        """Test the quick benchmarks stay within the loose thresholds."""
+        results, failures = benchmarks.run(names=benchmarks.QUICK, factor=benchmarks.LOOSE)
+        self.assertEqual(sorted(results.keys()), sorted(benchmarks.QUICK))
+        self.assertEqual(failures, [], '\n'.join(failures))
+
+    @unittest.skipUnless(os.environ.get('TRMM_BENCHMARKS'), 'set TRMM_BENCHMARKS=1 to run all the benchmarks')
+    def test_thresholds(self):
+        """Test no benchmark exceeds its thresholds."""
+        results, failures = benchmarks.run()
+        with open(benchmarks.THRESHOLDS) as f:
+            thresholds = json.load(f)
+        self.assertEqual(sorted(results.keys()), sorted(thresholds.keys()))
+        self.assertEqual(failures, [], '\n'.join(failures))
+
+
+@unittest.skipIf(benchmark_operation.tracemalloc is None, 'tracemalloc is not available')
+class OperationAllocationsTest(unittest.TestCase):
+    """Test tiled operations allocate a few blocks, not the whole raster."""
+
+    def test_peak(self):
+        """Test no operation allocates more than PEAK_BLOCKS blocks."""
+        results, failures = benchmark_operation.run(repeat=1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(failures, [], '\n'.join(failures))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(BenchmarksTest), unittest.makeSuite(OperationAllocationsTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,142 @@
+# coding=utf-8
+"""Header cache and handle pool test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import os
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import HandlePool
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import HeaderCache
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import LazyDataset
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+def open_files():
+    """Paths of the files open in this process."""
+    fds = '/proc/self/fd'
+    paths = []
+    for fd in os.listdir(fds):
+        try:
+            paths.append(os.readlink(os.path.join(fds, fd)))
+        except OSError:
+            pass
+    return paths
+
+
+def rewrite(path, create):
+    """Rewrite a file, with a later modification time even on coarse timestamps."""
+    mtime = os.stat(path).st_mtime
+    create()
+    os.utime(path, (mtime + 10, mtime + 10))
+
+
+class HandlePoolTest(SyntheticLayersTestCase):
+    """Test at most Env.maxhandles files are kept open and rewritten files are reopened."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.maxhandles, Env.maxhandles = Env.maxhandles, 2
+        HandlePool.clear()
+        self.layers = [self.create_layer('layer%d.tif' % i, seed=i) for i in range(3)]
+        self.datasets = [LazyDataset(layer) for layer in self.layers]
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.datasets = None
+        HandlePool.clear()
+        Env.maxhandles = self.maxhandles
+        SyntheticLayersTestCase.tearDown(self)
+
+    def test_eviction(self):
+        """Test the least recently used file is closed, even if one of its bands is still used."""
+        bands = [ds[0] for ds in self.datasets]
+        for band in bands:
+            band.ReadAsArray(0, 0, 10, 10)
+        self.assertEqual(len(HandlePool), 2)
+        self.assertEqual((HandlePool.hits, HandlePool.misses), (0, 3))
+        if os.path.isdir('/proc/self/fd'):
+            files = open_files()
+            self.assertFalse(os.path.realpath(self.layers[0]) in files)
+            self.assertTrue(os.path.realpath(self.layers[2]) in files)
+
+    def test_reopen(self):
+        """Test an evicted file is reopened when it is read again."""
+        for ds in self.datasets:
+            ds[0].ReadAsArray(0, 0, 10, 10)
+        numpy.testing.assert_array_equal(self.datasets[0][0].ReadAsArray(), self.read(self.layers[0]))
+        self.assertEqual(HandlePool.misses, 4)
+        self.datasets[2][0].ReadAsArray(0, 0, 10, 10)
+        self.assertEqual((HandlePool.hits, HandlePool.misses), (1, 4))
+
+    def test_rewrite(self):
+        """Test a file rewritten while it is open is read again, not served from the old handle."""
+        band = self.datasets[0][0]
+        band.ReadAsArray()
+        rewrite(self.layers[0], lambda: self.create_layer('layer0.tif', seed=5))
+        numpy.testing.assert_array_equal(band.ReadAsArray(), self.read(self.layers[0]))
+        self.assertEqual(HandlePool.misses, 2)
+
+    def test_close_all(self):
+        """Test close_all closes the handles and keeps the counters."""
+        for ds in self.datasets:
+            ds[0].ReadAsArray(0, 0, 10, 10)
+        HandlePool.close_all()
+        self.assertEqual(len(HandlePool), 0)
+        self.assertEqual(HandlePool.misses, 3)
+
+
+class LazyDatasetTest(SyntheticLayersTestCase):
+    """Test LazyDatasets are planned from the header cache and only opened to read pixels."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.layer = self.create_layer('3B42.20150731.00.7.tif')
+        HeaderCache.clear()
+        HandlePool.clear()
+
+    def tearDown(self):
+        """Runs after each test."""
+        HeaderCache.clear()
+        HandlePool.clear()
+        SyntheticLayersTestCase.tearDown(self)
+
+    def test_header_only(self):
+        """Test the grid, extent and bands don't open the file."""
+        ds = LazyDataset(self.layer)
+        band = ds[0]
+        self.assertEqual((ds._x_size, ds._y_size, len(ds)), (1440, 400, 1))
+        self.assertEqual(band._nodata, ds._nodata)
+        self.assertEqual(ds.clip_to_extent([0.0, 0.0, 10.0, 10.0])._x_size, 40)
+        self.assertEqual((len(HandlePool), HandlePool.misses), (0, 0))
+        band.ReadAsArray(0, 0, 10, 10)
+        self.assertEqual(HandlePool.misses, 1)
+
+    def test_changed_file(self):
+        """Test the header is read again when the file changes, and reused when it doesn't."""
+        LazyDataset(self.layer)
+        LazyDataset(self.layer)
+        self.assertEqual((HeaderCache.hits, HeaderCache.misses), (1, 1))
+        rewrite(self.layer, lambda: self.create_layer('3B42.20150731.00.7.tif', nodata=-1.0))
+        self.assertEqual(LazyDataset(self.layer)._nodata, [-1.0])
+        self.assertEqual(HeaderCache.misses, 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(HandlePoolTest), unittest.makeSuite(LazyDatasetTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Dataset stack test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import DatasetStack
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+LAYERS = 5
+
+
+class DatasetStackTest(SyntheticLayersTestCase):
+    """Test each band of the stack is a layer and the stack reductions match numpy along the layers."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        # Windows of 10 rows, so the reductions are combined from several windows
+        self.stackmemory, Env.stackmemory = Env.stackmemory, LAYERS * 4 * 2 * synthetic.COLS * 10
+        self.layers = [self.create_layer('layer%d.tif' % i, seed=i) for i in range(LAYERS)]
+        data = numpy.array([self.read(layer) for layer in self.layers])
+        self.data = numpy.where(data == numpy.float32(synthetic.NODATA), numpy.nan, data)
+        self.stack = DatasetStack(self.layers)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.stack = None
+        Env.stackmemory = self.stackmemory
+        SyntheticLayersTestCase.tearDown(self)
+
+    def assert_reduction(self, ds, expected):
+        """Check a reduction against numpy, NaN (all the layers are nodata) is written as nodata."""
+        expected = numpy.where(numpy.isnan(expected), numpy.float32(synthetic.NODATA), expected)
+        numpy.testing.assert_allclose(ds.ReadAsArray(), expected, rtol=1e-5, atol=1e-5)
+
+    def test_bands(self):
+        """Test band i of the stack is layer i, not band 1 of every layer."""
+        self.assertEqual(self.stack._nbands, LAYERS)
+        for i, layer in enumerate(self.layers):
+            numpy.testing.assert_array_equal(self.stack._dataset.GetRasterBand(i + 1).ReadAsArray(),
+                                             self.read(layer))
+
+    def test_reductions(self):
+        """Test the mean, median, std and count above a threshold."""
+        self.assert_reduction(self.stack.stack_mean(), numpy.nanmean(self.data, axis=0))
+        self.assert_reduction(self.stack.stack_median(), numpy.nanmedian(self.data, axis=0))
+        self.assert_reduction(self.stack.stack_std(), numpy.nanstd(self.data, axis=0))
+        self.assert_reduction(self.stack.stack_std(ddof=1), numpy.nanstd(self.data, axis=0, ddof=1))
+        with numpy.errstate(invalid='ignore'):
+            count = (self.data > 2.5).sum(axis=0)
+        numpy.testing.assert_array_equal(self.stack.stack_count_above(2.5).ReadAsArray(), count)
+
+    def test_percentiles(self):
+        """Test a sequence of percentiles gives a band per percentile."""
+        ds = self.stack.stack_percentile([10, 90])
+        self.assertEqual(ds._nbands, 2)
+        self.assert_reduction(ds, numpy.nanpercentile(self.data, [10, 90], axis=0))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DatasetStackTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
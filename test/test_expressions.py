@@ -0,0 +1,54 @@
+# coding=utf-8
+"""Calculation expressions test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations.expressions import NAMESPACE
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations.expressions import compile_expression
+
+
+class ExpressionTest(unittest.TestCase):
+    """Test expressions can only use the variables and numpy functions."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.namespace = {'a': numpy.arange(4.0), 'b': numpy.ones(4)}
+
+    def test_numpy(self):
+        """Test numpy ufuncs and types are evaluated."""
+        expression = compile_expression('numpy.maximum(a, b) + np.where(a > 1, a, 0).astype(np.float32)')
+        numpy.testing.assert_array_equal(expression(self.namespace), [1, 1, 4, 6])
+        self.assertFalse('__builtins__' in NAMESPACE)
+
+    def test_rejected(self):
+        """Test other numpy attributes, builtins and private attributes are rejected."""
+        for expr in ('np.load("a.npy")', 'numpy.lib.npyio', '[np][0].load', 'a.__class__'):
+            self.assertRaises(RuntimeError, compile_expression, expr)
+        self.assertRaises(NameError, compile_expression('open("a.tif")'), self.namespace)
+
+    def test_attributes(self):
+        """Test reductions and astype are allowed, methods writing or deleting files are rejected."""
+        expression = compile_expression('a.astype(np.float32).sum() + a.max() * b.mean()')
+        self.assertEqual(expression(self.namespace), 9)
+        for expr in ('a.tofile("a.bin")', 'a.dump("a.pkl")', 'a.sum().tofile("a.bin")',
+                     'ds.GetDriver().Delete("a.tif")', 'ds.save("a.tif")', 'ds.GetRasterBand(1).SetNoDataValue(0)'):
+            self.assertRaises(RuntimeError, compile_expression, expr)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ExpressionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
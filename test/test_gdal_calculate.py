@@ -0,0 +1,68 @@
+# coding=utf-8
+"""gdal_calculate command line test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import os
+import subprocess
+import sys
+import unittest
+
+import numpy
+from osgeo import gdal
+
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+LIBS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'geobricks_qgis_plugin_trmm_libs')
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+class WindowTest(SyntheticLayersTestCase):
+    """Test --window only calculates the window of the inputs."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.layer = self.create_layer('3B42.20150731.00.7.tif')
+        self.data = self.read(self.layer)
+        self.output = self.path('output.tif')
+
+    def calculate(self, *args):
+        command = [sys.executable, '-m', 'gdal_calculations', '-q', '--calc=a*2', '--outfile=%s' % self.output,
+                   '--window=10 20 30 40', '--a=%s' % self.layer] + list(args)
+        subprocess.check_call(command, cwd=LIBS)
+        ds = gdal.Open(self.output)
+        self.assertEqual((ds.RasterXSize, ds.RasterYSize), (30, 40))
+        gt = ds.GetGeoTransform()
+        self.assertAlmostEqual(gt[0], synthetic.GEOTRANSFORM[0] + 10 * synthetic.GEOTRANSFORM[1])
+        self.assertAlmostEqual(gt[3], synthetic.GEOTRANSFORM[3] + 20 * synthetic.GEOTRANSFORM[5])
+        numpy.testing.assert_array_equal(ds.GetRasterBand(1).ReadAsArray(), self.data[20:60, 10:40] * 2)
+
+    def test_single_input(self):
+        """Test a calculation of a single input."""
+        self.calculate()
+
+    @unittest.skipIf(numexpr is None, 'numexpr is not installed')
+    def test_numexpr(self):
+        """Test a calculation evaluated with numexpr."""
+        self.calculate('--numexpr', '--notile')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(WindowTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Vectorized geometry helpers test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import geometry
+
+
+class GeometryTest(unittest.TestCase):
+    """Test the array helpers match the scalar ones."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.gt = (-180.0, 0.25, 0.0, 50.0, 0.0, -0.25)
+        self.rotated_gt = (-180.0, 0.25, 0.01, 50.0, 0.02, -0.25)
+        random = numpy.random.RandomState(0)
+        self.x = random.uniform(-180, 180, 1000)
+        self.y = random.uniform(-50, 50, 1000)
+
+    def test_map_to_pixel(self):
+        """Test MapToPixelArray and PixelToMapArray against the scalar versions."""
+        for gt in (self.gt, self.rotated_gt):
+            px, py = geometry.MapToPixelArray(self.x, self.y, gt)
+            for i in range(0, 1000, 97):
+                expected = geometry.MapToPixel(self.x[i], self.y[i], gt)
+                self.assertAlmostEqual(px[i], expected[0], places=6)
+                self.assertAlmostEqual(py[i], expected[1], places=6)
+            mx, my = geometry.PixelToMapArray(px, py, gt)
+            numpy.testing.assert_allclose(mx, self.x)
+            numpy.testing.assert_allclose(my, self.y)
+
+    def test_not_invertible(self):
+        """Test a geotransform without an inverse raises a ValueError."""
+        gt = (-180.0, 0.25, 0.5, 50.0, 0.125, 0.25)
+        self.assertRaises(ValueError, geometry.MapToPixelArray, self.x, self.y, gt)
+        self.assertRaises(ValueError, geometry.MapToPixel, self.x[0], self.y[0], gt)
+
+    def test_extent(self):
+        """Test bulk extents and snapping against the scalar versions."""
+        gts = [self.gt, (-179.93, 0.25, 0.0, 49.91, 0.0, -0.25), (-10.1, 0.5, 0.0, 10.2, 0.0, -0.5)]
+        cols, rows = [1440, 100, 20], [400, 50, 30]
+        extents = geometry.GeoTransformToExtentArray(gts, cols, rows)
+        snap_ext = [-180.0, -50.0, 180.0, 50.0]
+        boxes = []
+        for i, gt in enumerate(gts):
+            expected = geometry.GeoTransformToExtent(gt, cols[i], rows[i])
+            numpy.testing.assert_allclose(extents[i], expected)
+            boxes.append([expected[1][0], expected[1][1], expected[3][0], expected[3][1]])
+        snapped = geometry.SnapExtentArray(boxes, gts, snap_ext, self.gt)
+        for i, gt in enumerate(gts):
+            numpy.testing.assert_allclose(snapped[i], geometry.SnapExtent(boxes[i], gt, snap_ext, self.gt))
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GeometryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""In place operations test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import operator
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ArrayDataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class InplaceTest(SyntheticLayersTestCase):
+    """Test augmented assignments update temporary datasets or fall back to the operators."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.env = Env.tiled, Env.nodata
+        self.layer = self.create_layer('a.tif', seed=1)
+        self.a = Dataset(self.layer)
+        self.b = Dataset(self.create_layer('b.tif', seed=2))
+
+    def tearDown(self):
+        """Runs after each test."""
+        Env.tiled, Env.nodata = self.env
+        self.a = self.b = None
+        SyntheticLayersTestCase.tearDown(self)
+
+    def assert_inplace(self, op, iop, other):
+        """Check an augmented assignment to a temporary dataset updates it and equals the operator."""
+        expected = op(self.a, other).ReadAsArray()
+        target = self.a + 0
+        result = iop(target, other)
+        self.assertIs(result, target)
+        numpy.testing.assert_array_equal(result.ReadAsArray(), expected)
+
+    def test_operators(self):
+        """Test += -= *= with datasets and numbers, tiled and untiled."""
+        for tiled in (True, False):
+            Env.tiled = tiled
+            for op, iop in ((operator.add, operator.iadd), (operator.sub, operator.isub), (operator.mul, operator.imul)):
+                self.assert_inplace(op, iop, self.b)
+                self.assert_inplace(op, iop, 2)
+
+    def test_nodata(self):
+        """Test nodata is kept as with the operators when Env.nodata is set."""
+        Env.nodata = True
+        for tiled in (True, False):
+            Env.tiled = tiled
+            self.assert_inplace(operator.add, operator.iadd, self.b)
+            self.assert_inplace(operator.mul, operator.imul, 2)
+
+    def test_not_writable(self):
+        """Test a dataset opened from a file is not modified, a new dataset is returned."""
+        expected = (self.a + self.b).ReadAsArray()
+        target = self.a
+        target += self.b
+        self.assertIsNot(target, self.a)
+        numpy.testing.assert_array_equal(target.ReadAsArray(), expected)
+        numpy.testing.assert_array_equal(self.read(self.layer), self.a.ReadAsArray())
+
+    def test_extent(self):
+        """Test an operand changing the extent falls back to a new dataset of that extent."""
+        window = self.b.window(10, 20, 100, 50)
+        target = self.a + 0
+        before = target.ReadAsArray()
+        result = operator.iadd(target, window)
+        self.assertIsNot(result, target)
+        numpy.testing.assert_array_equal(result.ReadAsArray(), before[20:70, 10:110] + window.ReadAsArray())
+        numpy.testing.assert_array_equal(target.ReadAsArray(), before)
+
+    def test_datatype(self):
+        """Test an integer dataset is updated with integers and falls back for a float result."""
+        array = numpy.arange(12, dtype=numpy.int32).reshape(3, 4)
+        ds = ArrayDataset(array, extent=[0, 0, 4, 3])
+        result = operator.iadd(ds, 1)
+        self.assertIs(result, ds)
+        result = operator.iadd(ds, 0.5)
+        self.assertIsNot(result, ds)
+        numpy.testing.assert_array_equal(result.ReadAsArray(), array + 1.5)
+        numpy.testing.assert_array_equal(ds.ReadAsArray(), array + 1)
+        numpy.testing.assert_array_equal(array, numpy.arange(12).reshape(3, 4))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(InplaceTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,135 @@
+# coding=utf-8
+"""Calculation progress test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import logging
+import unittest
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import environment
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import format_progress
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import LogSink
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Progress
+
+
+class FakeClock:
+    """Stand-in for the time module, only moved forward by the tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class ListHandler(logging.Handler):
+    """Logging handler keeping the messages."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ProgressTest(unittest.TestCase):
+    """Test the throughput, ETA and rate limiting of the progress sinks."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.clock = FakeClock()
+        self.time, environment.time = environment.time, self.clock
+        self.calls = []
+
+    def tearDown(self):
+        """Runs after each test."""
+        environment.time = self.time
+
+    def sink(self, fraction, rate=None, eta=None):
+        self.calls.append((fraction, rate, eta))
+
+    def test_interval(self):
+        """Test sinks are called at most once per interval, with the throughput and ETA."""
+        progress = Progress(10, [self.sink], interval=1.0)
+        self.assertEqual(self.calls, [(0.0, None, None)])
+        progress.update_progress()
+        self.clock.now += 0.5
+        progress.update_progress()
+        self.assertEqual(len(self.calls), 1)
+        self.clock.now += 0.5
+        progress.update_progress()
+        self.assertEqual(self.calls[1], (0.3, 3.0, 7 / 3.0))
+
+    def test_moving_average(self):
+        """Test the throughput is smoothed with the latest measurement weighted by smoothing."""
+        progress = Progress(10, [self.sink], interval=0, smoothing=0.5)
+        self.clock.now += 1
+        progress.update_progress(2)
+        self.assertEqual(progress.rate, 2.0)
+        self.clock.now += 1
+        progress.update_progress(4)
+        self.assertEqual(progress.rate, 3.0)
+        self.assertAlmostEqual(progress.eta, 4 / 3.0)
+        self.assertAlmostEqual(self.calls[-1][0], 0.6)
+
+    def test_steps(self):
+        """Test the total is operations * steps."""
+        progress = Progress(2, [self.sink], interval=0)
+        progress.steps = 100
+        self.clock.now += 1
+        progress.update_progress(50)
+        self.assertEqual(self.calls[-1], (0.25, 50.0, 3.0))
+
+    def test_completion(self):
+        """Test completion is notified once even within the interval."""
+        progress = Progress(2, [self.sink], interval=10)
+        progress.update_progress()
+        progress.update_progress()
+        self.clock.now += 20
+        progress.update_progress()
+        self.assertEqual([c[0] for c in self.calls], [0.0, 1.0])
+
+    def test_disabled(self):
+        """Test nothing is notified without operations."""
+        progress = Progress(0, [self.sink], interval=0)
+        progress.update_progress()
+        self.assertEqual(self.calls, [])
+
+    def test_callback(self):
+        """Test the GDAL callback is rate limited, except on completion, and never cancels."""
+        progress = Progress(1, [self.sink], interval=1.0)
+        self.assertEqual(progress.callback(0.5), 1)
+        self.clock.now += 1
+        progress.callback(0.6)
+        progress.callback(1.0)
+        self.assertEqual(self.calls[1:], [(0.6, None, None), (1.0, None, None)])
+
+    def test_sinks(self):
+        """Test the progress text and the logging sink."""
+        self.assertEqual(format_progress(0.42, 1.3e6, 12), '42% 1.3e+06/s ETA 0:00:12')
+        self.assertEqual(format_progress(1.0, None, 3725), '100% ETA 1:02:05')
+        handler = ListHandler()
+        logger = logging.getLogger('test_progress')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        progress = Progress(4, [LogSink(logger)], interval=0)
+        self.clock.now += 2
+        progress.update_progress()
+        logger.removeHandler(handler)
+        self.assertEqual(handler.messages, ['0%', '25% 0.5/s ETA 0:00:06'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProgressTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,103 @@
+# coding=utf-8
+"""Dataset reductions test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ArrayDataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+
+REDUCTIONS = ['max', 'mean', 'min', 'ptp', 'std', 'sum', 'var']
+NODATA = -9999
+
+
+class ReductionsTest(unittest.TestCase):
+    """Test reductions combined block by block give the numpy reductions of the whole array."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.env = Env.tiled, Env.nodata, Env.nthreads
+        Env.tiled = True
+        random = numpy.random.RandomState(0)
+        self.floats = random.gamma(0.5, 5, (300, 200)).astype(numpy.float32)
+        self.ints = random.randint(-1000, 1000, (300, 200)).astype(numpy.int32)
+
+    def tearDown(self):
+        """Runs after each test."""
+        Env.tiled, Env.nodata, Env.nthreads = self.env
+
+    def dataset(self, array):
+        return ArrayDataset(array, extent=[0, 0, array.shape[1], array.shape[0]], nodata=[NODATA])
+
+    def assert_reductions(self, array, expected=None, **kwargs):
+        """Check each reduction of a dataset of the array against numpy (of expected if given)."""
+        ds = self.dataset(array)
+        if expected is None:
+            expected = array
+        for attr in REDUCTIONS:
+            args = kwargs if attr in ('std', 'var') else {}
+            value = getattr(ds, attr)(**args)
+            # Block statistics are accumulated in float64, as numpy does for the mean/std/var of floats
+            numpy.testing.assert_allclose(value, getattr(expected.astype(numpy.float64), attr)(**args), rtol=1e-7,
+                                          err_msg=attr)
+            if attr in ('min', 'max', 'ptp'):
+                self.assertEqual(value, getattr(expected, attr)(), attr)
+
+    def test_float(self):
+        """Test the reductions of a float dataset."""
+        self.assert_reductions(self.floats)
+
+    def test_int(self):
+        """Test integer sums are exact integers."""
+        self.assert_reductions(self.ints)
+        self.assertEqual(self.dataset(self.ints).sum(), int(self.ints.astype(numpy.int64).sum()))
+
+    def test_ddof(self):
+        """Test std and var with ddof=1."""
+        self.assert_reductions(self.floats, ddof=1)
+
+    def test_threads(self):
+        """Test blocks processed by a pool of threads give the same reductions."""
+        Env.nthreads = 4
+        self.assert_reductions(self.floats)
+        self.assert_reductions(self.ints)
+
+    def test_nodata(self):
+        """Test nodata is counted like any value, or excluded as by masked arrays when Env.nodata is set."""
+        self.ints[::5, ::3] = NODATA
+        self.assert_reductions(self.ints)
+        Env.nodata = True
+        self.assert_reductions(self.ints, numpy.ma.masked_equal(self.ints, NODATA).compressed())
+
+    def test_nan(self):
+        """Test NaNs make every reduction NaN, as in numpy."""
+        self.floats[10, 20] = numpy.nan
+        ds = self.dataset(self.floats)
+        for attr in REDUCTIONS:
+            self.assertTrue(numpy.isnan(getattr(ds, attr)()), attr)
+            self.assertTrue(numpy.isnan(getattr(self.floats, attr)()), attr)
+
+    def test_all_nodata(self):
+        """Test reductions of only nodata are masked with Env.nodata."""
+        Env.nodata = True
+        ds = self.dataset(numpy.zeros((30, 20), numpy.int32) + NODATA)
+        for attr in REDUCTIONS:
+            self.assertIs(getattr(ds, attr)(), numpy.ma.masked, attr)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ReductionsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
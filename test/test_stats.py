@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Single pass band statistics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Statistics
+
+
+class StatisticsTest(unittest.TestCase):
+    """Test statistics collected block by block."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.data = numpy.random.RandomState(0).gamma(0.5, 5, (400, 1440)).astype(numpy.float32)
+        self.data[::7, ::3] = -9999.9
+        self.valid = self.data[self.data != numpy.float32(-9999.9)].astype(numpy.float64)
+
+    def test_blockwise(self):
+        """Test block updates match statistics of the whole array."""
+        stats = Statistics(nodata=numpy.float32(-9999.9))
+        for y in range(0, 400, 128):
+            stats.update(self.data[y:y + 128])
+        self.assertEqual(stats.count, self.valid.size)
+        self.assertAlmostEqual(stats.min, self.valid.min())
+        self.assertAlmostEqual(stats.max, self.valid.max())
+        self.assertAlmostEqual(stats.mean, self.valid.mean(), places=6)
+        self.assertAlmostEqual(stats.std, self.valid.std(), places=6)
+        hmin, hmax, counts = stats.histogram()
+        self.assertEqual(sum(counts), self.valid.size)
+        self.assertLessEqual(hmin, self.valid.min())
+        self.assertGreaterEqual(hmax, self.valid.max())
+
+    def test_merge(self):
+        """Test merging partial statistics."""
+        stats1 = Statistics(nodata=numpy.float32(-9999.9))
+        stats2 = Statistics(nodata=numpy.float32(-9999.9))
+        stats1.update(self.data[:200])
+        stats2.update(self.data[200:])
+        stats1.merge(stats2)
+        self.assertEqual(stats1.count, self.valid.size)
+        self.assertAlmostEqual(stats1.mean, self.valid.mean(), places=6)
+        self.assertAlmostEqual(stats1.std, self.valid.std(), places=6)
+        self.assertEqual(sum(stats1.histogram()[2]), self.valid.size)
+
+    def test_moments_only(self):
+        """Test sum and variance without a histogram."""
+        stats = Statistics(nodata=numpy.float32(-9999.9), buckets=0)
+        for y in range(0, 400, 128):
+            stats.update(self.data[y:y + 128])
+        self.assertIsNone(stats.histogram())
+        self.assertAlmostEqual(stats.sum / self.valid.sum(), 1.0, places=9)
+        self.assertAlmostEqual(stats.var_ddof(1), self.valid.var(ddof=1), places=5)
+
+    def test_nan(self):
+        """Test NaNs are excluded and counted, also when merged."""
+        self.data[1, :10] = numpy.nan
+        stats1 = Statistics(nodata=numpy.float32(-9999.9))
+        stats2 = Statistics(nodata=numpy.float32(-9999.9))
+        stats1.update(self.data[:200])
+        stats2.update(self.data[200:])
+        stats1.merge(stats2)
+        valid = self.data[(self.data != numpy.float32(-9999.9)) & ~numpy.isnan(self.data)].astype(numpy.float64)
+        self.assertEqual(stats1.nans, 10)
+        self.assertEqual(stats1.count, valid.size)
+        self.assertAlmostEqual(stats1.mean, valid.mean(), places=6)
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(StatisticsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
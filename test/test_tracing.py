@@ -0,0 +1,101 @@
+# coding=utf-8
+"""Tracing spans test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import json
+import os
+import unittest
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Tracer
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+# Slack for the float microseconds of the trace
+SLACK = 1e-3
+
+
+class TracerTest(SyntheticLayersTestCase):
+    """Test the spans of a calculation are exported as nested Chrome trace events."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.env = Env.trace, Env.tiled, Env.overwrite
+        Env.trace, Env.tiled, Env.overwrite = True, True, True
+        Tracer.clear()
+        self.a = Dataset(self.create_layer('a.tif', seed=1))
+        self.b = Dataset(self.create_layer('b.tif', seed=2))
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.a, self.b = None, None
+        Env.trace, Env.tiled, Env.overwrite = self.env
+        Tracer.clear()
+        SyntheticLayersTestCase.tearDown(self)
+
+    def export(self):
+        """Export the spans and load the trace events."""
+        path = self.path('trace.json')
+        Tracer.export_chrome(path)
+        with open(path) as f:
+            trace = json.load(f)
+        return trace['traceEvents']
+
+    def assert_within(self, event, parent):
+        self.assertGreaterEqual(event['ts'], parent['ts'] - SLACK)
+        self.assertLessEqual(event['ts'] + event['dur'], parent['ts'] + parent['dur'] + SLACK)
+
+    def test_export_chrome(self):
+        """Test the complete events of the reads, operations and writes of each block, inside the calculation."""
+        with Tracer.span('calculation'):
+            (self.a + self.b).save(self.path('sum.tif'))
+        events = self.export()
+        names = [e['name'] for e in events]
+        for name in ('calculation', 'apply_environment', 'read', 'op', 'write', 'create_temporary', 'save'):
+            self.assertTrue(name in names, name)
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['pid'], os.getpid())
+            self.assertGreaterEqual(event['ts'], 0)
+            self.assertGreaterEqual(event['dur'], 0)
+        calculation = events[names.index('calculation')]
+        self.assertEqual(calculation['ts'], 0)
+        for event in events:
+            self.assert_within(event, calculation)
+
+        # Each block is read from both inputs, then added and written
+        blocks = [e for e in events if e['name'] in ('read', 'op', 'write')]
+        self.assertEqual(names.count('read'), 2 * names.count('write'))
+        self.assertEqual(names.count('op'), names.count('write'))
+        for i in range(0, len(blocks), 4):
+            self.assertEqual([e['name'] for e in blocks[i:i + 4]], ['read', 'read', 'op', 'write'])
+            for previous, event in zip(blocks[i:i + 3], blocks[i + 1:i + 4]):
+                self.assertLessEqual(previous['ts'] + previous['dur'], event['ts'] + SLACK)
+        self.assertEqual(sum(e['args']['pixels'] for e in blocks if e['name'] == 'write'),
+                         synthetic.COLS * synthetic.ROWS)
+        self.assertGreater(events[names.index('save')]['ts'], blocks[-1]['ts'])
+
+    def test_disabled(self):
+        """Test nothing is recorded unless Env.trace is set."""
+        Env.trace = False
+        with Tracer.span('calculation'):
+            self.a + self.b
+        self.assertEqual(self.export(), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TracerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
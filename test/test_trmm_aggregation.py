@@ -0,0 +1,108 @@
+# coding=utf-8
+"""TRMM aggregation test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import datetime
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ArrayDataset
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import aggregate_daily
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import daily_operations
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_aggregation import RollingWindow
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class AggregateDailyTest(SyntheticLayersTestCase):
+    """Test the daily aggregates include all the 3-hourly layers of the day."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.layers = synthetic.create_day(self.path('layers'), datetime.date(2015, 7, 31))
+        self.data = numpy.array([self.read(layer) for layer in self.layers], dtype=numpy.float64)
+
+    def test_sum(self):
+        """Test the SUM is the sum of the 8 layers, the last one included."""
+        self.assertEqual(len(self.layers), 8)
+        total = aggregate_daily(self.layers + [l.replace('.tif', '.tfw') for l in self.layers], 'SUM')
+        data = total.ReadAsArray()
+        numpy.testing.assert_allclose(data, self.data.sum(axis=0), rtol=1e-5)
+        self.assertFalse(numpy.allclose(data, self.data[:-1].sum(axis=0), rtol=1e-5))
+
+    def test_avg(self):
+        """Test the AVG is the mean of the 8 layers."""
+        numpy.testing.assert_allclose(aggregate_daily(self.layers, 'AVG').ReadAsArray(), self.data.mean(axis=0),
+                                      rtol=1e-5)
+
+    def test_operations(self):
+        """Test the operations counted for the progress."""
+        self.assertEqual(daily_operations(self.layers, 'SUM'), 7)
+        self.assertEqual(daily_operations(self.layers, 'AVG'), 8)
+        self.assertEqual(daily_operations([], 'AVG'), 0)
+
+
+class RollingWindowTest(unittest.TestCase):
+    """Test the running total is the sum of the days in the window, without drifting."""
+
+    def setUp(self):
+        """Runs before each test."""
+        random = numpy.random.RandomState(0)
+        # Large totals with small decimals, so float32 rounding shows up
+        self.days = random.gamma(0.5, 500, (100, 40, 50)).astype(numpy.float32)
+
+    def daily(self, i):
+        return ArrayDataset(self.days[i], extent=[0, 0, 50, 40])
+
+    def test_window(self):
+        """Test the total of each full window is the sum of its days, and None before."""
+        rolling = RollingWindow(3)
+        for i in range(10):
+            total = rolling.push(self.daily(i))
+            if i < 2:
+                self.assertIsNone(total)
+            else:
+                expected = self.days[i - 2:i + 1].astype(numpy.float64).sum(axis=0)
+                numpy.testing.assert_allclose(total.ReadAsArray(), expected, rtol=1e-5)
+
+    def test_drift(self):
+        """Test the error of the total against a fresh sum stays bounded by the resync."""
+        days = 7
+        rolling = RollingWindow(days)
+        errors = []
+        for i in range(len(self.days)):
+            total = rolling.push(self.daily(i))
+            if total is not None:
+                expected = self.days[i - days + 1:i + 1].astype(numpy.float64).sum(axis=0)
+                errors.append(numpy.abs(total.ReadAsArray() - expected).max() / expected.max())
+        # At most 2 * days float32 additions since the last resync
+        self.assertLess(max(errors), 2 * days * numpy.finfo(numpy.float32).eps)
+
+    def test_snapshot(self):
+        """Test the returned total is updated by the next push, a snapshot is not."""
+        rolling = RollingWindow(2)
+        self.assertIsNone(rolling.snapshot())
+        rolling.push(self.daily(0))
+        total = rolling.push(self.daily(1))
+        snapshot = rolling.snapshot()
+        self.assertIs(rolling.push(self.daily(2)), total)
+        numpy.testing.assert_allclose(snapshot.ReadAsArray(), self.days[0] + self.days[1], rtol=1e-6)
+        numpy.testing.assert_allclose(total.ReadAsArray(), self.days[1] + self.days[2], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(AggregateDailyTest), unittest.makeSuite(RollingWindowTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""Climatology baseline and anomaly test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import datetime
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_climatology import Climatology
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_climatology import NODATA
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class ClimatologyTest(SyntheticLayersTestCase):
+    """Test the baseline and the anomalies of synthetic daily totals."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.layers = {}
+        for year in (2013, 2014, 2015):
+            d = datetime.date(year, 7, 31)
+            self.layers[d] = self.create_layer('%s_SUM.tif' % d, seed=year)
+        data = numpy.array([self.read(self.layers[d]) for d in sorted(self.layers)])
+        # Nodata is compared in Float32, as stored in the layers
+        self.valid = numpy.ma.MaskedArray(data.astype(numpy.float64), data == numpy.float32(synthetic.NODATA))
+        self.climatology = Climatology(self.path('climatology'))
+        self.climatology.build(self.layers)
+
+    def test_baseline(self):
+        """Test the mean and std of the baseline match numpy on the valid pixels."""
+        statistics = self.climatology.statistics('DAY', datetime.date(2015, 7, 31))
+        window = (0, 0, synthetic.COLS, synthetic.ROWS)
+        numpy.testing.assert_array_equal(statistics.read('COUNT', window), self.valid.count(axis=0))
+        numpy.testing.assert_allclose(statistics.read('MEAN', window), self.valid.mean(axis=0).filled(0), atol=1e-9)
+        numpy.testing.assert_allclose(statistics.read_std(window), self.valid.std(axis=0).filled(0), atol=1e-9)
+
+    def test_anomaly(self):
+        """Test the anomaly of a day is the difference from the mean and nodata stays nodata."""
+        d = datetime.date(2015, 7, 31)
+        anomaly = self.climatology.anomaly(self.layers[d], 'DAY', d)
+        data = anomaly.ReadAsArray()
+        expected = (self.valid[-1] - self.valid.mean(axis=0)).astype(numpy.float32).filled(NODATA)
+        numpy.testing.assert_allclose(data, expected, atol=1e-3)
+        self.assertTrue((data[self.valid.mask[-1]] == NODATA).all())
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ClimatologyTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
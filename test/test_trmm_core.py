@@ -0,0 +1,108 @@
+# coding=utf-8
+"""TRMM product selection test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import datetime
+import unittest
+
+from osgeo import gdal
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Progress
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core import trmm_core
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_core import resolve_products
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class ResolveProductsTest(unittest.TestCase):
+    """Test one version of each timestamp is selected."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.listing = ['3B42.20150731.00.7.tfw', '3B42.20150731.00.7.tif',
+                        '3B42.20150731.00.7A.tfw', '3B42.20150731.00.7A.tif',
+                        '3B42.20150731.03.7.tfw', '3B42.20150731.03.7.tif',
+                        '3B42.20150731.03.7.tif.aux.xml', '3B42.20150731.06.6.tif', 'README']
+
+    def test_preferred_version(self):
+        """Test 7A is preferred and only the .tif and .tfw are selected."""
+        self.assertEqual(resolve_products(self.listing),
+                         ['3B42.20150731.00.7A.tif', '3B42.20150731.00.7A.tfw',
+                          '3B42.20150731.03.7.tif', '3B42.20150731.03.7.tfw'])
+
+    def test_policy(self):
+        """Test a custom order of preference."""
+        self.assertEqual(resolve_products(self.listing, ['7']),
+                         ['3B42.20150731.00.7.tif', '3B42.20150731.00.7.tfw',
+                          '3B42.20150731.03.7.tif', '3B42.20150731.03.7.tfw'])
+
+    def test_missing_world_file(self):
+        """Test a layer is selected without its .tfw when it is not listed."""
+        self.assertEqual(resolve_products(['3B42.20150731.03.7.tif']), ['3B42.20150731.03.7.tif'])
+
+
+class FailingFTP(synthetic.LocalFTP):
+    """LocalFTP running out of memory on the second layer."""
+
+    quits = 0
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        if self.retrieved:
+            raise MemoryError()
+        return synthetic.LocalFTP.retrbinary(self, command, callback, blocksize, rest)
+
+    def quit(self):
+        FailingFTP.quits += 1
+        return synthetic.LocalFTP.quit(self)
+
+
+class StreamLayersTest(SyntheticLayersTestCase):
+    """Test a failed in memory download frees the layers and closes the connection."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.date = datetime.date(2015, 7, 31)
+        synthetic.create_ftp_tree(self.folder, trmm_core.conf['source']['ftp']['data_dir'], [self.date])
+        FailingFTP.root = self.folder
+        FailingFTP.quits = 0
+        self.ftp, trmm_core.FTP = trmm_core.FTP, FailingFTP
+
+    def tearDown(self):
+        """Runs after each test."""
+        trmm_core.FTP = self.ftp
+        SyntheticLayersTestCase.tearDown(self)
+
+    def test_failure(self):
+        """Test nothing is left in /vsimem after a failure."""
+        self.assertRaises(MemoryError, trmm_core.stream_layers, 'user', 'password', 2015, 7, 31)
+        self.assertEqual(FailingFTP.quits, 1)
+        self.assertIsNone(gdal.VSIStatL('/vsimem/trmm/2015/07/31/3B42.20150731.00.7.tif'))
+
+    def test_progress(self):
+        """Test the download progress is in bytes, from the sizes reported by the FTP."""
+        synthetic.LocalFTP.root = self.folder
+        trmm_core.FTP = synthetic.LocalFTP
+        progress = Progress(0, [], interval=0)
+        layers = trmm_core.stream_layers('user', 'password', 2015, 7, 31, progress=progress)
+        try:
+            size = sum(gdal.VSIStatL(l).size for l in layers)
+        finally:
+            trmm_core.release_layers(layers)
+        self.assertEqual(progress.operations, size)
+        self.assertEqual(progress.progress, size)
+        self.assertEqual(progress.fraction, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Point and zonal time series extraction test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import csv
+import json
+import math
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_extraction import extract_vector
+from test.benchmarks import synthetic
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+MERCATOR = {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:EPSG::3857'}}
+
+
+class ExtractionTest(SyntheticLayersTestCase):
+    """Test values at points and zonal statistics of a synthetic layer."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.layer = self.create_layer('3B42.20150731.00.7.tif')
+        self.data = self.read(self.layer)
+        self.nodata = self.data == numpy.float32(synthetic.NODATA)
+        rows, cols = numpy.nonzero(self.nodata[1:-2, 1:-2])
+        # A nodata cell, and the valid cell on its right or below
+        self.row, self.col = int(rows[0]) + 1, int(cols[0]) + 1
+        self.valid = [(r, c) for r, c in ((self.row, self.col + 1), (self.row + 1, self.col)) if not self.nodata[r, c]][0]
+
+    def cell(self, row, col):
+        """Longitude and latitude of the top left corner of a cell."""
+        return -180.0 + col * 0.25, 50.0 - row * 0.25
+
+    def write_vector(self, name, features, crs=None):
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'ID': i}, 'geometry': g} for i, g in features]}
+        if crs is not None:
+            collection['crs'] = crs
+        return self.write(name, json.dumps(collection))
+
+    def read_csv(self, path):
+        with open(path, 'rb') as f:
+            return list(csv.DictReader(f))
+
+    def extract_points(self, project):
+        points = []
+        for i, (row, col) in (('nodata', (self.row, self.col)), ('valid', self.valid)):
+            x, y = self.cell(row, col)
+            x, y = x + 0.125, y - 0.125
+            if project:
+                x, y = 6378137 * math.radians(x), 6378137 * math.log(math.tan(math.pi / 4 + math.radians(y) / 2))
+            points.append((i, {'type': 'Point', 'coordinates': [x, y]}))
+        vector = self.write_vector('points.geojson', points, MERCATOR if project else None)
+        output = self.path('points.csv')
+        extract_vector([self.layer], vector, 'ID', output)
+        return dict((r['id'], r['value']) for r in self.read_csv(output))
+
+    def test_points(self):
+        """Test nodata is empty and valid values are the cell values."""
+        values = self.extract_points(False)
+        self.assertEqual(values['nodata'], '')
+        self.assertAlmostEqual(float(values['valid']), float(self.data[self.valid]), places=4)
+
+    def test_projected_points(self):
+        """Test points in another coordinate system are reprojected."""
+        self.assertEqual(self.extract_points(True), self.extract_points(False))
+
+    def test_zonal(self):
+        """Test zonal statistics skip nodata and polygons smaller than a cell get the cell they touch."""
+        x, y = self.cell(self.row, self.col)
+        square = [[x, y], [x + 0.5, y], [x + 0.5, y - 0.5], [x, y - 0.5], [x, y]]
+        x, y = self.cell(*self.valid)
+        tiny = [[x + 0.01, y - 0.01], [x + 0.06, y - 0.01], [x + 0.06, y - 0.06], [x + 0.01, y - 0.06], [x + 0.01, y - 0.01]]
+        vector = self.write_vector('zones.geojson', [('square', {'type': 'Polygon', 'coordinates': [square]}),
+                                                     ('tiny', {'type': 'Polygon', 'coordinates': [tiny]})])
+        output = self.path('zones.csv')
+        extract_vector([self.layer], vector, 'ID', output)
+        zones = dict((r['zone'], r) for r in self.read_csv(output))
+        block = self.data[self.row:self.row + 2, self.col:self.col + 2]
+        valid = block[block != numpy.float32(synthetic.NODATA)].astype(numpy.float64)
+        self.assertEqual(float(zones['square']['count']), len(valid))
+        self.assertAlmostEqual(float(zones['square']['mean']), valid.mean(), places=4)
+        self.assertAlmostEqual(float(zones['square']['min']), valid.min(), places=4)
+        self.assertEqual(float(zones['tiny']['count']), 1)
+        self.assertAlmostEqual(float(zones['tiny']['mean']), float(self.data[self.valid]), places=4)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ExtractionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Job journal test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import os
+import unittest
+
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_journal import Journal
+from utilities import TemporaryFolderTestCase
+
+
+class JournalTest(TemporaryFolderTestCase):
+    """Test dates are only processed again when something changed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        TemporaryFolderTestCase.setUp(self)
+        self.filename = self.path('trmm_journal.json')
+        self.layer = self.write('3B42.20150731.00.7.tif', 'layer')
+        self.output = self.write('2015_07_31_SUM.tif', 'sum')
+        self.parameters = {'aggregation': 'SUM', 'versions': ['7A', '7']}
+
+    def test_resume(self):
+        """Test a recorded date is up to date in a new run."""
+        Journal(self.filename).record('2015-07-31_SUM', self.parameters, [self.layer, '/vsimem/x.tif'], self.output)
+        journal = Journal(self.filename)
+        self.assertTrue(journal.is_current('2015-07-31_SUM', self.parameters))
+        self.assertFalse(journal.is_current('2015-08-01_SUM', self.parameters))
+        self.assertFalse(journal.is_current('2015-07-31_SUM', {'aggregation': 'AVG', 'versions': ['7A', '7']}))
+        self.assertEqual(journal.output('2015-07-31_SUM'), self.output)
+        self.assertIsNone(journal.output('2015-07-31_AVG'))
+
+    def test_changes(self):
+        """Test changed inputs or outputs are processed again."""
+        journal = Journal(self.filename)
+        journal.record('2015-07-31_SUM', self.parameters, [self.layer], self.output)
+        self.write('3B42.20150731.00.7.tif', 'new layer')
+        self.assertFalse(journal.is_current('2015-07-31_SUM', self.parameters))
+        journal.record('2015-07-31_SUM', self.parameters, [self.layer], self.output)
+        os.remove(self.output)
+        self.assertFalse(journal.is_current('2015-07-31_SUM', self.parameters))
+
+    def test_interrupted(self):
+        """Test a truncated last line is dropped and repeated dates are compacted."""
+        journal = Journal(self.filename)
+        for i in range(3):
+            journal.record('2015-07-31_SUM', self.parameters, [self.layer], self.output)
+        with open(self.filename, 'a') as f:
+            f.write('{"key": "2015-08-01_SUM", "param')
+        journal = Journal(self.filename)
+        self.assertEqual(sorted(journal.entries), ['2015-07-31_SUM'])
+        with open(self.filename) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertTrue(journal.is_current('2015-07-31_SUM', self.parameters))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(JournalTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
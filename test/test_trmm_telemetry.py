@@ -0,0 +1,58 @@
+# coding=utf-8
+"""Download telemetry test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import json
+import unittest
+
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_telemetry import latency_summary
+from geobricks_qgis_plugin_trmm_libs.geobricks_trmm.core.trmm_telemetry import Telemetry
+from utilities import TemporaryFolderTestCase
+
+
+class TelemetryTest(TemporaryFolderTestCase):
+    """Test the counters, latencies and JSON report of a run."""
+
+    def test_latency_summary(self):
+        """Test percentiles and histogram buckets."""
+        summary = latency_summary([0.2, 0.02, 3.0, 0.005, 60.0])
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['min'], 0.005)
+        self.assertEqual(summary['p50'], 0.2)
+        self.assertEqual(summary['max'], 60.0)
+        self.assertEqual(sum(h['count'] for h in summary['histogram']), 5)
+        self.assertEqual(summary['histogram'][0], {'le': 0.01, 'count': 1})
+        self.assertEqual(summary['histogram'][-1], {'le': None, 'count': 1})
+
+    def test_report(self):
+        """Test transfers and counters are saved in the JSON report."""
+        telemetry = Telemetry()
+        with telemetry.timer('ftp_login'):
+            pass
+        telemetry.add_transfer('3B42.20150731.00.7.tif', 2 * 1024 ** 2, 2.0)
+        telemetry.count('retries')
+        telemetry.count('files_skipped', 3)
+        telemetry.save(self.path('report.json'))
+        with open(self.path('report.json')) as f:
+            report = json.load(f)
+        self.assertEqual(report['counters'], {'bytes_downloaded': 2 * 1024 ** 2, 'files_downloaded': 1,
+                                              'files_skipped': 3, 'retries': 1})
+        self.assertAlmostEqual(report['throughput_mb_s'], 1.0)
+        self.assertEqual(report['latencies']['ftp_login']['count'], 1)
+        self.assertEqual(len(report['transfers']), 1)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TelemetryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
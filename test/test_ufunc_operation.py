@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Tiled ufunc operations test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import operator
+import unittest
+
+import numpy
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ArrayDataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from test.benchmarks.benchmark_operation import create_raster
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class UfuncOperationTest(SyntheticLayersTestCase):
+    """Test operations evaluated into reused buffers equal the block by block operations."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.env = Env.tiled, Env.nodata
+        Env.tiled, Env.nodata = True, False
+        # Tiled, with partial blocks on the right and at the bottom
+        self.a = Dataset(create_raster(self.path('a.tif'), seed=0))
+        self.b = Dataset(create_raster(self.path('b.tif'), seed=1))
+
+    def tearDown(self):
+        """Runs after each test."""
+        Env.tiled, Env.nodata = self.env
+        self.a = self.b = None
+        SyntheticLayersTestCase.tearDown(self)
+
+    def assert_operation(self, op, other, swapped=False):
+        """Check the ufunc path against __operation__ with a single block (no ufunc path)."""
+        result = self.a.__operation__(op, other, swapped)
+        Env.tiled = False
+        try:
+            expected = self.a.__operation__(op, other, swapped)
+        finally:
+            Env.tiled = True
+        self.assertEqual(result._data_type, expected._data_type)
+        numpy.testing.assert_array_equal(result.ReadAsArray(), expected.ReadAsArray())
+
+    def test_datasets(self):
+        """Test arithmetic and comparisons of two datasets, also with swapped operands."""
+        for op in (operator.add, operator.sub, operator.mul, operator.truediv, operator.gt):
+            self.assert_operation(op, self.b)
+            self.assert_operation(op, self.b, swapped=True)
+
+    def test_scalar(self):
+        """Test operations with a number, on either side."""
+        for op in (operator.add, operator.sub, operator.mul, operator.le):
+            self.assert_operation(op, 2)
+            self.assert_operation(op, 2, swapped=True)
+        numpy.testing.assert_array_equal((2 - self.a).ReadAsArray(), 2 - self.a.ReadAsArray())
+
+    def test_multiband(self):
+        """Test multiband blocks written with the WriteArray fallback."""
+        array = numpy.random.RandomState(0).rand(300, 200, 3).astype(numpy.float32)
+        ds = ArrayDataset(array, extent=[0, 0, 200, 300])
+        result = ds * 2
+        self.assertEqual(result._nbands, 3)
+        numpy.testing.assert_array_equal(result.ReadAsArray(), numpy.rollaxis(array, 2) * 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(UfuncOperationTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
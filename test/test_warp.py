@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Warped dataset test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+from osgeo import gdal
+from osgeo import osr
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Env
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import WarpedDataset
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class WarpTest(SyntheticLayersTestCase):
+    """Test the warped VRT and the in memory warp match AutoCreateWarpedVRT and gdal.Warp."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.warpinmemory = Env.warpinmemory
+        self.layer = self.create_layer('3B42.20150731.00.7.tif')
+        self.ds = Dataset(self.layer)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(3857)
+        self.mercator = srs.ExportToWkt()
+
+    def tearDown(self):
+        """Runs after each test."""
+        Env.warpinmemory = self.warpinmemory
+        self.ds = None
+        SyntheticLayersTestCase.tearDown(self)
+
+    def warp(self, warped, wkt):
+        """Warp the layer with gdal.Warp to the grid of a WarpedDataset."""
+        gt = warped._gt
+        bounds = [gt[0], gt[3] + warped._y_size * gt[5], gt[0] + warped._x_size * gt[1], gt[3]]
+        nodata = self.ds._nodata[0]
+        ds = gdal.Warp('', self.layer, format='MEM', width=warped._x_size, height=warped._y_size,
+                       outputBounds=bounds, dstSRS=wkt, srcNodata=nodata, dstNodata=nodata, resampleAlg='near')
+        return ds.ReadAsArray()
+
+    def warped(self, wkt, snap_cellsize=None):
+        """
+        Warp the layer with a warped VRT and in memory, check both against gdal.Warp.
+        @return: The WarpedDatasets.
+        """
+        datasets = []
+        for warpinmemory, driver in ((0, 'VRT'), (10 ** 9, 'MEM')):
+            Env.warpinmemory = warpinmemory
+            warped = WarpedDataset(self.ds, wkt, self.ds if snap_cellsize else None, snap_cellsize)
+            self.assertEqual(warped._dataset.GetDriver().ShortName, driver)
+            numpy.testing.assert_array_equal(warped.ReadAsArray(), self.warp(warped, wkt))
+            datasets.append(warped)
+        vrt, mem = datasets
+        self.assertEqual((vrt._x_size, vrt._y_size), (mem._x_size, mem._y_size))
+        numpy.testing.assert_allclose(vrt._gt, mem._gt)
+        return datasets
+
+    def test_reprojection(self):
+        """Test a reprojection has the grid suggested by AutoCreateWarpedVRT."""
+        src = gdal.Open(self.layer)
+        auto = gdal.AutoCreateWarpedVRT(src, src.GetProjection(), self.mercator, gdal.GRA_NearestNeighbour)
+        for warped in self.warped(self.mercator):
+            self.assertEqual((warped._x_size, warped._y_size), (auto.RasterXSize, auto.RasterYSize))
+            numpy.testing.assert_allclose(warped._gt, auto.GetGeoTransform(), rtol=1e-9)
+
+    def test_cellsize(self):
+        """Test a cellsize change snapped to the grid of the layer."""
+        for warped in self.warped(self.ds._srs, (0.5, 0.5)):
+            self.assertEqual((warped._x_size, warped._y_size), (self.ds._x_size / 2, self.ds._y_size / 2))
+            numpy.testing.assert_allclose(warped._gt, (-180.0, 0.5, 0.0, 50.0, 0.0, -0.5))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(WarpTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
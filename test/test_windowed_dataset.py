@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Windowed dataset test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@geobricks.org'
+__date__ = '2015-10-06'
+__copyright__ = 'Copyright 2015, Geobricks'
+
+import unittest
+
+import numpy
+from osgeo import gdal
+
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import ClippedDataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import Dataset
+from geobricks_qgis_plugin_trmm_libs.gdal_calculations import WindowedDataset
+from test.benchmarks.synthetic import SyntheticLayersTestCase
+
+
+class WindowedDatasetTest(SyntheticLayersTestCase):
+    """Test windows read the same grid and values as the VRT of a ClippedDataset."""
+
+    def setUp(self):
+        """Runs before each test."""
+        SyntheticLayersTestCase.setUp(self)
+        self.ds = Dataset(self.create_layer('3B42.20150731.00.7.tif'))
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.ds = None
+        SyntheticLayersTestCase.tearDown(self)
+
+    def assert_clipped(self, window):
+        """Check a window against the ClippedDataset of its extent."""
+        self.assertTrue(isinstance(window, WindowedDataset))
+        clipped = ClippedDataset(self.ds, window.extent)
+        self.assertEqual((window._x_size, window._y_size), (clipped._x_size, clipped._y_size))
+        numpy.testing.assert_allclose(window._gt, clipped._gt)
+        numpy.testing.assert_array_equal(window.ReadAsArray(), clipped.ReadAsArray())
+        return clipped
+
+    def test_inside(self):
+        """Test a window inside the dataset."""
+        self.assert_clipped(self.ds.window(100, 50, 400, 200))
+
+    def test_partial_overlap(self):
+        """Test a window partly outside the dataset is padded with nodata."""
+        window = self.ds.clip_to_extent([-185.0, 30.0, -170.0, 52.0])
+        self.assertEqual((window._x_off, window._y_off), (-20, -8))
+        data = self.assert_clipped(window).ReadAsArray()
+        self.assertTrue((data[:8] == numpy.float32(self.ds._nodata[0])).all())
+
+    def test_window_of_window(self):
+        """Test a window of a window reads the parent directly."""
+        window = self.ds.window(100, 50, 400, 200).window(10, 20, 30, 40)
+        self.assertIs(window._parentds, self.ds)
+        self.assertEqual((window._x_off, window._y_off), (110, 70))
+        self.assert_clipped(window)
+
+    def test_buffer(self):
+        """Test reads into a buffer, inside and partly outside the dataset."""
+        for window in (self.ds.window(100, 50, 400, 200), self.ds.clip_to_extent([-185.0, 30.0, -170.0, 52.0])):
+            buf = numpy.empty((window._y_size, window._x_size), numpy.float32)
+            self.assertIs(window.ReadAsArray(buf_obj=buf), buf)
+            numpy.testing.assert_array_equal(buf, ClippedDataset(self.ds, window.extent).ReadAsArray())
+
+    def test_rotated(self):
+        """Test a rotated grid is clipped with a VRT, windows can't be mapped to its pixels."""
+        path = self.path('rotated.tif')
+        ds = gdal.GetDriverByName('GTiff').Create(path, 100, 100, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((0.0, 1.0, 0.1, 100.0, 0.1, -1.0))
+        ds.GetRasterBand(1).WriteArray(numpy.arange(10000, dtype=numpy.float32).reshape(100, 100))
+        ds = None
+        clipped = Dataset(path).clip_to_extent([10.0, 10.0, 50.0, 50.0])
+        self.assertTrue(isinstance(clipped, ClippedDataset))
+        self.assertFalse(isinstance(clipped, WindowedDataset))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(WindowedDatasetTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -1,8 +1,12 @@
 # coding=utf-8
 """Common functionality used by regression tests."""
 
+import os
+import shutil
 import sys
 import logging
+import tempfile
+import unittest
 
 
 LOGGER = logging.getLogger('QGIS')
@@ -59,3 +63,28 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+class TemporaryFolderTestCase(unittest.TestCase):
+    """Base class of the tests writing files, in a folder removed after each test."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def path(self, name):
+        """Path of a file in the test folder."""
+        return os.path.join(self.folder, name)
+
+    def write(self, name, data):
+        """Write a file in the test folder.
+        :returns: Its path.
+        """
+        path = self.path(name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path